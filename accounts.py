@@ -0,0 +1,73 @@
+import os
+import json
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# 当前线程 / 任务正在处理的账号；为空时所有配置都从环境变量读取 (单账号模式)
+_current = ContextVar("account", default=None)
+
+
+# ========== 账号 ==========
+class Account:
+    """
+    一个 Microsoft 365 账号的配置。settings 的键与单账号模式下的环境变量同名
+    (CLIENT_ID / CLIENT_SECRET / TENANT_ID / GRAPH_REFRESH_TOKEN / UNSPLASH_ACCESS_KEY /
+    SHAREPOINT_SITE_NAME / LATITUDE / LONGITUDE ...)，未配置的键回退到环境变量。
+    """
+
+    def __init__(self, name, settings, jobs=None):
+        self.name = name
+        self.settings = settings
+        self.jobs = jobs
+
+    def __repr__(self):
+        return f"Account({self.name!r})"
+
+
+def current_account():
+    return _current.get()
+
+
+def setting(name, default=None):
+    """读取配置项：优先当前账号的配置，其次环境变量。"""
+    account = _current.get()
+    if account and account.settings.get(name) not in (None, ""):
+        return account.settings[name]
+    return os.environ.get(name, default)
+
+
+@contextmanager
+def use_account(account):
+    """在 with 块内把 account 设为当前账号 (只影响当前线程 / 上下文)。"""
+    token = _current.set(account)
+    try:
+        yield account
+    finally:
+        _current.reset(token)
+
+
+# ========== 读取账号列表 ==========
+def load_accounts(path=None):
+    """
+    读取账号列表 JSON：优先环境变量 ACCOUNTS_JSON 的内容 (适合放在 GitHub Secret 里)，
+    其次 path / ACCOUNTS_FILE 指向的文件。格式为数组，每项包含 name、可选的 jobs 和各配置项，例如：
+    [{"name": "main", "CLIENT_ID": "...", "CLIENT_SECRET": "...", "TENANT_ID": "...",
+      "GRAPH_REFRESH_TOKEN": "...", "jobs": ["note", "page", "images"]}]
+    """
+    raw = os.environ.get("ACCOUNTS_JSON")
+    if not raw:
+        path = path or os.environ.get("ACCOUNTS_FILE", "accounts.json")
+        with open(path, "r", encoding="utf-8") as f:
+            raw = f.read()
+
+    accounts = []
+    for index, entry in enumerate(json.loads(raw)):
+        entry = dict(entry)
+        name = str(entry.pop("name", None) or f"account{index + 1}")
+        jobs = entry.pop("jobs", None)
+        accounts.append(Account(name, {k: str(v) for k, v in entry.items()}, jobs))
+
+    names = [a.name for a in accounts]
+    if len(set(names)) != len(names):
+        raise ValueError("账号 name 不能重复")
+    return accounts
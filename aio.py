@@ -0,0 +1,343 @@
+import os
+import json
+import time
+import atexit
+import asyncio
+import threading
+import contextvars
+import urllib.parse
+from importlib.util import find_spec
+from types import SimpleNamespace
+
+import throttle
+from accounts import current_account
+from config import env_int, env_flag
+from graph_client import GRAPH_BASE, DEFAULT_TIMEOUT, get_client, get_access_token, run_request_hooks
+
+# ==============================================================================
+# asyncio 引擎：创建 OneNote / SharePoint 页面、解析分区、下载和上传图片的请求都在一个共享的事件循环中执行。
+# 同步函数 (create_page / create_sharepoint_page / process_images 等) 是 run() 包装的外壳，供各脚本的
+# __main__ 和线程池调用；在事件循环中则直接 await 对应的 *_async 函数，大量并发请求只占用一个线程和一个连接池。
+# 本地缓存、图片目录 (SQLite) 和 Token 刷新依赖文件锁，仍是同步代码，协程中通过 asyncio.to_thread 调用。
+# ==============================================================================
+
+# ================= 配置区域 =================
+# 安装了 aiohttp 时使用原生异步 HTTP；未安装或 AIOHTTP=0 时在线程池中执行同步请求 (行为相同，只是不省线程)
+USE_AIOHTTP = env_flag("AIOHTTP", True) and find_spec("aiohttp") is not None
+if USE_AIOHTTP:
+    # 导入约需 0.2 秒，放在模块导入阶段，不计入第一个请求
+    import aiohttp
+# 每个账号一个连接池 (与 graph_client.get_client 一致)：单个连接池的连接上限 (所有主机合计) 与单个主机的上限
+AIO_CONNECTIONS = env_int("AIO_CONNECTIONS", 100)
+AIO_CONNECTIONS_PER_HOST = env_int("AIO_CONNECTIONS_PER_HOST", 32)
+# 读取下载流的块大小
+READ_SIZE = 64 * 1024
+
+
+# ========== 响应 ==========
+class AsyncResponse:
+    """
+    异步请求的响应，提供与 requests.Response 相同的常用属性 (status_code / headers / content / text / json())。
+    stream=True 时不预先读取内容：用 async for 遍历 iter_content() 逐块读取，用完后 close()。
+    """
+
+    def __init__(self, status_code, headers, url, content=None, request_body=None, read=None, close=None):
+        self.status_code = status_code
+        self.headers = headers
+        self.url = url
+        self.content = content
+        # metrics 的请求钩子从 response.request.body 统计发送的字节数
+        self.request = SimpleNamespace(body=request_body)
+        self.retries = 0
+        self.throttle_wait = 0.0
+        self._read = read
+        self._close = close
+
+    @property
+    def text(self):
+        return (self.content or b"").decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content or b"null")
+
+    async def iter_content(self, size=READ_SIZE):
+        if self._read is None:
+            if self.content:
+                yield self.content
+            return
+        while True:
+            block = await self._read(size)
+            if not block:
+                return
+            yield block
+
+    def close(self):
+        if self._close:
+            self._close()
+            self._close = None
+
+
+def _from_requests(resp, stream):
+    """把线程中执行的 requests.Response 包装成 AsyncResponse (流式读取同样放到线程中)。"""
+    read = None
+    if stream:
+        blocks = None
+
+        def next_block(size):
+            nonlocal blocks
+            if blocks is None:
+                blocks = resp.iter_content(size)
+            return next(blocks, b"")
+
+        async def read(size):
+            return await asyncio.to_thread(next_block, size)
+
+    result = AsyncResponse(resp.status_code, resp.headers, resp.url, None if stream else resp.content,
+                           getattr(resp.request, "body", None), read, resp.close)
+    result.retries = getattr(resp, "retries", 0)
+    result.throttle_wait = getattr(resp, "throttle_wait", 0.0)
+    return result
+
+
+def _form_data(files):
+    """把 requests 风格的 files={"名称": (文件名, 内容, Content-Type)} 转换为 aiohttp.FormData。"""
+    form = aiohttp.FormData()
+    for name, (filename, data, content_type) in files.items():
+        # 与 requests 不同，aiohttp 的二进制部件必须带文件名
+        form.add_field(name, data, filename=filename or name, content_type=content_type)
+    return form
+
+
+# ========== 异步 Graph 客户端 ==========
+class AsyncGraphClient:
+    """
+    GraphClient 的 asyncio 版本：方法相同 (get / post / put / patch / delete，path 规则一致)，但都是协程。
+    每个账号一个连接池 (AIO_CONNECTIONS)，所有请求同样经过 throttle 限流和 429/503/504 退避重试，
+    并触发相同的请求钩子 (metrics)。未安装 aiohttp 时把请求交给线程中的同步 GraphClient 执行。
+    """
+
+    def __init__(self, base_url=GRAPH_BASE, timeout=DEFAULT_TIMEOUT,
+                 connections=AIO_CONNECTIONS, connections_per_host=AIO_CONNECTIONS_PER_HOST):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.connections = connections
+        self.connections_per_host = connections_per_host
+        self.mock_server = os.environ.get("E5_MOCK_SERVER")
+        self._session = None
+        # 线程模式下同时执行的请求数
+        self._slots = asyncio.Semaphore(connections)
+
+    def url(self, path):
+        if path.startswith("http://") or path.startswith("https://"):
+            return path
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def _aiohttp_session(self):
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.connections, limit_per_host=self.connections_per_host)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def request(self, method, path, access_token=None, headers=None, **kwargs):
+        url = self.url(path)
+        stream = kwargs.get("stream", False)
+        if not USE_AIOHTTP:
+            # 同步客户端自己负责限流和请求钩子
+            async with self._slots:
+                resp = await asyncio.to_thread(get_client().request, method, url, access_token, headers, **kwargs)
+            return _from_requests(resp, stream)
+
+        merged_headers = dict(headers or {})
+        if access_token:
+            merged_headers["Authorization"] = f"Bearer {access_token}"
+        started = time.monotonic()
+        resp = None
+        try:
+            resp = await throttle.send_async(url, lambda: self._send(method, url, merged_headers, **kwargs),
+                                             method=method)
+            return resp
+        finally:
+            run_request_hooks(method, url, resp, time.monotonic() - started, stream)
+
+    async def _send(self, method, url, headers, params=None, data=None, json=None, files=None,
+                    timeout=None, stream=False):
+        timeout = timeout or self.timeout
+        connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        body = data
+        if json is not None:
+            body = _json_dumps(json)
+            headers.setdefault("Content-Type", "application/json")
+        elif isinstance(data, dict):
+            body = urllib.parse.urlencode(data).encode("utf-8")
+            headers.setdefault("Content-Type", "application/x-www-form-urlencoded")
+        elif isinstance(data, str):
+            body = data.encode("utf-8")
+
+        # 离线测试：请求改发到本地模拟服务器 (见 mock_server.py)
+        target = url
+        if self.mock_server:
+            from mock_server import redirect_url
+            target = redirect_url(url, self.mock_server)
+
+        raw = await self._aiohttp_session().request(
+            method, target, params=params, headers=headers,
+            data=_form_data(files) if files else body,
+            timeout=aiohttp.ClientTimeout(sock_connect=connect, sock_read=read),
+        )
+        if stream:
+            return AsyncResponse(raw.status, raw.headers, url, None, body, raw.content.read, raw.release)
+        try:
+            content = await raw.read()
+        finally:
+            raw.release()
+        return AsyncResponse(raw.status, raw.headers, url, content, body)
+
+    async def get(self, path, access_token=None, **kwargs):
+        return await self.request("GET", path, access_token, **kwargs)
+
+    async def post(self, path, access_token=None, **kwargs):
+        return await self.request("POST", path, access_token, **kwargs)
+
+    async def put(self, path, access_token=None, **kwargs):
+        return await self.request("PUT", path, access_token, **kwargs)
+
+    async def patch(self, path, access_token=None, **kwargs):
+        return await self.request("PATCH", path, access_token, **kwargs)
+
+    async def delete(self, path, access_token=None, **kwargs):
+        return await self.request("DELETE", path, access_token, **kwargs)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+def _json_dumps(value):
+    # 与 requests 的 json= 参数序列化方式一致
+    return json.dumps(value).encode("utf-8")
+
+
+# ========== 共享事件循环 ==========
+_loop = None
+_loop_thread = None
+_loop_lock = threading.Lock()
+# 每个 (事件循环, 账号) 一个客户端：多账号模式下各账号的连接池互相独立，与 graph_client.get_client 一致。
+# 共享事件循环之外，调用方也可以在自己的 asyncio.run() 中使用
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _engine_loop():
+    global _loop, _loop_thread
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            _loop_thread = threading.Thread(target=_loop.run_forever, name="aio-engine", daemon=True)
+            _loop_thread.start()
+            atexit.register(shutdown)
+        return _loop
+
+
+def get_async_client():
+    """
+    返回当前事件循环共用的 AsyncGraphClient (首次调用时创建)。只能在协程中调用。
+    处于 accounts.use_account() 中时返回该账号专属的客户端。
+    """
+    account = current_account()
+    key = (asyncio.get_running_loop(), account.name if account else None)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = AsyncGraphClient()
+        return _clients[key]
+
+
+async def close_async_client():
+    """关闭当前事件循环中的全部 AsyncGraphClient。"""
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        clients = [_clients.pop(key) for key in list(_clients) if key[0] is loop]
+    for client in clients:
+        await client.close()
+
+
+def close_account_async_client(name):
+    """关闭并丢弃某个账号的 AsyncGraphClient (批量任务中该账号处理完毕后与 close_account_client 一起调用)。"""
+    with _clients_lock:
+        clients = [(key[0], _clients.pop(key)) for key in list(_clients) if key[1] == name]
+    for loop, client in clients:
+        if loop.is_closed() or not loop.is_running():
+            continue
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            loop.create_task(client.close())
+            continue
+        try:
+            asyncio.run_coroutine_threadsafe(client.close(), loop).result(timeout=5)
+        except Exception:
+            pass
+
+
+class _Exit:
+    def __init__(self, error):
+        self.error = error
+
+
+async def _in_context(context, coro):
+    # 协程在事件循环线程中执行，把调用方的 ContextVar (当前账号、metrics 阶段等) 带过去
+    for var, value in context.items():
+        var.set(value)
+    try:
+        return await coro
+    except SystemExit as e:
+        # exit() 穿过事件循环会终止事件循环线程，交给调用方所在的线程重新抛出
+        return _Exit(e)
+
+
+def run(coro):
+    """
+    同步外壳：在共享事件循环中执行 coro，阻塞到完成后返回结果 (异常原样抛出)。
+    可以在任意线程中调用，多个线程的请求共用同一个连接池；不能在事件循环内部调用。
+    """
+    loop = _engine_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        coro.close()
+        raise RuntimeError("事件循环中请直接 await 对应的 *_async 函数")
+    future = asyncio.run_coroutine_threadsafe(_in_context(contextvars.copy_context(), coro), loop)
+    result = future.result()
+    if isinstance(result, _Exit):
+        raise result.error
+    return result
+
+
+def shutdown():
+    """关闭连接池并停止共享事件循环 (退出时自动调用)。"""
+    global _loop, _loop_thread
+    with _loop_lock:
+        loop, thread, _loop, _loop_thread = _loop, _loop_thread, None, None
+    if loop is None:
+        return
+    try:
+        asyncio.run_coroutine_threadsafe(close_async_client(), loop).result(timeout=5)
+    except Exception:
+        pass
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(timeout=5)
+    if not loop.is_running():
+        loop.close()
+
+
+# ========== Token ==========
+async def get_access_token_async():
+    """
+    Token 缓存依赖文件锁，刷新过程放到线程中执行。
+    每个账号每次运行最多刷新一次，通常直接命中缓存，不影响事件循环中的其他请求。
+    """
+    return await asyncio.to_thread(get_access_token)
@@ -0,0 +1,136 @@
+import sys
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, time as dt_time, timedelta
+from zoneinfo import ZoneInfo
+
+from config import env_int
+from fanout import bind_context
+from graph_client import get_access_token
+import metrics
+import create_notebook
+import create_sharepoint
+
+# ================= 配置区域 =================
+# 同时创建的页面数；OneNote / SharePoint 请求另外受 throttle 的按资源限流约束
+BACKFILL_WORKERS = env_int("BACKFILL_WORKERS", 4)
+# 补建页面使用的时间 (北京时间)
+DEFAULT_PAGE_TIME = "06:47"
+
+
+def date_range(start, end):
+    day = start
+    while day <= end:
+        yield day
+        day += timedelta(days=1)
+
+
+def page_time(day, at):
+    return datetime.combine(day, at, tzinfo=ZoneInfo("Asia/Shanghai"))
+
+
+def _run_all(label, jobs, workers):
+    """在有界线程池中执行 {日期: 可调用对象}，返回 (成功数, 失败日期列表)。"""
+    succeeded, failed = 0, []
+    with ThreadPoolExecutor(max(1, workers), thread_name_prefix=label) as pool:
+        futures = {pool.submit(bind_context(fn)): day for day, fn in jobs.items()}
+        for future in as_completed(futures):
+            day = futures[future]
+            try:
+                ok = future.result()
+            except BaseException as e:  # 页面函数出错时可能直接 exit()
+                print(f"⚠️  {label} {day} 创建出错: {e!r}")
+                ok = False
+            if ok:
+                succeeded += 1
+            else:
+                failed.append(day)
+    return succeeded, sorted(failed)
+
+
+# ========== OneNote 补建 ==========
+def backfill_notes(access_token, days, at, workers):
+    """每个月份分区只解析一次、只列一次已有页面；已有页面的日期直接跳过。"""
+    months = {}
+    for day in days:
+        months.setdefault(create_notebook.section_name_for(day), []).append(day)
+
+    profile_info = create_notebook.get_my_profile(access_token)
+    jobs = {}
+    for section_name, month_days in months.items():
+        section_id = create_notebook.resolve_section(access_token, section_name)
+        existing = create_notebook.existing_page_days(access_token, section_id)
+        for day in month_days:
+            if day.strftime("%d") in existing:
+                print(f"⏭️  OneNote {day} 已有页面，跳过")
+                continue
+            jobs[day] = (lambda d=day, sid=section_id:
+                         create_notebook.create_page(access_token, profile_info, page_time(d, at), sid))
+
+    print(f"📓 OneNote：需要补建 {len(jobs)} 页，跳过 {len(days) - len(jobs)} 页")
+    return _run_all("note", jobs, workers)
+
+
+# ========== SharePoint 补建 ==========
+def _sharepoint_job(access_token, site_id, day, at):
+    day_str = day.strftime("%Y%m%d")
+    inputs = create_sharepoint.gather_inputs(access_token, day_str, {
+        "image": lambda: create_sharepoint.get_today_image(access_token, day_str),
+    }, weather_day=day.isoformat())
+    return create_sharepoint.create_sharepoint_page(
+        access_token, inputs["image"], inputs["weather"], inputs["quote"], site_id, page_time(day, at))
+
+
+def backfill_sharepoint(access_token, days, at, workers):
+    """站点只解析一次、已有页面只列一次；已有晨报的日期直接跳过。"""
+    site_id = create_sharepoint.resolve_site(access_token)
+    if not site_id:
+        return 0, list(days)
+    existing = create_sharepoint.existing_report_days(access_token, site_id)
+    jobs = {}
+    for day in days:
+        if day.strftime("%Y%m%d") in existing:
+            print(f"⏭️  SharePoint {day} 已有页面，跳过")
+            continue
+        jobs[day] = lambda d=day: _sharepoint_job(access_token, site_id, d, at)
+
+    print(f"📰 SharePoint：需要补建 {len(jobs)} 页，跳过 {len(days) - len(jobs)} 页")
+    return _run_all("page", jobs, workers)
+
+
+# ========== 主程序 ==========
+BACKFILLS = {"note": backfill_notes, "page": backfill_sharepoint}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="为一段日期补建 OneNote / SharePoint 页面 (已有页面的日期会跳过)")
+    parser.add_argument("start", type=date.fromisoformat, help="开始日期 YYYY-MM-DD")
+    parser.add_argument("end", type=date.fromisoformat, nargs="?", help="结束日期 YYYY-MM-DD (含)，默认与开始日期相同")
+    parser.add_argument("--jobs", default="note,page", help="要补建的页面，逗号分隔：note,page")
+    parser.add_argument("--time", default=DEFAULT_PAGE_TIME, type=dt_time.fromisoformat, help="页面时间 (北京时间 HH:MM)")
+    parser.add_argument("--workers", type=int, default=BACKFILL_WORKERS, help="同时创建的页面数")
+    args = parser.parse_args(argv)
+    metrics.install("backfill")
+
+    end = args.end or args.start
+    if end < args.start:
+        parser.error("结束日期不能早于开始日期")
+    jobs = [j.strip() for j in args.jobs.split(",") if j.strip()]
+    unknown = [j for j in jobs if j not in BACKFILLS]
+    if unknown:
+        parser.error(f"未知任务: {', '.join(unknown)}")
+
+    days = list(date_range(args.start, end))
+    print(f"🚀 补建 {args.start} ~ {end} 共 {len(days)} 天的页面：{', '.join(jobs)}")
+    token = get_access_token()
+
+    all_ok = True
+    for job in jobs:
+        succeeded, failed = BACKFILLS[job](token, days, args.time, args.workers)
+        print(f"🎉 {job}：成功 {succeeded} 页" + (f"，失败 {len(failed)} 页: {', '.join(map(str, failed))}" if failed else ""))
+        all_ok = all_ok and not failed
+    return 0 if all_ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from accounts import load_accounts, use_account
+from config import env_int
+from graph_client import close_account_client
+from aio import close_account_async_client
+import metrics
+import create_notebook
+import create_sharepoint
+import unsplash_to_onedrive
+
+# ================= 配置区域 =================
+# 同时处理的账号数；每个账号的请求另外受 throttle 的按账号限流约束
+BATCH_WORKERS = env_int("BATCH_WORKERS", 4)
+DEFAULT_JOBS = ("note", "page", "images")
+
+
+# ========== 单个任务 ==========
+def run_note():
+    return bool(create_notebook.run())
+
+
+def run_page():
+    return bool(create_sharepoint.run())
+
+
+def run_images():
+    succeeded, total = unsplash_to_onedrive.run()
+    return succeeded > 0 or total == 0
+
+
+JOBS = {"note": run_note, "page": run_page, "images": run_images}
+
+
+def run_job(account, job):
+    """在 account 的上下文中执行一个任务，返回结果记录 (任务内的 exit() 也按失败记录)。account 为 None 时使用环境变量中的账号。"""
+    started = time.monotonic()
+    ok, error = False, None
+    try:
+        with use_account(account):
+            ok = JOBS[job]()
+        if not ok:
+            error = "任务未完成"
+    except SystemExit as e:
+        error = f"退出码 {e.code}"
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    return {
+        "account": account.name if account else None,
+        "job": job,
+        "ok": ok,
+        "seconds": round(time.monotonic() - started, 3),
+        "error": error,
+    }
+
+
+def run_account(account, jobs):
+    """依次执行一个账号的全部任务；结束后关闭该账号的连接池。"""
+    try:
+        return [run_job(account, job) for job in (account.jobs or jobs)]
+    finally:
+        close_account_client(account.name)
+        close_account_async_client(account.name)
+
+
+# ========== 汇总报告 ==========
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def summarize(records, wall_seconds):
+    jobs = {}
+    for job in sorted({r["job"] for r in records}):
+        rows = [r for r in records if r["job"] == job]
+        seconds = [r["seconds"] for r in rows]
+        jobs[job] = {
+            "total": len(rows),
+            "succeeded": sum(r["ok"] for r in rows),
+            "p50_seconds": _percentile(seconds, 50),
+            "p95_seconds": _percentile(seconds, 95),
+            "max_seconds": max(seconds),
+        }
+    return {
+        "accounts": len({r["account"] for r in records}),
+        "total": len(records),
+        "succeeded": sum(r["ok"] for r in records),
+        "wall_seconds": round(wall_seconds, 3),
+        "jobs": jobs,
+        "failures": [r for r in records if not r["ok"]],
+        "records": records,
+    }
+
+
+def print_report(report):
+    print("\n" + "=" * 60)
+    print(f"📊 批量任务汇总：{report['accounts']} 个账号，成功 {report['succeeded']} / {report['total']}，"
+          f"总耗时 {report['wall_seconds']:.1f} 秒")
+    for job, stats in report["jobs"].items():
+        print(f"   {job:<8} 成功 {stats['succeeded']}/{stats['total']}  "
+              f"p50 {stats['p50_seconds']:.1f}s  p95 {stats['p95_seconds']:.1f}s  max {stats['max_seconds']:.1f}s")
+    for r in report["failures"]:
+        print(f"   ❌ {r['account']} / {r['job']}: {r['error']}")
+
+
+# ========== 主程序 ==========
+def run_batch(accounts, jobs=DEFAULT_JOBS, workers=BATCH_WORKERS):
+    """在有界线程池中并发处理各账号，返回汇总报告。"""
+    started = time.monotonic()
+    records = []
+    with ThreadPoolExecutor(max(1, workers), thread_name_prefix="account") as pool:
+        futures = [pool.submit(run_account, account, jobs) for account in accounts]
+        for future in as_completed(futures):
+            records.extend(future.result())
+    records.sort(key=lambda r: (r["account"], r["job"]))
+    return summarize(records, time.monotonic() - started)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="为多个账号批量执行 OneNote / SharePoint / 壁纸同步任务")
+    parser.add_argument("--accounts", help="账号列表 JSON 文件 (默认 ACCOUNTS_FILE 或 accounts.json)")
+    parser.add_argument("--jobs", default=",".join(DEFAULT_JOBS), help="要执行的任务，逗号分隔：note,page,images")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="同时处理的账号数")
+    parser.add_argument("--report", default=os.environ.get("BATCH_REPORT"), help="把汇总报告写入该 JSON 文件")
+    args = parser.parse_args(argv)
+    metrics.install("batch_runner")
+
+    jobs = [j.strip() for j in args.jobs.split(",") if j.strip()]
+    unknown = [j for j in jobs if j not in JOBS]
+    if unknown:
+        parser.error(f"未知任务: {', '.join(unknown)}")
+
+    accounts = load_accounts(args.accounts)
+    for account in accounts:
+        bad = [j for j in account.jobs or () if j not in JOBS]
+        if bad:
+            parser.error(f"账号 {account.name} 配置了未知任务: {', '.join(bad)}")
+
+    print(f"🚀 开始批量任务：{len(accounts)} 个账号，并发 {args.workers}")
+    report = run_batch(accounts, jobs, args.workers)
+    print_report(report)
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"📝 报告已写入 {args.report}")
+    return 0 if report["succeeded"] == report["total"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,214 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+# ================= 配置区域 =================
+SCENARIOS = ("notebook", "sharepoint", "unsplash")
+RESULT_MARKER = "BENCH_RESULT "
+# 与基线相比允许的劣化比例 (耗时 / 请求数 / 峰值内存)
+DEFAULT_TOLERANCE = 0.25
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# ==============================================================================
+# 子进程：执行单个场景并测量
+# ==============================================================================
+def load_scenario(name):
+    """导入场景所需的模块 (导入耗时单独计量)，返回执行场景的函数。"""
+    if name == "notebook":
+        import create_notebook
+        return lambda: bool(create_notebook.run())
+    if name == "sharepoint":
+        import create_sharepoint
+        return lambda: bool(create_sharepoint.run())
+    if name == "unsplash":
+        import unsplash_to_onedrive
+
+        def run():
+            succeeded, total = unsplash_to_onedrive.run()
+            return succeeded == total
+        return run
+    raise ValueError(f"未知场景: {name}")
+
+
+def child_main(name):
+    """在独立进程中运行一次场景 (冷启动状态与真实的 cron 运行一致)，最后一行输出测量结果。"""
+    import resource
+    import tracemalloc
+
+    # tracemalloc 会让导入慢一个数量级，导入完成后才开始跟踪 (峰值内存只统计场景执行本身)
+    started = time.perf_counter()
+    imported = started
+    try:
+        run = load_scenario(name)
+        imported = time.perf_counter()
+        tracemalloc.start()
+        ok = run()
+        error = None
+    except BaseException as e:  # 脚本出错时可能直接 exit()
+        ok, error = False, repr(e)
+    finished = time.perf_counter()
+    _, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+    result = {
+        "ok": ok,
+        "error": error,
+        "wall_seconds": round(finished - started, 3),
+        "import_seconds": round(imported - started, 3),
+        "peak_python_bytes": peak,
+        "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }
+    print(RESULT_MARKER + json.dumps(result), flush=True)
+
+
+# ==============================================================================
+# 主进程：启动模拟服务器，依次运行各场景
+# ==============================================================================
+def _child_env(server_url, cache_dir, args):
+    env = dict(os.environ)
+    env.update({
+        "E5_MOCK_SERVER": server_url,
+        "E5_CACHE_DIR": cache_dir,
+        "CLIENT_ID": "mock-client",
+        "CLIENT_SECRET": "mock-secret",
+        "TENANT_ID": "mock-tenant",
+        "GRAPH_REFRESH_TOKEN": "mock-refresh-token",
+        "UNSPLASH_ACCESS_KEY": "mock-unsplash-key",
+        "IMAGE_COUNT": str(args.images),
+        # create 模式的页面名精确到分钟，同一分钟内的 warm 运行会重名；基准测试 upsert 路径
+        "SHAREPOINT_PAGE_MODE": "upsert",
+        "PYTHONPATH": REPO_DIR + os.pathsep + env.get("PYTHONPATH", ""),
+    })
+    env.pop("ACCOUNTS_JSON", None)
+    return env
+
+
+def _run_child(name, env):
+    started = time.perf_counter()
+    proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", name],
+                          env=env, cwd=REPO_DIR, capture_output=True, text=True)
+    process_wall = time.perf_counter() - started
+    lines = [line for line in proc.stdout.splitlines() if line.startswith(RESULT_MARKER)]
+    if not lines:
+        tail = "\n".join((proc.stdout + proc.stderr).splitlines()[-20:])
+        return {"ok": False, "error": f"子进程没有输出结果 (退出码 {proc.returncode})\n{tail}",
+                "process_seconds": round(process_wall, 3)}
+    result = json.loads(lines[-1][len(RESULT_MARKER):])
+    result["process_seconds"] = round(process_wall, 3)
+    if not result["ok"]:
+        result["log_tail"] = "\n".join(proc.stdout.splitlines()[-20:])
+    return result
+
+
+def _totals(stats):
+    return {
+        "requests": sum(s["requests"] for s in stats.values()),
+        "throttled": sum(s["throttled"] for s in stats.values()),
+        "bytes_in": sum(s["bytes_in"] for s in stats.values()),
+        "bytes_out": sum(s["bytes_out"] for s in stats.values()),
+    }
+
+
+def run_benchmark(args):
+    from mock_server import MockConfig, MockServer
+
+    config = MockConfig(
+        latency=args.latency,
+        page_size=args.page_size,
+        throttle_rate=args.throttle_rate,
+        image_size=int(args.image_size * 1024 * 1024),
+        seed_images=args.seed_images,
+        folder_delta=not args.business,
+    )
+    results = []
+    with MockServer(config) as server:
+        for name in args.scenarios:
+            # 每个场景使用独立的缓存目录：先冷启动 (无缓存)，再热启动 (复用上一次的缓存)
+            with tempfile.TemporaryDirectory(prefix=f"e5-bench-{name}-") as cache_dir:
+                env = _child_env(server.url, cache_dir, args)
+                for phase in ("cold", "warm"):
+                    server.reset_stats()
+                    result = _run_child(name, env)
+                    stats = server.stats()
+                    result.update(scenario=name, phase=phase, hosts=stats, **_totals(stats))
+                    results.append(result)
+                    print_result(result)
+    return results
+
+
+# ========== 报告 ==========
+def print_result(r):
+    status = "✅" if r["ok"] else "❌"
+    print(f"{status} {r['scenario']:<10} {r['phase']:<4}  "
+          f"耗时 {r.get('wall_seconds', float('nan')):6.2f}s (导入 {r.get('import_seconds', float('nan')):.2f}s，"
+          f"进程 {r['process_seconds']:.2f}s)  "
+          f"请求 {r['requests']:4d} (429: {r['throttled']})  "
+          f"上行 {r['bytes_in'] / 1048576:7.2f} MB  下行 {r['bytes_out'] / 1048576:7.2f} MB  "
+          f"峰值 {r.get('peak_python_bytes', 0) / 1048576:6.1f} MB (RSS {r.get('max_rss_bytes', 0) / 1048576:.0f} MB)")
+    if not r["ok"]:
+        print(f"   ⚠️ {r.get('error')}")
+        if r.get("log_tail"):
+            print("   " + r["log_tail"].replace("\n", "\n   "))
+
+
+def compare(results, baseline, tolerance):
+    """与基线逐项比较，返回劣化超过 tolerance 的描述列表。"""
+    index = {(b["scenario"], b["phase"]): b for b in baseline}
+    regressions = []
+    for r in results:
+        base = index.get((r["scenario"], r["phase"]))
+        if not base or not r["ok"]:
+            continue
+        for metric in ("wall_seconds", "import_seconds", "requests", "bytes_in", "bytes_out", "peak_python_bytes"):
+            old, new = base.get(metric), r.get(metric)
+            if old and new is not None and new > old * (1 + tolerance):
+                regressions.append(f"{r['scenario']}/{r['phase']} {metric}: {old} -> {new}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="在本地模拟服务器上对各脚本做端到端基准测试")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, dest="scenarios",
+                        help="要运行的场景 (可重复)，默认全部")
+    parser.add_argument("--latency", type=float, default=0.02, help="每个请求的模拟延迟 (秒)")
+    parser.add_argument("--page-size", type=int, default=200, help="列表接口每页条数")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Graph 请求随机返回 429 的概率")
+    parser.add_argument("--image-size", type=float, default=4, help="Unsplash 原图大小 (MB)")
+    parser.add_argument("--images", type=int, default=5, help="unsplash 场景同步的图片数量")
+    parser.add_argument("--seed-images", type=int, default=30, help="OneDrive 中预置的图片数量")
+    parser.add_argument("--business", action="store_true", help="模拟商业版 OneDrive (不支持目录级 delta)")
+    parser.add_argument("--json", help="把结果写入该 JSON 文件")
+    parser.add_argument("--baseline", help="与该 JSON 基线比较，劣化超过 --tolerance 时返回非零")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        child_main(args.child)
+        return 0
+
+    args.scenarios = args.scenarios or list(SCENARIOS)
+    print(f"🧪 基准测试：{', '.join(args.scenarios)} (延迟 {args.latency}s，429 概率 {args.throttle_rate})")
+    results = run_benchmark(args)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"📝 结果已写入 {args.json}")
+
+    failed = [r for r in results if not r["ok"]]
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"📉 性能退化: {line}")
+        if regressions:
+            return 1
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+import os
+import time
+import random
+
+# ================= 配置区域 =================
+# 本地运行时存放凭据的文件 (与 act 的 --secret-file 共用，KEY=VALUE 格式)
+SECRETS_FILE = "my.secrets"
+# 各任务开始前的随机延迟范围 (秒)，错开固定的执行时间
+JOB_JITTER = {"note": (5, 30), "page": (1, 3), "images": (0, 0)}
+
+_FALSE = ("0", "false", "no", "off")
+
+
+# ========== 环境变量 ==========
+def env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value not in (None, "") else default
+
+
+def env_flag(name, default=False):
+    """开关类环境变量：未设置时为 default，设置为 0 / false / no / off 时关闭，其余值开启。"""
+    value = os.environ.get(name)
+    if value in (None, ""):
+        return default
+    return value.strip().lower() not in _FALSE
+
+
+# ========== 随机延迟 ==========
+def job_delay(job):
+    """按 JOB_JITTER 随机延迟后返回延迟的秒数。"""
+    low, high = JOB_JITTER.get(job, (0, 0))
+    delay = random.randint(low, high)
+    if delay:
+        print(f"⏳ 随机延迟 {delay} 秒后开始执行...")
+        time.sleep(delay)
+    return delay
+
+
+# ========== 读取 my.secrets ==========
+def parse_secrets(text):
+    """解析 KEY=VALUE 格式的内容 (支持 # 注释、export 前缀和引号)，返回字典。"""
+    values = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#") or "=" not in line:
+            continue
+        key, value = line.split("=", 1)
+        key = key.strip()
+        if key.startswith("export "):
+            key = key[len("export "):].strip()
+        value = value.strip()
+        if len(value) >= 2 and value[0] == value[-1] and value[0] in "\"'":
+            quote, value = value[0], value[1:-1]
+            if quote == '"':
+                value = value.replace("\\n", "\n").replace('\\"', '"')
+        elif " #" in value:
+            value = value.split(" #", 1)[0].rstrip()
+        values[key] = value
+    return values
+
+
+def load_secrets(path=None, override=False):
+    """
+    把 my.secrets 中的变量加载到环境变量 (已存在的变量默认不覆盖，与 python-dotenv 一致)。
+    文件不存在时返回 False。
+    """
+    path = path or SECRETS_FILE
+    if not os.path.exists(path):
+        return False
+    with open(path, "r", encoding="utf-8") as f:
+        for key, value in parse_secrets(f.read()).items():
+            if override or key not in os.environ:
+                os.environ[key] = value
+    return True
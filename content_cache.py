@@ -0,0 +1,162 @@
+import time
+import atexit
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from config import env_flag
+from fanout import bind_context
+from json_cache import JsonCache
+
+# ================= 配置区域 =================
+# 第三方内容源 (天气 / 一言 / 笑话) 的磁盘缓存策略，单位为秒：
+#   ttl         在此时间内直接使用缓存，不发请求
+#   revalidate  超过 ttl 但未超过该时间：立即返回旧值，同时在后台刷新
+#   max_stale   需要新内容但获取失败 (或超过 wait 仍未返回) 时，旧值可以兜底的最长时间
+#   wait        有旧值兜底时，等待实时获取的最长时间；没有旧值时一直等到请求本身超时
+#   once        每条内容只使用一次 (随机内容)：本次直接使用上次预取的内容，后台预取下一条
+POLICIES = {
+    "weather": {"ttl": 1800, "revalidate": 3 * 3600, "max_stale": 2 * 86400, "wait": 2},
+    # 历史日期的天气不会再变
+    "weather_history": {"ttl": 30 * 86400, "revalidate": 30 * 86400, "max_stale": 365 * 86400, "wait": 2},
+    "hitokoto": {"once": True, "max_stale": 30 * 86400, "wait": 2},
+    "joke": {"once": True, "max_stale": 30 * 86400, "wait": 2},
+}
+
+# 进程退出时最多再等后台刷新多少秒 (所有刷新合计)；没写完的刷新放弃，下次运行仍可使用旧值
+EXIT_WAIT = 1.0
+
+# 同一内容同一时刻只有一个刷新请求 (single-flight)
+_inflight = {}
+_inflight_lock = threading.Lock()
+# 尚未结束的后台刷新线程
+_threads = set()
+_threads_lock = threading.Lock()
+
+
+def cache_enabled():
+    return env_flag("CONTENT_CACHE", True)
+
+
+def _store():
+    return JsonCache("content_cache")
+
+
+def _try_fetch(fetch):
+    """调用 fetch()，失败 (抛异常或返回 None) 时返回 None。"""
+    try:
+        return fetch()
+    except Exception:
+        return None
+
+
+# ========== 后台刷新 ==========
+def _refresh(name, fetch, shared=True):
+    """
+    在后台线程中获取新内容并写入缓存，返回 Future (结果为新内容，失败为 None)。
+    shared 时同一内容的并发刷新合并为一个请求。
+    线程是守护线程：退出时最多等待 EXIT_WAIT 秒 (见 _join_refreshes)，上游很慢时不会拖住整个进程。
+    """
+    future = Future()
+    if shared:
+        with _inflight_lock:
+            if name in _inflight:
+                return _inflight[name]
+            _inflight[name] = future
+
+    def run():
+        value = _try_fetch(fetch)
+        if value is not None:
+            _store().set(name, {"value": value, "fetched_at": time.time(), "used": False})
+        if shared:
+            with _inflight_lock:
+                _inflight.pop(name, None)
+        future.set_result(value)
+        with _threads_lock:
+            _threads.discard(threading.current_thread())
+
+    thread = threading.Thread(target=bind_context(run), name=f"refresh-{name}", daemon=True)
+    with _threads_lock:
+        _threads.add(thread)
+    thread.start()
+    return future
+
+
+def _join_refreshes():
+    """退出时等待仍在进行的后台刷新，总共不超过 EXIT_WAIT 秒。"""
+    deadline = time.monotonic() + EXIT_WAIT
+    with _threads_lock:
+        threads = list(_threads)
+    for thread in threads:
+        thread.join(max(0.0, deadline - time.monotonic()))
+
+
+atexit.register(_join_refreshes)
+
+
+def _mark_used(name, fetched_at):
+    with _store().locked() as data:
+        entry = data.get(name)
+        if entry and entry.get("fetched_at") == fetched_at:
+            entry["used"] = True
+
+
+# ========== 读取内容 ==========
+def cached(source, fetch, key="default"):
+    """
+    按 POLICIES[source] 返回 fetch() 的内容 (带磁盘缓存)，没有可用内容时返回 None。
+    fetch 失败时应抛出异常或返回 None；返回值需要能 JSON 序列化。
+    """
+    if not cache_enabled():
+        return _try_fetch(fetch)
+
+    policy = POLICIES[source]
+    name = f"{source}:{key}"
+    now = time.time()
+
+    if policy.get("once"):
+        # 取走上次预取、尚未使用的内容，并在后台预取下一条
+        with _store().locked() as data:
+            entry = data.get(name)
+            if entry and not entry.get("used"):
+                entry["used"] = True
+                _refresh(name, fetch)
+                return entry["value"]
+    else:
+        entry = _store().get(name)
+        age = now - entry["fetched_at"] if entry else None
+        if entry and age <= policy["ttl"]:
+            return entry["value"]
+        if entry and age <= policy["revalidate"]:
+            _refresh(name, fetch)
+            return entry["value"]
+
+    # 需要新内容：有旧值兜底时最多等待 wait 秒，超时的刷新在后台继续完成并写入缓存。
+    # 随机内容各取各的，避免并发生成的多个页面拿到同一条
+    stale = entry if entry and now - entry["fetched_at"] <= policy["max_stale"] else None
+    future = _refresh(name, fetch, shared=not policy.get("once"))
+    try:
+        value = future.result(timeout=policy["wait"] if stale else None)
+    except FutureTimeout:
+        value = None
+    if value is not None:
+        if policy.get("once"):
+            # 刚取到的内容本次就用掉，再预取一条留给下次
+            current = _store().get(name)
+            if current and current["value"] == value:
+                _mark_used(name, current["fetched_at"])
+            _refresh(name, fetch)
+        return value
+    if stale:
+        print(f"♻️  {source} 暂时获取不到，使用缓存的内容 ({int((now - stale['fetched_at']) // 60)} 分钟前)")
+        return stale["value"]
+    return None
+
+
+def last_value(source, key="default"):
+    """返回缓存中最近一次的内容 (不超过 max_stale，不发请求)，没有时返回 None。用作并发获取超时时的兜底值。"""
+    if not cache_enabled():
+        return None
+    entry = _store().get(f"{source}:{key}")
+    if entry and time.time() - entry["fetched_at"] <= POLICIES[source]["max_stale"]:
+        return entry["value"]
+    return None
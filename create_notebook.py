@@ -1,48 +1,45 @@
 import os
-import requests
 import html
-import time
-import random
+import asyncio
 from datetime import datetime, timezone
 from zoneinfo import ZoneInfo
 
+import aio
+from aio import get_async_client
+from fanout import gather_async
+from graph_client import get_client, get_access_token, account_key, odata_quote
+from json_cache import JsonCache
+from config import job_delay
+from content_cache import cached, last_value
+import metrics
+from metrics import phase
+from image_catalog import select_daily_image, find_preview_id
+from onedrive_listing import iter_pages
 
-# ========== 获取 access_token ==========
-def get_access_token():
-    client_id = os.environ["CLIENT_ID"]
-    client_secret = os.environ["CLIENT_SECRET"]
-    tenant_id = os.environ["TENANT_ID"]
-    refresh_token = os.environ["GRAPH_REFRESH_TOKEN"]
-
-    token_url = f"https://login.microsoftonline.com/{tenant_id}/oauth2/v2.0/token"
-    data = {
-        "client_id": client_id,
-        "client_secret": client_secret,
-        "grant_type": "refresh_token",
-        "refresh_token": refresh_token,
-        "scope": "https://graph.microsoft.com/.default offline_access"
-    }
-
-    resp = requests.post(token_url, data=data)
-    if resp.status_code != 200:
-        print("❌ 获取 access_token 失败")
-        print(resp.text)
-        exit(1)
+# 笑话与图片的最长等待时间 (秒)，超时使用兜底内容
+SOURCE_TIMEOUTS = {"joke": 10, "image": 30}
 
-    return resp.json()["access_token"]
+# 页面中图片的嵌入方式：
+#   url       引用原图的临时下载链接 (OneNote 创建页面时自己去拉取原图)
+#   thumbnail 引用 driveItem 的缩略图链接 (large / medium)
+#   multipart 把预览图或缩略图作为 multipart 二进制部件随页面一起提交
+ONENOTE_IMAGE_MODE = os.environ.get("ONENOTE_IMAGE_MODE", "url").lower()
+ONENOTE_THUMBNAIL_SIZE = os.environ.get("ONENOTE_THUMBNAIL_SIZE", "large")
+NO_IMAGE_HTML = '<p>未找到图片</p>'
 
 
 # ========== 查询个人资料 ==========
 def get_my_profile(access_token):
-    headers = {"Authorization": f"Bearer {access_token}"}
-    url = "https://graph.microsoft.com/v1.0/me"
-
-    requests.get("https://graph.microsoft.com/v1.0/me/messages", headers=headers)
-    requests.get("https://graph.microsoft.com/v1.0/me/events?$select=subject,body,bodyPreview,organizer,attendees,start,end,location", headers=headers)
-    requests.get("https://graph.microsoft.com/v1.0/me/drive/root/children", headers=headers)
-    requests.get("https://graph.microsoft.com/v1.0/sites/root", headers=headers)
-    requests.get("https://graph.microsoft.com/v1.0/me/joinedTeams", headers=headers)
-    resp = requests.get(url, headers=headers)
+    # 保活调用和 /me 合并为一次 $batch 请求；保活调用只为产生活动，只取少量字段
+    responses = get_client().batch([
+        {"url": "me/messages?$select=id,subject&$top=10"},
+        {"url": "me/events?$select=subject,start,end&$top=10"},
+        {"url": "me/drive/root/children?$select=id,name&$top=10"},
+        {"url": "sites/root?$select=id,displayName"},
+        {"url": "me/joinedTeams?$select=id,displayName"},
+        {"url": "me"},
+    ], access_token)
+    resp = responses[-1]
     if resp.status_code == 200:
         profile = resp.json()
         info = {
@@ -65,18 +62,44 @@ def get_my_profile(access_token):
         return {}
 
 
+# ========== 笔记本 / 分区 ID 缓存 ==========
+class StaleIdError(Exception):
+    """缓存的笔记本或分区 ID 在 Graph 上已不存在 (404)。"""
+
+
+def _onenote_cache():
+    return JsonCache("onenote")
+
+
+def _notebook_key(access_token, notebook_name):
+    return f"{account_key(access_token)}:notebook:{notebook_name}"
+
+
+def _section_key(access_token, notebook_id, section_name):
+    return f"{account_key(access_token)}:section:{notebook_id}:{section_name}"
+
+
 # ========== 获取或创建笔记本 ==========
-def get_or_create_notebook(access_token, notebook_name="MyNotes"):
-    headers = {"Authorization": f"Bearer {access_token}"}
+async def get_or_create_notebook_async(access_token, notebook_name="MyNotes"):
+    # 命中本地缓存时跳过笔记本列表 (缓存文件的读写都在线程中执行，不阻塞事件循环)
+    cached_id = await asyncio.to_thread(_onenote_cache().get, _notebook_key(access_token, notebook_name))
+    if cached_id:
+        print(f"✅ 找到笔记本 (缓存): {notebook_name}")
+        return cached_id
+
+    graph = get_async_client()
     
-    # 获取所有笔记本
-    notebooks_url = "https://graph.microsoft.com/v1.0/me/onenote/notebooks"
-    resp = requests.get(notebooks_url, headers=headers)
+    # 按名称查找笔记本 (由服务端过滤，只返回 id 和名称)
+    notebooks_url = "me/onenote/notebooks"
+    resp = await graph.get(notebooks_url, access_token, params={
+        "$filter": f"displayName eq {odata_quote(notebook_name)}",
+        "$select": "id,displayName",
+    })
     
     if resp.status_code != 200:
         print("❌ 获取笔记本失败")
         print(resp.text)
-        exit(1)
+        raise RuntimeError(f"获取笔记本失败: {resp.status_code}")
     
     notebooks = resp.json().get("value", [])
     
@@ -84,38 +107,55 @@ def get_or_create_notebook(access_token, notebook_name="MyNotes"):
     for notebook in notebooks:
         if notebook.get("displayName") == notebook_name:
             print(f"✅ 找到笔记本: {notebook_name}")
+            await asyncio.to_thread(_onenote_cache().set, _notebook_key(access_token, notebook_name), notebook["id"])
             return notebook["id"]
     
     # 创建新笔记本
     print(f"📓 创建新笔记本: {notebook_name}")
-    create_resp = requests.post(
+    create_resp = await graph.post(
         notebooks_url,
-        headers=headers,
+        access_token,
         json={"displayName": notebook_name}
     )
     
     if create_resp.status_code == 201:
         notebook_id = create_resp.json()["id"]
         print(f"✅ 笔记本创建成功: {notebook_id}")
+        await asyncio.to_thread(_onenote_cache().set, _notebook_key(access_token, notebook_name), notebook_id)
         return notebook_id
     else:
         print("❌ 创建笔记本失败")
         print(create_resp.text)
-        exit(1)
+        raise RuntimeError(f"创建笔记本失败: {create_resp.status_code}")
+
+
+def get_or_create_notebook(access_token, notebook_name="MyNotes"):
+    return aio.run(get_or_create_notebook_async(access_token, notebook_name))
 
 
 # ========== 获取或创建分区 ==========
-def get_or_create_section(access_token, notebook_id, section_name):
-    headers = {"Authorization": f"Bearer {access_token}"}
+async def get_or_create_section_async(access_token, notebook_id, section_name):
+    # 命中本地缓存时跳过分区列表
+    cached_id = await asyncio.to_thread(_onenote_cache().get, _section_key(access_token, notebook_id, section_name))
+    if cached_id:
+        print(f"✅ 找到分区 (缓存): {section_name}")
+        return cached_id
+
+    graph = get_async_client()
     
-    # 获取笔记本的所有分区
-    sections_url = f"https://graph.microsoft.com/v1.0/me/onenote/notebooks/{notebook_id}/sections"
-    resp = requests.get(sections_url, headers=headers)
+    # 按名称查找分区 (由服务端过滤，只返回 id 和名称)
+    sections_url = f"me/onenote/notebooks/{notebook_id}/sections"
+    resp = await graph.get(sections_url, access_token, params={
+        "$filter": f"displayName eq {odata_quote(section_name)}",
+        "$select": "id,displayName",
+    })
     
+    if resp.status_code == 404:
+        raise StaleIdError(f"笔记本不存在: {notebook_id}")
     if resp.status_code != 200:
         print("❌ 获取分区失败")
         print(resp.text)
-        exit(1)
+        raise RuntimeError(f"获取分区失败: {resp.status_code}")
     
     sections = resp.json().get("value", [])
     
@@ -123,112 +163,178 @@ def get_or_create_section(access_token, notebook_id, section_name):
     for section in sections:
         if section.get("displayName") == section_name:
             print(f"✅ 找到分区: {section_name}")
+            await asyncio.to_thread(_onenote_cache().set, _section_key(access_token, notebook_id, section_name),
+                                    section["id"])
             return section["id"]
     
     # 创建新分区
     print(f"📑 创建新分区: {section_name}")
-    create_resp = requests.post(
+    create_resp = await graph.post(
         sections_url,
-        headers=headers,
+        access_token,
         json={"displayName": section_name}
     )
     
     if create_resp.status_code == 201:
         section_id = create_resp.json()["id"]
         print(f"✅ 分区创建成功: {section_id}")
+        await asyncio.to_thread(_onenote_cache().set, _section_key(access_token, notebook_id, section_name), section_id)
         return section_id
     else:
         print("❌ 创建分区失败")
         print(create_resp.text)
-        exit(1)
+        raise RuntimeError(f"创建分区失败: {create_resp.status_code}")
+
+
+def get_or_create_section(access_token, notebook_id, section_name):
+    return aio.run(get_or_create_section_async(access_token, notebook_id, section_name))
+
+
+# ========== 解析月份分区 (缓存失效时自动修复) ==========
+async def resolve_section_async(access_token, section_name, notebook_name="MyNotes"):
+    """
+    返回分区 ID。缓存的笔记本 ID 已失效 (列分区返回 404) 时，
+    清除该笔记本的缓存并重新查找一次。
+    """
+    with phase("resolve"):
+        notebook_id = await get_or_create_notebook_async(access_token, notebook_name)
+        try:
+            return await get_or_create_section_async(access_token, notebook_id, section_name)
+        except StaleIdError as e:
+            print(f"♻️  {e}，刷新笔记本缓存")
+            await asyncio.to_thread(_onenote_cache().delete, _notebook_key(access_token, notebook_name))
+            notebook_id = await get_or_create_notebook_async(access_token, notebook_name)
+            return await get_or_create_section_async(access_token, notebook_id, section_name)
+
+
+def resolve_section(access_token, section_name, notebook_name="MyNotes"):
+    return aio.run(resolve_section_async(access_token, section_name, notebook_name))
+
+
+def forget_section(access_token, section_name, notebook_name="MyNotes"):
+    """清除某个分区的缓存 ID (创建页面返回 404 时调用)。"""
+    notebook_id = _onenote_cache().get(_notebook_key(access_token, notebook_name))
+    if notebook_id:
+        _onenote_cache().delete(_section_key(access_token, notebook_id, section_name))
+
+
+# ========== 已有页面 (补建时跳过) ==========
+def existing_page_days(access_token, section_id):
+    """返回分区中已有页面的日期集合 ("DD"，取自 "DD日HH:MM" 形式的页面标题)。"""
+    days = set()
+    params = {"$select": "title", "$top": 100}
+    for page in iter_pages(access_token, f"me/onenote/sections/{section_id}/pages", params):
+        for item in page.get("value", []):
+            title = item.get("title") or ""
+            if len(title) >= 3 and title[2] == "日" and title[:2].isdigit():
+                days.add(title[:2])
+    return days
 
 
 # ========== 获取 OneDrive 图片 ==========
-def get_random_image_from_onedrive(access_token):
-    headers = {"Authorization": f"Bearer {access_token}"}
-    
-    # 获取 Pictures/Unsplash 目录下的文件
-    folder_path = "Pictures/Unsplash"
-    encoded_path = requests.utils.quote(folder_path)
-    url = f"https://graph.microsoft.com/v1.0/me/drive/root:/{encoded_path}:/children"
-    
-    resp = requests.get(url, headers=headers)
-    
-    if resp.status_code != 200:
-        print(f"❌ 获取 OneDrive 图片失败: {resp.status_code}")
-        print(resp.text)
-        return None
-    
-    files = resp.json().get("value", [])
-    
-    # 过滤出图片文件
-    image_files = [f for f in files if f.get("file") and any(f["name"].lower().endswith(ext) for ext in ['.jpg', '.jpeg', '.png', '.gif', '.webp'])]
-    
-    if not image_files:
+def pick_onedrive_image(access_token, day=None):
+    """返回 (driveItem, 下载链接)，找不到图片时返回 (None, None)。day 为 YYYYMMDD，默认今天。"""
+    # 尝试获取当天的图片（文件名需以 YYYYMMDD 开头），找不到时使用最新的图片。
+    # 先查本地图片目录 (按日期索引)，目录里没有当天的图片时才列出 Pictures/Unsplash。
+    today_str = day or beijing_now().strftime("%Y%m%d")
+
+    selected_image, download_url = select_daily_image(access_token, today_str)
+    if not selected_image:
         print("❌ OneDrive 中没有找到图片")
-        return None
-    
-    # 按文件名排序（假设文件名以日期开头，如 YYYYMMDD_HHMMSS_xxx.jpg）
-    image_files.sort(key=lambda x: x["name"], reverse=True)
-    
-    # 尝试获取当天的图片（文件名需以 YYYYMMDD 开头）
-    beijing_time = datetime.now(timezone.utc).astimezone(ZoneInfo("Asia/Shanghai"))
-    today_str = beijing_time.strftime("%Y%m%d")
-    
-    # 尝试找到当天的图片
-    today_image = None
-    for img in image_files:
-        if img["name"].startswith(today_str):
-            today_image = img
-            break
-    
-    # 如果找不到当天的图片，使用最新的图片
-    selected_image = today_image if today_image else image_files[0]
+        return None, None
     
     print(f"✅ 选择图片: {selected_image['name']}")
-    
-    # 获取图片的下载链接
-    return selected_image.get("@microsoft.graph.downloadUrl")
+    return selected_image, download_url
 
 
-# ========== 创建 OneNote 页面 ==========
-def create_page(access_token, profile_info):
-    def generate_joke():
-        try:
-            headers = {"Accept": "application/json"}
-            resp = requests.get("https://icanhazdadjoke.com/", headers=headers)
-            if resp.status_code == 200:
-                return html.escape(resp.json()["joke"])
-            else:
-                return "加载笑话失败 🥲"
-        except Exception:
-            return "获取笑话异常 🥲"
+def get_random_image_from_onedrive(access_token):
+    # 图片的下载链接
+    return pick_onedrive_image(access_token)[1]
 
-    # 获取北京时间
-    current_time = datetime.now(timezone.utc).astimezone(ZoneInfo("Asia/Shanghai"))
-    
-    # 页面标题格式：DD日HH:MM
-    title = current_time.strftime("%d日%H:%M")
-    
+
+# ========== 页面图片 ==========
+def _thumbnail_url(access_token, item_id):
+    resp = get_client().get(f"me/drive/items/{item_id}/thumbnails/0/{ONENOTE_THUMBNAIL_SIZE}", access_token)
+    if resp.status_code != 200:
+        raise RuntimeError(f"获取缩略图失败: {resp.status_code}")
+    return resp.json()["url"]
+
+
+def _preview_bytes(access_token, item):
+    """优先使用 unsplash_to_onedrive 生成的预览图，没有时使用 OneDrive 缩略图。"""
+    preview_id = find_preview_id(access_token, item["name"])
+    if preview_id:
+        resp = get_client().get(f"me/drive/items/{preview_id}/content", access_token, timeout=30)
+        if resp.status_code == 200:
+            return resp.content, resp.headers.get("Content-Type", "image/webp")
+    resp = get_client().get(f"me/drive/items/{item['id']}/thumbnails/0/{ONENOTE_THUMBNAIL_SIZE}/content",
+                            access_token, timeout=30)
+    if resp.status_code != 200:
+        raise RuntimeError(f"下载缩略图失败: {resp.status_code}")
+    return resp.content, resp.headers.get("Content-Type", "image/jpeg")
+
+
+def prepare_page_image(access_token, mode=None, day=None):
+    """
+    按 ONENOTE_IMAGE_MODE 准备页面中的图片，返回 (图片 HTML, multipart 图片部件或 None)。
+    缩略图 / 预览图获取失败时退回到原图下载链接。
+    """
+    mode = mode or ONENOTE_IMAGE_MODE
+    item, download_url = pick_onedrive_image(access_token, day)
+    if not item:
+        return NO_IMAGE_HTML, None
+
+    try:
+        if mode == "thumbnail":
+            src = _thumbnail_url(access_token, item["id"])
+            return f'<img src="{html.escape(src)}" alt="每日图片" />', None
+        if mode == "multipart":
+            data, content_type = _preview_bytes(access_token, item)
+            print(f"🖼️  以二进制部件嵌入图片 ({len(data) // 1024} KB)")
+            return '<img src="name:imageBlock1" alt="每日图片" />', (data, content_type)
+    except Exception as e:
+        print(f"⚠️  {e}，改用原图链接")
+
+    if not download_url:
+        return NO_IMAGE_HTML, None
+    return f'<img src="{html.escape(download_url)}" alt="每日图片" />', None
+
+
+# ========== 获取笑话 ==========
+def _fetch_joke():
+    headers = {"Accept": "application/json"}
+    resp = get_client().get("https://icanhazdadjoke.com/", headers=headers, timeout=10)
+    if resp.status_code != 200:
+        return None
+    return resp.json().get("joke") or None
+
+
+def generate_joke():
+    """返回一条笑话 (已转义)：使用上次预取的内容并在后台预取下一条，全部失败时返回提示语。"""
+    joke = cached("joke", _fetch_joke)
+    return html.escape(joke) if joke else "获取笑话异常 🥲"
+
+
+# ========== 北京时间 ==========
+def beijing_now():
+    return datetime.now(timezone.utc).astimezone(ZoneInfo("Asia/Shanghai"))
+
+
+def as_beijing(when):
+    """把 when 转换为北京时间；不带时区的 datetime 视为北京时间。"""
+    if when.tzinfo is None:
+        return when.replace(tzinfo=ZoneInfo("Asia/Shanghai"))
+    return when.astimezone(ZoneInfo("Asia/Shanghai"))
+
+
+def section_name_for(when):
     # 月份分区名称：YYYY年MM月
-    section_name = current_time.strftime("%Y年%m月")
-    
-    joke = generate_joke()
-    
-    # 获取或创建笔记本和分区
-    notebook_id = get_or_create_notebook(access_token, "MyNotes")
-    section_id = get_or_create_section(access_token, notebook_id, section_name)
-    
-    # 获取 OneDrive 图片
-    image_url = get_random_image_from_onedrive(access_token)
-    
-    # 图片 HTML
-    image_html = ""
-    if image_url:
-        image_html = f'<img src="{html.escape(image_url)}" alt="每日图片" />'
-    else:
-        image_html = '<p>未找到图片</p>'
-    
+    return when.strftime("%Y年%m月")
+
+
+# ========== 创建 OneNote 页面 ==========
+def build_page_html(title, current_time, joke, image_html, profile_info):
+    """拼接页面的 XHTML (笑话与图片 HTML 已转义，个人资料在这里转义)。"""
     # 🔹 个人资料拼接成表格
     profile_html = ""
     if profile_info:
@@ -239,7 +345,7 @@ def create_page(access_token, profile_info):
                 profile_html += f"<tr><td>{html.escape(k)}</td><td>{html.escape(str(v))}</td></tr>"
         profile_html += "</table>"
 
-    page_content = f"""<!DOCTYPE html>
+    return f"""<!DOCTYPE html>
 <html xmlns="http://www.w3.org/1999/xhtml">
   <head>
     <title>{title}</title>
@@ -253,36 +359,102 @@ def create_page(access_token, profile_info):
   </body>
 </html>"""
 
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/xhtml+xml"
+
+def page_body(page_content, image_part=None):
+    """创建页面请求的 body 参数 (带图片部件时为 multipart/form-data)。"""
+    if image_part:
+        # multipart/form-data：页面 HTML 必须放在名为 Presentation 的部件里
+        data, content_type = image_part
+        return {"files": {
+            "Presentation": (None, page_content.encode("utf-8"), "application/xhtml+xml"),
+            "imageBlock1": ("image", data, content_type),
+        }}
+    return {"headers": {"Content-Type": "application/xhtml+xml"}, "data": page_content}
+
+
+async def create_page_async(access_token, profile_info, when=None, section_id=None):
+    """
+    创建一页日记，返回页面链接 (失败为 None)。
+    when 为页面对应的时间 (默认当前北京时间，补建历史页面时传入该天)；
+    section_id 为调用方已解析好的月份分区，省略时按 when 所在月份查找。
+    """
+    # 获取北京时间
+    current_time = as_beijing(when) if when else beijing_now()
+    
+    # 页面标题格式：DD日HH:MM
+    title = current_time.strftime("%d日%H:%M")
+    
+    section_name = section_name_for(current_time)
+    
+    # 笑话、分区解析、OneDrive 图片互不依赖，并发获取 (笑话和图片依赖本地缓存 / 图片目录，在线程中执行)
+    tasks = {
+        "joke": lambda: asyncio.to_thread(generate_joke),
+        "image": lambda: asyncio.to_thread(prepare_page_image, access_token, None, current_time.strftime("%Y%m%d")),
     }
+    if section_id is None:
+        tasks["section"] = lambda: resolve_section_async(access_token, section_name)
+    last_joke = await asyncio.to_thread(last_value, "joke")
+    with phase("gather"):
+        inputs = await gather_async(
+            tasks,
+            timeouts=SOURCE_TIMEOUTS,
+            fallbacks={"joke": html.escape(last_joke or "获取笑话异常 🥲"), "image": (NO_IMAGE_HTML, None)},
+        )
+    joke = inputs["joke"]
+    section_id = section_id or inputs["section"]
+    
+    # 图片 HTML (multipart 模式下还有随页面提交的图片数据)
+    image_html, image_part = inputs["image"]
+    page_content = build_page_html(title, current_time, joke, image_html, profile_info)
+
+    async def post_page(section_id):
+        url = f"me/onenote/sections/{section_id}/pages"
+        return await get_async_client().post(url, access_token, **page_body(page_content, image_part))
 
     # 创建页面到指定分区
-    response = requests.post(
-        f"https://graph.microsoft.com/v1.0/me/onenote/sections/{section_id}/pages",
-        headers=headers,
-        data=page_content
-    )
+    with phase("create"):
+        response = await post_page(section_id)
+
+    # 缓存的分区已被删除：清除缓存、重新解析后重试一次
+    if response.status_code == 404:
+        print("♻️  缓存的分区已失效，重新查找分区")
+        await asyncio.to_thread(forget_section, access_token, section_name)
+        section_id = await resolve_section_async(access_token, section_name)
+        with phase("create"):
+            response = await post_page(section_id)
 
     if response.status_code == 201:
+        page_url = response.json()["links"]["oneNoteWebUrl"]["href"]
         print("✅ 成功创建 OneNote 页面：")
-        print(response.json()["links"]["oneNoteWebUrl"]["href"])
-    else:
-        print("❌ 页面创建失败")
-        print(response.status_code)
-        print(response.text)
+        print(page_url)
+        return page_url
+    print("❌ 页面创建失败")
+    print(response.status_code)
+    print(response.text)
+    return None
 
 
+def create_page(access_token, profile_info, when=None, section_id=None):
+    return aio.run(create_page_async(access_token, profile_info, when, section_id))
 
 
 # ========== 主函数 ==========
+def run():
+    """获取 Token 和个人资料后创建今天的 OneNote 页面，返回页面链接 (失败为 None)。"""
+    with phase("token"):
+        token = get_access_token()
+    with phase("profile"):
+        profile_info = get_my_profile(token)   # 获取个人资料
+    return create_page(token, profile_info)  # 创建页面时附带资料表格
+
+
+def main(delay=True):
+    """脚本入口：开启统计，随机延迟 5-30 秒后创建今天的页面。"""
+    metrics.install("create_notebook")
+    if delay:
+        job_delay("note")
+    return run()
+
+
 if __name__ == "__main__":
-    # 🔹 随机延迟 5-30 秒
-    delay = random.randint(5, 30)
-    print(f"⏳ 随机延迟 {delay} 秒后开始执行...")
-    time.sleep(delay)
-    
-    token = get_access_token()
-    profile_info = get_my_profile(token)   # 获取个人资料
-    create_page(token, profile_info)       # 创建页面时附带资料表格
\ No newline at end of file
+    main()
\ No newline at end of file
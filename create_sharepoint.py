@@ -1,96 +1,210 @@
-import os
-import requests
 import html
-import time
-import random
 import json
-from datetime import datetime
+import asyncio
+import hashlib
+from datetime import datetime, timedelta
 try:
     from zoneinfo import ZoneInfo
 except ImportError:
     from backports.zoneinfo import ZoneInfo
 
+import aio
+from aio import get_async_client
+from fanout import gather
+from accounts import setting
+from config import job_delay
+from content_cache import cached, last_value
+from create_notebook import as_beijing
+from graph_client import GRAPH_BETA, get_client, get_access_token, account_key, odata_quote
+from json_cache import JsonCache
+from image_catalog import select_daily_image
+from onedrive_listing import iter_pages
+import metrics
+from metrics import phase
+
 # ================= 配置区域 =================
 DEFAULT_LAT = "39.9042"
 DEFAULT_LON = "116.4074"
+DEFAULT_QUOTE = {"content": "心系一处，守口如瓶。", "from": "Unknown"}
 
-# ========== 工具函数：获取 access_token ==========
-def get_access_token():
-    if not os.environ.get("CLIENT_ID"):
-        print("❌ [错误] 环境变量 CLIENT_ID 未找到")
-        exit(1)
-    client_id = os.environ["CLIENT_ID"]
-    client_secret = os.environ["CLIENT_SECRET"]
-    tenant_id = os.environ["TENANT_ID"]
-    refresh_token = os.environ["GRAPH_REFRESH_TOKEN"]
-    
-    token_url = f"https://login.microsoftonline.com/{tenant_id}/oauth2/v2.0/token"
-    data = {
-        "client_id": client_id,
-        "client_secret": client_secret,
-        "grant_type": "refresh_token",
-        "refresh_token": refresh_token,
-        "scope": "https://graph.microsoft.com/.default offline_access"
-    }
-    try:
-        resp = requests.post(token_url, data=data, timeout=10)
-        if resp.status_code != 200:
-            print(f"❌ 获取 access_token 失败: {resp.status_code}")
-            exit(1)
-        return resp.json()["access_token"]
-    except Exception as e:
-        print(f"❌ 获取 Token 异常: {e}")
-        exit(1)
+# upsert 模式固定当天的天气和一言，记录保留的天数
+PINNED_DAYS = 31
+# 各数据源的最长等待时间 (秒)，超时使用兜底值
+SOURCE_TIMEOUTS = {"weather": 12, "quote": 8, "image": 25, "site": 30}
+
+# open-meteo 的 weather_code (WMO 天气代码)
+WEATHER_CODES = {
+    0: "晴", 1: "晴间多云", 2: "多云", 3: "阴", 45: "雾", 48: "雾凇",
+    51: "小毛毛雨", 53: "毛毛雨", 55: "大毛毛雨", 56: "冻毛毛雨", 57: "冻毛毛雨",
+    61: "小雨", 63: "中雨", 65: "大雨", 66: "冻雨", 67: "冻雨",
+    71: "小雪", 73: "中雪", 75: "大雪", 77: "米雪",
+    80: "小阵雨", 81: "阵雨", 82: "强阵雨", 85: "小阵雪", 86: "阵雪",
+    95: "雷阵雨", 96: "雷阵雨伴冰雹", 99: "强雷阵雨伴冰雹",
+}
 
 # ========== 数据获取 ==========
-def get_weather():
-    lat = os.environ.get("LATITUDE", DEFAULT_LAT)
-    lon = os.environ.get("LONGITUDE", DEFAULT_LON)
+def _fetch_weather(lat, lon, day=None):
     url = "https://api.open-meteo.com/v1/forecast"
     params = {"latitude": lat, "longitude": lon, "daily": "weather_code,temperature_2m_max,temperature_2m_min", "current_weather": "true", "timezone": "auto"}
-    try:
-        resp = requests.get(url, params=params, timeout=10)
-        if resp.status_code == 200:
-            data = resp.json()
-            daily = data.get("daily", {})
-            current = data.get("current_weather", {})
-            return {"temp_now": current.get("temperature"), "temp_max": daily.get("temperature_2m_max", ["-"])[0], "temp_min": daily.get("temperature_2m_min", ["-"])[0], "desc": "多云"}
-    except Exception: pass
-    return None
+    if day:
+        params.update({"start_date": day, "end_date": day})
+        del params["current_weather"]
+    resp = get_client().get(url, params=params, timeout=10)
+    if resp.status_code != 200:
+        return None
+    data = resp.json()
+    daily = data.get("daily", {})
+    current = data.get("current_weather", {})
+    code = (daily.get("weather_code") or [None])[0]
+    return {"temp_now": current.get("temperature"), "temp_max": daily.get("temperature_2m_max", ["-"])[0], "temp_min": daily.get("temperature_2m_min", ["-"])[0], "desc": WEATHER_CODES.get(code, "")}
+
+
+def _weather_source(day=None):
+    """返回天气在内容缓存中的 (数据源, 键)：按坐标区分，历史日期单独缓存。"""
+    key = f"{setting('LATITUDE', DEFAULT_LAT)},{setting('LONGITUDE', DEFAULT_LON)}"
+    return ("weather_history", f"{key}:{day}") if day else ("weather", key)
+
+
+def get_weather(day=None):
+    """
+    day 为 YYYY-MM-DD 时返回当天的最高 / 最低气温 (补建历史页面用，没有实时气温)。
+    结果带磁盘缓存 (content_cache)：上游慢或失败时使用缓存的旧数据，都没有时返回 None。
+    """
+    lat = setting("LATITUDE", DEFAULT_LAT)
+    lon = setting("LONGITUDE", DEFAULT_LON)
+    source, key = _weather_source(day)
+    return cached(source, lambda: _fetch_weather(lat, lon, day), key)
+
+
+def weather_fallback(day=None):
+    """并发获取超时时使用的天气：缓存中最近一次的数据。"""
+    return last_value(*_weather_source(day))
+
+
+def _fetch_hitokoto():
+    resp = get_client().get("https://v1.hitokoto.cn/?c=d&c=i&c=k", timeout=5)
+    if resp.status_code != 200:
+        return None
+    data = resp.json()
+    if not data.get("hitokoto"):
+        return None
+    return {"content": data["hitokoto"], "from": data.get("from") or "Unknown"}
+
 
 def get_hitokoto():
-    try:
-        resp = requests.get("https://v1.hitokoto.cn/?c=d&c=i&c=k", timeout=5)
-        if resp.status_code == 200:
-            data = resp.json()
-            return {"content": data.get("hitokoto"), "from": data.get("from")}
-    except Exception: pass
-    return {"content": "心系一处，守口如瓶。", "from": "Unknown"}
+    """返回一条一言：使用上次预取的内容并在后台预取下一条，全部失败时使用默认语录。"""
+    return cached("hitokoto", _fetch_hitokoto) or dict(DEFAULT_QUOTE)
 
-# ========== 核心逻辑：创建 SharePoint 页面 ==========
-def create_sharepoint_page(access_token, image_url, weather_data, quote_data):
-    headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
-
-    # 1. 查找站点
-    target_site_name = os.environ.get("SHAREPOINT_SITE_NAME")
-    site_id = None
-    if target_site_name:
-        print(f"🔍 搜索站点: '{target_site_name}'")
-        search_resp = requests.get(f"https://graph.microsoft.com/v1.0/sites?search={target_site_name}", headers=headers)
-        if search_resp.status_code == 200 and search_resp.json().get("value"):
-            site_id = search_resp.json()["value"][0]["id"]
+
+def quote_fallback():
+    return last_value("hitokoto") or dict(DEFAULT_QUOTE)
+
+# ========== 站点 ID 缓存 ==========
+def _sharepoint_cache():
+    return JsonCache("sharepoint")
+
+
+def _site_key(access_token, site_name):
+    # 未配置站点名时使用根站点，同样缓存
+    return f"{account_key(access_token)}:site:{site_name or '(root)'}"
+
+
+def _search_site(graph, access_token, site_name):
+    """搜索站点，优先返回名称完全一致的结果。"""
+    print(f"🔍 搜索站点: '{site_name}'")
+    search_resp = graph.get("sites", access_token, params={"search": site_name, "$select": "id,name,displayName"})
+    if search_resp.status_code != 200:
+        return None
+    sites = search_resp.json().get("value", [])
+    for site in sites:
+        if site_name.lower() in ((site.get("name") or "").lower(), (site.get("displayName") or "").lower()):
+            return site["id"]
+    return sites[0]["id"] if sites else None
+
+
+# ========== 查找站点 ==========
+def resolve_site(access_token):
+    """
+    返回站点 ID。缓存的 ID 用一次轻量的 /sites/{id}?$select=id 校验，
+    只有未缓存或校验返回 404 时才搜索站点 (或读取根站点)。
+    """
+    with phase("resolve"):
+        graph = get_client()
+        target_site_name = setting("SHAREPOINT_SITE_NAME")
+        key = _site_key(access_token, target_site_name)
+
+        cached_id = _sharepoint_cache().get(key)
+        if cached_id:
+            check = graph.get(f"sites/{cached_id}", access_token, params={"$select": "id"})
+            if check.status_code == 200:
+                print(f"✅ 锁定站点 (缓存): {cached_id}")
+                return cached_id
+            if check.status_code != 404:
+                # 临时错误时沿用缓存，不为此多付一次搜索
+                print(f"⚠️ 校验站点失败 ({check.status_code})，沿用缓存的站点")
+                return cached_id
+            print("♻️ 缓存的站点已不存在，重新查找")
+            _sharepoint_cache().delete(key)
+
+        if target_site_name:
+            site_id = _search_site(graph, access_token, target_site_name)
+            if not site_id:
+                print("❌ 没找到站点")
+                return None
             print(f"✅ 锁定站点: {site_id}")
         else:
-            print("❌ 没找到站点"); return
-    else:
-        print("⚠️ 使用 Root 站点")
-        site_id = requests.get("https://graph.microsoft.com/v1.0/sites/root", headers=headers).json()["id"]
+            print("⚠️ 使用 Root 站点")
+            site_id = graph.get("sites/root", access_token, params={"$select": "id"}).json()["id"]
+        _sharepoint_cache().set(key, site_id)
+        return site_id
+
+
+def forget_site(access_token):
+    """清除缓存的站点 ID (在站点上创建页面返回 404 时调用)。"""
+    _sharepoint_cache().delete(_site_key(access_token, setting("SHAREPOINT_SITE_NAME")))
 
-    now = datetime.now(ZoneInfo("Asia/Shanghai"))
-    page_name = f"Report{now.strftime('%Y%m%d%H%M')}.aspx"
+# ========== 已有页面 (补建时跳过) ==========
+def existing_report_days(access_token, site_id):
+    """返回站点中已有晨报页面的日期集合 ("YYYYMMDD"，取自 ReportYYYYMMDD.aspx / ReportYYYYMMDDHHMM.aspx)。"""
+    days = set()
+    url = f"{GRAPH_BETA}/sites/{site_id}/pages"
+    for page in iter_pages(access_token, url, {"$select": "name"}):
+        for item in page.get("value", []):
+            name = item.get("name") or ""
+            if name.startswith("Report") and name[6:14].isdigit():
+                days.add(name[6:14])
+    return days
+
+
+# ========== 核心逻辑：创建 SharePoint 页面 ==========
+async def create_sharepoint_page_async(access_token, image, weather_data, quote_data, site_id=None, when=None):
+    """
+    创建并发布晨报页面，返回页面链接 (失败为 None)。
+    image 为 get_today_image() 的结果 ({"id", "url"} 或 None)；when 为页面对应的北京时间，默认当前时间。
+    """
+    graph = get_async_client()
+
+    # 1. 查找站点 (调用方已并发解析时直接使用；站点 ID 有磁盘缓存，在线程中解析)
+    if site_id is None:
+        site_id = await asyncio.to_thread(resolve_site, access_token)
+    if not site_id:
+        return None
+
+    # 不带时区的 when 视为北京时间 (与 OneNote 页面一致，不受运行机器时区影响)
+    now = as_beijing(when) if when else datetime.now(ZoneInfo("Asia/Shanghai"))
+    upsert = page_mode() == "upsert"
+    # upsert 模式每天一个固定名称的页面；create 模式每次新建带时间的页面
+    page_name = f"Report{now.strftime('%Y%m%d' if upsert else '%Y%m%d%H%M')}.aspx"
     title_text = f"{now.strftime('%d日')} | 每日晨报"
     
-    weather_html = f"<strong>{weather_data['temp_now']}°C</strong> ({weather_data['temp_min']}° ~ {weather_data['temp_max']}°)" if weather_data else "暂无数据"
+    if not weather_data:
+        weather_html = "暂无数据"
+    elif weather_data.get("temp_now") is None:
+        weather_html = f"<strong>{weather_data['temp_min']}° ~ {weather_data['temp_max']}°</strong>"
+    else:
+        weather_html = f"<strong>{weather_data['temp_now']}°C</strong> ({weather_data['temp_min']}° ~ {weather_data['temp_max']}°)"
+    if weather_data and weather_data.get("desc"):
+        weather_html += f" {html.escape(weather_data['desc'])}"
     quote_html = f"“{html.escape(quote_data['content'])}” —— {html.escape(quote_data['from'])}"
 
     # 🟢 构造 HTML 内容
@@ -147,64 +261,259 @@ def create_sharepoint_page(access_token, image_url, weather_data, quote_data):
         }
     }
     
-    if image_url:
-        payload["titleArea"]["imageWebUrl"] = image_url
+    if image:
+        payload["titleArea"]["imageWebUrl"] = image["url"]
+
+    if upsert:
+        # 内容指纹只取稳定的输入：下载链接每次都带新的 tempauth，用图片的 driveItem ID 代替
+        fingerprint = {"name": page_name, "title": title_text, "html": content_html,
+                       "image": image["id"] if image else None}
+        return await upsert_sharepoint_page_async(access_token, site_id, payload, fingerprint)
 
     print("📝 正在发布 SharePoint 页面...")
     
-    create_url = f"https://graph.microsoft.com/beta/sites/{site_id}/pages"
-    resp = requests.post(create_url, headers=headers, json=payload)
+    create_url = f"{GRAPH_BETA}/sites/{site_id}/pages"
+    with phase("create"):
+        resp = await graph.post(create_url, access_token, json=payload)
     
     if resp.status_code in [200, 201]:
         print("✅ 页面创建成功！")
         
         # 发布
-        page_item_id = resp.json()["id"]
-        publish_url = f"https://graph.microsoft.com/beta/sites/{site_id}/pages/{page_item_id}/publish"
-        requests.post(publish_url, headers=headers)
+        page = resp.json()
+        if not await publish_page_async(access_token, site_id, page["id"]):
+            return None
         
-        pub_url = resp.json().get("webUrl")
-        print("🚀 页面已发布！")
+        pub_url = page.get("webUrl")
         print(f"🔗 链接: {pub_url}")
-        
+        return pub_url
+
+    print(f"❌ 创建失败: {resp.status_code}")
+    print(f"🔍 错误详情: {resp.text}")
+    if resp.status_code == 404:
+        await asyncio.to_thread(forget_site, access_token)
+    return None
+
+
+def create_sharepoint_page(access_token, image, weather_data, quote_data, site_id=None, when=None):
+    return aio.run(create_sharepoint_page_async(access_token, image, weather_data, quote_data, site_id, when))
+
+
+# ========== 幂等更新 (upsert) ==========
+def page_mode():
+    """SHAREPOINT_PAGE_MODE：create (默认，每次新建页面) 或 upsert (每天一个页面，重复运行只更新)。"""
+    return (setting("SHAREPOINT_PAGE_MODE") or "create").lower()
+
+
+def _page_key(access_token, site_id, page_name):
+    return f"{account_key(access_token)}:page:{site_id}:{page_name}"
+
+
+def _content_hash(fingerprint):
+    return hashlib.sha256(json.dumps(fingerprint, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+# ========== 当天的天气 / 一言 ==========
+def _inputs_key(access_token, day):
+    return f"{account_key(access_token)}:inputs:{day}"
+
+
+def pinned_inputs(access_token, day):
+    """返回 day (YYYYMMDD) 已固定的天气 / 一言 ({"weather", "quote"} 中已有的部分)。create 模式不固定。"""
+    if page_mode() != "upsert":
+        return {}
+    return _sharepoint_cache().get(_inputs_key(access_token, day)) or {}
+
+
+def pin_inputs(access_token, day, inputs):
+    """
+    固定 day 的天气和一言：同一天重复运行生成相同的页面内容，不会因为新的一言或实时气温重新发布。
+    获取失败 (没有天气、默认语录) 的不固定，下次运行重新获取；超过 PINNED_DAYS 天的记录顺便清理。
+    """
+    if page_mode() != "upsert":
+        return
+    values = {}
+    if inputs.get("weather"):
+        values["weather"] = inputs["weather"]
+    if inputs.get("quote") and inputs["quote"] != DEFAULT_QUOTE:
+        values["quote"] = inputs["quote"]
+    prefix = f"{account_key(access_token)}:inputs:"
+    oldest = (datetime.strptime(day, "%Y%m%d") - timedelta(days=PINNED_DAYS)).strftime("%Y%m%d")
+    with _sharepoint_cache().locked() as data:
+        for key in [k for k in data if k.startswith(prefix) and k[len(prefix):] < oldest]:
+            del data[key]
+        key = _inputs_key(access_token, day)
+        data[key] = dict(data.get(key) or {}, **values)
+
+
+def gather_inputs(access_token, day, tasks, weather_day=None):
+    """
+    并发获取页面素材：tasks 之外再加上 day 尚未固定的天气 / 一言，获取后固定下来。
+    weather_day 为 YYYY-MM-DD 时获取历史天气 (补建用)。返回 {名称: 结果}。
+    """
+    pinned = pinned_inputs(access_token, day)
+    tasks = dict(tasks)
+    if "weather" not in pinned:
+        tasks["weather"] = lambda: get_weather(weather_day)
+    if "quote" not in pinned:
+        tasks["quote"] = get_hitokoto
+    inputs = gather(
+        tasks,
+        timeouts=SOURCE_TIMEOUTS,
+        fallbacks={"weather": weather_fallback(weather_day), "quote": quote_fallback(), "image": None},
+    )
+    inputs.update(pinned)
+    pin_inputs(access_token, day, inputs)
+    return inputs
+
+
+def _list_all_pages(access_token, url):
+    return [item for page in iter_pages(access_token, url, {"$select": "id,name,webUrl"})
+            for item in page.get("value", [])]
+
+
+async def find_page_async(access_token, site_id, page_name):
+    """按名称查找站点中的页面，返回 {"id", "webUrl"} 或 None。"""
+    url = f"{GRAPH_BETA}/sites/{site_id}/pages"
+    resp = await get_async_client().get(
+        url, access_token, params={"$filter": f"name eq {odata_quote(page_name)}", "$select": "id,name,webUrl"})
+    if resp.status_code == 200:
+        pages = resp.json().get("value", [])
     else:
-        print(f"❌ 创建失败: {resp.status_code}")
+        # 不支持 $filter 时逐页查找
+        pages = await asyncio.to_thread(_list_all_pages, access_token, url)
+    for item in pages:
+        if item.get("name") == page_name:
+            return {"id": item["id"], "webUrl": item.get("webUrl")}
+    return None
+
+
+async def publish_page_async(access_token, site_id, page_id):
+    """发布页面并检查结果。"""
+    with phase("publish"):
+        resp = await get_async_client().post(
+            f"{GRAPH_BETA}/sites/{site_id}/pages/{page_id}/microsoft.graph.sitePage/publish", access_token)
+    if resp.status_code in (200, 202, 204):
+        print("🚀 页面已发布！")
+        return True
+    print(f"❌ 发布失败: {resp.status_code}")
+    print(f"🔍 错误详情: {resp.text}")
+    return False
+
+
+async def upsert_sharepoint_page_async(access_token, site_id, payload, fingerprint):
+    """
+    按固定的页面名称创建或更新当天的页面，返回页面链接 (失败为 None)：
+    已有页面时只 PATCH 标题和画布，内容指纹 (fingerprint，决定页面内容的稳定输入) 与上次发布时相同则什么都不做，
+    只有内容变化 (或上次发布失败) 时才重新发布。超时后重试不会产生重复页面。
+    """
+    graph = get_async_client()
+    page_name = payload["name"]
+    key = _page_key(access_token, site_id, page_name)
+    content_hash = _content_hash(fingerprint)
+    pages_url = f"{GRAPH_BETA}/sites/{site_id}/pages"
+
+    # 本地记录的读写都在线程中执行 (文件锁)，不阻塞事件循环
+    record = await asyncio.to_thread(_sharepoint_cache().get, key)
+    if record and record.get("hash") == content_hash and record.get("published"):
+        # 只确认页面还在 (一个轻量请求)，不再 PATCH / 发布
+        with phase("resolve"):
+            resp = await graph.get(f"{pages_url}/{record['id']}", access_token, params={"$select": "id"})
+        if resp.status_code != 404:
+            print(f"⏭️  页面内容没有变化，跳过更新: {page_name}")
+            return record.get("webUrl")
+        record = None
+
+    if record:
+        page = {"id": record["id"], "webUrl": record.get("webUrl")}
+    else:
+        with phase("resolve"):
+            page = await find_page_async(access_token, site_id, page_name)
+
+    update = {k: payload[k] for k in ("@odata.type", "title", "titleArea", "canvasLayout")}
+    for _ in range(2):
+        if page:
+            print(f"📝 正在更新 SharePoint 页面: {page_name}")
+            with phase("create"):
+                resp = await graph.patch(f"{pages_url}/{page['id']}/microsoft.graph.sitePage", access_token, json=update)
+            if resp.status_code == 404:
+                # 页面已被删除：重新创建
+                await asyncio.to_thread(_sharepoint_cache().delete, key)
+                page = None
+                continue
+        else:
+            print(f"📝 正在创建 SharePoint 页面: {page_name}")
+            with phase("create"):
+                resp = await graph.post(pages_url, access_token, json=payload)
+            if resp.status_code == 409:
+                # 同名页面已存在 (例如上次请求超时但实际已创建)：改为更新
+                with phase("resolve"):
+                    page = await find_page_async(access_token, site_id, page_name)
+                if page:
+                    continue
+            elif resp.status_code in (200, 201):
+                page = {"id": resp.json()["id"], "webUrl": resp.json().get("webUrl")}
+        break
+
+    if resp.status_code not in (200, 201, 204):
+        print(f"❌ 保存失败: {resp.status_code}")
         print(f"🔍 错误详情: {resp.text}")
+        if resp.status_code == 404:
+            await asyncio.to_thread(forget_site, access_token)
+        return None
+    print("✅ 页面已保存！")
+
+    published = await publish_page_async(access_token, site_id, page["id"])
+    # 发布失败时不记录为已发布，下次运行即使内容相同也会重新发布
+    await asyncio.to_thread(_sharepoint_cache().set, key, {"id": page["id"], "webUrl": page.get("webUrl"),
+                                                           "hash": content_hash, "published": published})
+    if not published:
+        return None
+    print(f"🔗 链接: {page.get('webUrl')}")
+    return page.get("webUrl")
 
 # ========== 图片获取 ==========
-def get_today_image_url(access_token):
+def get_today_image(access_token, day=None):
+    """返回 day (YYYYMMDD，默认今天) 的图片 {"id": driveItem ID, "url": 下载链接}，没有图片时返回 None。"""
     try:
-        headers = {"Authorization": f"Bearer {access_token}"}
-        folder = "Pictures/Unsplash"
-        encoded_path = requests.utils.quote(folder)
-        url = f"https://graph.microsoft.com/v1.0/me/drive/root:/{encoded_path}:/children"
-        resp = requests.get(url, headers=headers, timeout=20)
+        # 先查本地图片目录 (按日期索引)，没有当天的图片时才列出 OneDrive 目录
+        beijing_now = datetime.now(ZoneInfo("Asia/Shanghai"))
+        today_prefix = day or beijing_now.strftime("%Y%m%d")
+        selected, download_url = select_daily_image(access_token, today_prefix)
         
-        if resp.status_code == 200:
-            files = resp.json().get("value", [])
-            images = [f for f in files if f.get("file")]
-            images.sort(key=lambda x: x["name"], reverse=True)
-            
-            beijing_now = datetime.now(ZoneInfo("Asia/Shanghai"))
-            today_prefix = beijing_now.strftime("%Y%m%d")
-            selected = next((img for img in images if img["name"].startswith(today_prefix)), images[0] if images else None)
-            
-            if selected:
-                return selected.get("@microsoft.graph.downloadUrl")
+        if selected and download_url:
+            return {"id": selected["id"], "url": download_url}
     except Exception:
         pass
     return None
 
 # ========== 主程序 ==========
-if __name__ == "__main__":
+def run():
+    """并发获取页面素材并创建今天的 SharePoint 页面，返回页面链接 (失败为 None)。"""
+    with phase("token"):
+        token = get_access_token()
+    # 天气、一言、今日图片、站点互不依赖，并发获取 (当天已固定的天气 / 一言不再获取)
+    today = datetime.now(ZoneInfo("Asia/Shanghai")).strftime("%Y%m%d")
+    with phase("gather"):
+        inputs = gather_inputs(token, today, {
+            "image": lambda: get_today_image(token),
+            "site": lambda: resolve_site(token),
+        })
+    return create_sharepoint_page(token, inputs["image"], inputs["weather"], inputs["quote"], inputs["site"] or "")
+
+
+def main(delay=True):
+    """脚本入口：开启统计，随机延迟 1-3 秒后创建今天的页面。"""
+    metrics.install("create_sharepoint")
     print("🚀 启动 SharePoint 生成器 (大小写修正版)...")
-    time.sleep(random.randint(1, 3))
+    if delay:
+        job_delay("page")
     try:
-        token = get_access_token()
-        weather = get_weather()
-        quote = get_hitokoto()
-        img_url = get_today_image_url(token)
-        create_sharepoint_page(token, img_url, weather, quote)
+        return run()
     except Exception as e:
         print(f"❌ 脚本错误: {e}")
-        exit(1)
\ No newline at end of file
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
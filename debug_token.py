@@ -1,18 +1,17 @@
 import os
-import requests
 import json
-from dotenv import load_dotenv
 
-def test_token():
+from config import SECRETS_FILE, load_secrets
+
+def test_token(secrets_file=SECRETS_FILE):
     print("🔍 开始 Token 诊断程序...")
     
     # 1. 加载 my.secrets 文件
-    if os.path.exists('my.secrets'):
-        load_dotenv('my.secrets')
-        print("✅ 成功加载 my.secrets 文件")
+    if load_secrets(secrets_file):
+        print(f"✅ 成功加载 {secrets_file} 文件")
     else:
-        print("❌ 错误：未找到 my.secrets 文件！请确保它在当前目录下。")
-        return
+        print(f"❌ 错误：未找到 {secrets_file} 文件！请确保它在当前目录下。")
+        return False
 
     # 2. 检查必要变量是否存在
     client_id = os.getenv("CLIENT_ID")
@@ -22,22 +21,22 @@ def test_token():
 
     if not all([client_id, client_secret, refresh_token]):
         print("❌ 错误：my.secrets 文件中缺少必要变量（CLIENT_ID, CLIENT_SECRET 或 GRAPH_REFRESH_TOKEN）")
-        return
+        return False
 
     # 3. 尝试用 Refresh Token 换取 Access Token
     print("\n🔄 正在尝试向微软请求新的 Access Token...")
-    token_url = f"https://login.microsoftonline.com/{tenant_id}/oauth2/v2.0/token"
-    
-    data = {
+    credentials = {
         "client_id": client_id,
         "client_secret": client_secret,
-        "grant_type": "refresh_token",
+        "tenant_id": tenant_id,
         "refresh_token": refresh_token,
-        "scope": "https://graph.microsoft.com/.default"
     }
 
+    # 诊断只用到 Token 请求，确认配置齐全后再导入网络相关模块
+    from graph_client import request_token
+
     try:
-        resp = requests.post(token_url, data=data, timeout=10)
+        resp = request_token(credentials, scope="https://graph.microsoft.com/.default")
         
         # 4. 分析结果
         if resp.status_code == 200:
@@ -49,6 +48,7 @@ def test_token():
             
             # 5. 进一步验证：尝试调用一下 /me 接口确保权限正常
             verify_permissions(access_token)
+            return True
             
         else:
             print(f"\n❌ 认证失败！HTTP 状态码: {resp.status_code}")
@@ -60,12 +60,14 @@ def test_token():
 
     except Exception as e:
         print(f"\n❌ 请求发生异常: {e}")
+    return False
 
 def verify_permissions(access_token):
+    from graph_client import get_client
+
     print("\n🕵️ 正在测试 API 权限 (读取个人资料)...")
-    headers = {"Authorization": f"Bearer {access_token}"}
     try:
-        me_resp = requests.get("https://graph.microsoft.com/v1.0/me", headers=headers, timeout=10)
+        me_resp = get_client().get("me", access_token, timeout=10)
         if me_resp.status_code == 200:
             profile = me_resp.json()
             print(f"✅ API 调用成功！你好，{profile.get('displayName')} ({profile.get('userPrincipalName')})")
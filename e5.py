@@ -0,0 +1,110 @@
+import os
+import sys
+import argparse
+
+from config import SECRETS_FILE, job_delay, load_secrets
+
+# ==============================================================================
+# 统一命令行入口：python -m e5 <子命令>
+# 各子命令的模块在执行时才导入：--help 不会导入 requests，debug-token / login 只加载各自用到的模块
+# ==============================================================================
+
+
+def _prefetch(module):
+    """在后台线程中导入模块 (与随机延迟重叠)，返回等待导入完成并取得模块的函数。"""
+    import importlib
+    import threading
+
+    result = {}
+
+    def load():
+        try:
+            result["module"] = importlib.import_module(module)
+        except BaseException as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=load, name=f"import-{module}", daemon=True)
+    thread.start()
+
+    def wait():
+        thread.join()
+        if "error" in result:
+            raise result["error"]
+        return result["module"]
+    return wait
+
+
+# ========== 子命令 ==========
+def cmd_note(args):
+    module = _prefetch("create_notebook")
+    if not args.no_delay:
+        job_delay("note")
+    return 0 if module().main(delay=False) else 1
+
+
+def cmd_page(args):
+    module = _prefetch("create_sharepoint")
+    if not args.no_delay:
+        job_delay("page")
+    return 0 if module().main(delay=False) else 1
+
+
+def cmd_sync_images(args):
+    # IMAGE_COUNT 在模块导入时读取，需要先写入环境变量
+    if args.count is not None:
+        os.environ["IMAGE_COUNT"] = str(args.count)
+    import unsplash_to_onedrive
+
+    succeeded, total = unsplash_to_onedrive.main()
+    return 0 if succeeded > 0 or total == 0 else 1
+
+
+def cmd_debug_token(args):
+    import debug_token
+
+    return 0 if debug_token.test_token(args.secrets) else 1
+
+
+def cmd_login(args):
+    import get_refresh_token
+
+    return get_refresh_token.main(args.secrets)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m e5", description="Microsoft 365 E5 自动化脚本")
+    parser.add_argument("--secrets", default=SECRETS_FILE,
+                        help=f"本地凭据文件 (KEY=VALUE 格式，存在时加载，不覆盖已有的环境变量)，默认 {SECRETS_FILE}")
+    # 子命令后面也可以写 --secrets (未写时沿用上一级的值)
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--secrets", default=argparse.SUPPRESS, help=argparse.SUPPRESS)
+    sub = parser.add_subparsers(dest="command", required=True, metavar="<子命令>")
+
+    note = sub.add_parser("note", parents=[common], help="创建今天的 OneNote 页面")
+    note.add_argument("--no-delay", action="store_true", help="跳过 5-30 秒的随机延迟")
+    note.set_defaults(func=cmd_note)
+
+    page = sub.add_parser("page", parents=[common], help="创建并发布今天的 SharePoint 晨报")
+    page.add_argument("--no-delay", action="store_true", help="跳过 1-3 秒的随机延迟")
+    page.set_defaults(func=cmd_page)
+
+    images = sub.add_parser("sync-images", parents=[common], help="把 Unsplash 随机壁纸同步到 OneDrive")
+    images.add_argument("--count", type=int, help="本次同步的图片数量 (默认 IMAGE_COUNT 或 5)")
+    images.set_defaults(func=cmd_sync_images)
+
+    debug = sub.add_parser("debug-token", parents=[common], help="诊断 Refresh Token 和 API 权限")
+    debug.set_defaults(func=cmd_debug_token)
+
+    login = sub.add_parser("login", parents=[common], help="在浏览器中登录，获取新的 Refresh Token")
+    login.set_defaults(func=cmd_login)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    load_secrets(args.secrets)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+
+def bind_context(fn):
+    """
+    把 fn 绑定到调用时的上下文 (当前账号、metrics 阶段等 ContextVar)。
+    线程池里的任务不会继承提交方的 ContextVar，提交前用它包装一下；
+    每次调用都在上下文的副本中执行，同一个包装函数可以被多个线程同时调用。
+    """
+    context = contextvars.copy_context()
+
+    def wrapper(*args, **kwargs):
+        return context.copy().run(fn, *args, **kwargs)
+
+    return wrapper
+
+
+# ========== 并发收集多个独立数据源 ==========
+def gather(tasks, timeouts=None, fallbacks=None):
+    """
+    并发执行互不依赖的任务，返回 {名称: 结果}。
+    tasks:     {名称: 无参可调用对象}
+    timeouts:  {名称: 秒数}，从开始并发时计时；未列出的任务不限时
+    fallbacks: {名称: 兜底值}，列出的任务出错或超时返回兜底值；
+               未列出的任务视为必需，其异常原样抛出
+    超时的任务不会等待其结束，整体耗时约等于最慢的必需任务或最长的超时。
+    """
+    timeouts = timeouts or {}
+    fallbacks = fallbacks or {}
+    results = {}
+
+    executor = ThreadPoolExecutor(max_workers=max(len(tasks), 1), thread_name_prefix="gather")
+    try:
+        started = time.monotonic()
+        futures = {name: executor.submit(bind_context(fn)) for name, fn in tasks.items()}
+        for name, future in futures.items():
+            remaining = None
+            if timeouts.get(name) is not None:
+                remaining = max(0.0, timeouts[name] - (time.monotonic() - started))
+            try:
+                results[name] = future.result(timeout=remaining)
+            except FutureTimeout:
+                if name not in fallbacks:
+                    raise
+                print(f"⏱️  {name} 超过 {timeouts[name]} 秒未返回，使用兜底值")
+                results[name] = fallbacks[name]
+            except Exception as e:
+                if name not in fallbacks:
+                    raise
+                print(f"⚠️  {name} 获取失败，使用兜底值: {e}")
+                results[name] = fallbacks[name]
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return results
+
+
+async def gather_async(tasks, timeouts=None, fallbacks=None):
+    """
+    gather() 的 asyncio 版本 (见 aio.py)：tasks 的值为无参的协程函数，timeouts / fallbacks 含义相同。
+    协程在当前任务的上下文副本中执行，无需 bind_context；超时或出错后仍未结束的任务会被取消。
+    """
+    import asyncio
+
+    timeouts = timeouts or {}
+    fallbacks = fallbacks or {}
+    results = {}
+
+    started = time.monotonic()
+    futures = {name: asyncio.ensure_future(fn()) for name, fn in tasks.items()}
+    try:
+        for name, future in futures.items():
+            remaining = None
+            if timeouts.get(name) is not None:
+                remaining = max(0.0, timeouts[name] - (time.monotonic() - started))
+            try:
+                results[name] = await asyncio.wait_for(future, remaining)
+            except asyncio.TimeoutError:
+                if name not in fallbacks:
+                    raise
+                print(f"⏱️  {name} 超过 {timeouts[name]} 秒未返回，使用兜底值")
+                results[name] = fallbacks[name]
+            except Exception as e:
+                if name not in fallbacks:
+                    raise
+                print(f"⚠️  {name} 获取失败，使用兜底值: {e}")
+                results[name] = fallbacks[name]
+    finally:
+        for future in futures.values():
+            future.cancel()
+    return results
@@ -7,26 +7,36 @@ import sys
 import time
 import threading
 import os
-from dotenv import load_dotenv
 
 # ================= 配置区域 =================
-# 1. 尝试加载 my.secrets 文件
-if os.path.exists('my.secrets'):
-    load_dotenv('my.secrets')
-    print("✅ 已加载 my.secrets 文件")
-else:
-    print("⚠️ 未找到 my.secrets 文件，将使用手动输入或系统环境变量")
-
-# 2. 从环境变量(secrets)中获取，如果没有则留空，稍后会要求手动输入
-CLIENT_ID = os.getenv("CLIENT_ID", "")
-CLIENT_SECRET = os.getenv("CLIENT_SECRET", "")
-TENANT_ID = os.getenv("TENANT_ID", "common")  # 默认为 common
-
-# 3. 端口必须与 Azure 注册的回调地址一致
+# 端口必须与 Azure 注册的回调地址一致
 PORT = 8000
 REDIRECT_URI = f"http://localhost:{PORT}" 
+SECRETS_FILE = "my.secrets"
 # ===========================================
 
+def load_secrets(path=SECRETS_FILE):
+    """
+    把 KEY=VALUE 格式的 secrets 文件加载到环境变量 (已存在的变量不覆盖)，文件不存在时返回 False。
+    本脚本需要能单独下载运行，所以不依赖 config.py (完整解析见 config.parse_secrets)。
+    """
+    if not os.path.exists(path):
+        return False
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#") or "=" not in line:
+                continue
+            key, value = line.split("=", 1)
+            key = key.strip()
+            if key.startswith("export "):
+                key = key[len("export "):].strip()
+            value = value.strip()
+            if len(value) >= 2 and value[0] == value[-1] and value[0] in "\"'":
+                value = value[1:-1]
+            os.environ.setdefault(key, value)
+    return True
+
 auth_code = None
 
 class OAuthHandler(http.server.SimpleHTTPRequestHandler):
@@ -127,17 +137,27 @@ def get_refresh_token(client_id, client_secret, tenant_id):
         print("\n❌ 获取失败，错误信息：")
         print(json_resp)
 
-if __name__ == "__main__":
+def main(secrets_file=SECRETS_FILE):
+    # 1. 尝试加载 my.secrets 文件
+    if load_secrets(secrets_file):
+        print(f"✅ 已加载 {secrets_file} 文件")
+    else:
+        print(f"⚠️ 未找到 {secrets_file} 文件，将使用手动输入或系统环境变量")
+
     print("--- Microsoft Graph API Refresh Token 获取助手 ---")
     
-    # 优先使用 secrets 里的值，如果没有则提示输入
-    c_id = CLIENT_ID if CLIENT_ID else input("请输入 Client ID (应用程序ID): ").strip()
-    c_secret = CLIENT_SECRET if CLIENT_SECRET else input("请输入 Client Secret (客户端密码): ").strip()
-    t_id = TENANT_ID if TENANT_ID else input("请输入 Tenant ID (直接回车默认为 common): ").strip() or "common"
+    # 2. 优先使用 secrets / 环境变量里的值，如果没有则提示输入
+    c_id = os.getenv("CLIENT_ID") or input("请输入 Client ID (应用程序ID): ").strip()
+    c_secret = os.getenv("CLIENT_SECRET") or input("请输入 Client Secret (客户端密码): ").strip()
+    t_id = os.getenv("TENANT_ID", "common") or input("请输入 Tenant ID (直接回车默认为 common): ").strip() or "common"
     
     if not c_id or not c_secret:
         print("❌ 错误：必须提供 Client ID 和 Client Secret")
-        sys.exit(1)
+        return 1
 
     get_refresh_token(c_id, c_secret, t_id)
-    input("\n按回车键退出...")
\ No newline at end of file
+    input("\n按回车键退出...")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,338 @@
+import os
+import json
+import time
+import base64
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+import throttle
+from accounts import current_account, setting
+from token_cache import TokenCache, TokenError, cache_enabled
+
+# ================= 配置区域 =================
+GRAPH_BASE = "https://graph.microsoft.com/v1.0"
+GRAPH_BETA = "https://graph.microsoft.com/beta"
+GRAPH_HOST = "https://graph.microsoft.com/"
+AAD_HOST = "https://login.microsoftonline.com/"
+
+# (连接超时, 读取超时)，调用方可以按请求覆盖
+DEFAULT_TIMEOUT = (10, 30)
+# 每个主机保留的长连接数量；Graph 是主要目标，给更大的池
+GRAPH_POOL_SIZE = 16
+DEFAULT_POOL_SIZE = 4
+# Graph $batch 单次最多 20 个子请求
+BATCH_LIMIT = 20
+
+
+# 每个请求结束后依次调用 hook(method, url, response, 耗时秒数, stream)；请求异常时 response 为 None
+_request_hooks = []
+
+
+def add_request_hook(hook):
+    """注册请求钩子 (见 metrics.py)，对所有 GraphClient / AsyncGraphClient 生效。"""
+    _request_hooks.append(hook)
+
+
+def run_request_hooks(method, url, response, seconds, stream=False):
+    for hook in _request_hooks:
+        hook(method, url, response, seconds, stream)
+
+
+# ========== 连接池 Session ==========
+def build_session(graph_pool_size=GRAPH_POOL_SIZE, default_pool_size=DEFAULT_POOL_SIZE):
+    """
+    创建带长连接池的 requests.Session。
+    Graph 和 AAD 单独挂载更大的连接池，其余主机 (Unsplash / open-meteo 等) 使用默认池。
+    """
+    session = requests.Session()
+    session.headers.update({"Accept-Encoding": "gzip, deflate"})
+
+    default_adapter = HTTPAdapter(pool_connections=default_pool_size, pool_maxsize=default_pool_size)
+    session.mount("https://", default_adapter)
+    session.mount("http://", default_adapter)
+    session.mount(GRAPH_HOST, HTTPAdapter(pool_connections=1, pool_maxsize=graph_pool_size))
+    session.mount(AAD_HOST, HTTPAdapter(pool_connections=1, pool_maxsize=2))
+
+    # 离线测试：所有请求改发到本地模拟服务器 (见 mock_server.py / benchmark.py)
+    mock_server = os.environ.get("E5_MOCK_SERVER")
+    if mock_server:
+        from mock_server import redirect_session
+        redirect_session(session, mock_server)
+    return session
+
+
+# ========== $batch 子响应 ==========
+class BatchResponse:
+    """$batch 中单个子请求的响应，提供与 requests.Response 相同的常用属性。"""
+
+    def __init__(self, status_code, headers=None, body=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.body = body
+
+    def json(self):
+        if isinstance(self.body, (dict, list)):
+            return self.body
+        return json.loads(self.body or "null")
+
+    @property
+    def text(self):
+        if isinstance(self.body, (dict, list)):
+            return json.dumps(self.body, ensure_ascii=False)
+        return self.body or ""
+
+
+# ========== OData 查询参数 ==========
+def odata_quote(value):
+    """把字符串写成 $filter 中的字符串字面量：两侧加单引号，内部的单引号写两次。"""
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+# ========== Graph 客户端 ==========
+class GraphClient:
+    """
+    所有脚本共用的 HTTP 客户端：复用同一个连接池，统一默认超时和 Graph 基础地址。
+    path 以 http 开头时按绝对地址请求 (用于 beta 端点、第三方接口、下载链接等)。
+    所有请求都经过 throttle 按资源限流，429/503/504 时按 Retry-After 退避重试 (POST 等非幂等请求见 throttle.should_retry)。
+    """
+
+    def __init__(self, base_url=GRAPH_BASE, timeout=DEFAULT_TIMEOUT, session=None):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.session = session or build_session()
+
+    def url(self, path):
+        if path.startswith("http://") or path.startswith("https://"):
+            return path
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def request(self, method, path, access_token=None, headers=None, **kwargs):
+        merged_headers = dict(headers or {})
+        if access_token:
+            merged_headers["Authorization"] = f"Bearer {access_token}"
+        kwargs.setdefault("timeout", self.timeout)
+        url = self.url(path)
+        started = time.monotonic()
+        resp = None
+        try:
+            resp = throttle.send(url, lambda: self.session.request(method, url, headers=merged_headers, **kwargs),
+                                 method=method)
+            return resp
+        finally:
+            run_request_hooks(method, url, resp, time.monotonic() - started, kwargs.get("stream", False))
+
+    def get(self, path, access_token=None, **kwargs):
+        return self.request("GET", path, access_token, **kwargs)
+
+    def post(self, path, access_token=None, **kwargs):
+        return self.request("POST", path, access_token, **kwargs)
+
+    def put(self, path, access_token=None, **kwargs):
+        return self.request("PUT", path, access_token, **kwargs)
+
+    def patch(self, path, access_token=None, **kwargs):
+        return self.request("PATCH", path, access_token, **kwargs)
+
+    def delete(self, path, access_token=None, **kwargs):
+        return self.request("DELETE", path, access_token, **kwargs)
+
+    def batch(self, requests_, access_token=None):
+        """
+        通过 JSON $batch 发送多个 Graph 请求，每 20 个合并为一次 HTTP 调用。
+        requests_ 中每一项为 {"method", "url", 可选 "id" / "headers" / "body" / "dependsOn"}，
+        url 相对于 base_url (如 "me/messages")。返回与输入顺序一致的 BatchResponse 列表。
+        dependsOn 引用的请求若已在前一批中完成，会自动从依赖中去掉 (批次本身按顺序执行)。
+        """
+        items = []
+        for index, req in enumerate(requests_):
+            item = {
+                "id": str(req.get("id", index + 1)),
+                "method": req.get("method", "GET").upper(),
+                "url": "/" + req["url"].lstrip("/"),
+            }
+            if req.get("body") is not None:
+                item["body"] = req["body"]
+                item["headers"] = {"Content-Type": "application/json"}
+            if req.get("headers"):
+                item["headers"] = dict(item.get("headers", {}), **req["headers"])
+            if req.get("dependsOn"):
+                item["dependsOn"] = [str(d) for d in req["dependsOn"]]
+            items.append(item)
+
+        results = {}
+        for start in range(0, len(items), BATCH_LIMIT):
+            chunk = items[start:start + BATCH_LIMIT]
+            chunk_ids = {item["id"] for item in chunk}
+            for item in chunk:
+                if "dependsOn" in item:
+                    item["dependsOn"] = [d for d in item["dependsOn"] if d in chunk_ids]
+                    if not item["dependsOn"]:
+                        del item["dependsOn"]
+            self._send_batch(chunk, access_token, results)
+
+        return [results.get(item["id"], BatchResponse(424)) for item in items]
+
+    def _send_batch(self, chunk, access_token, results):
+        """发送一批子请求；被单独限流 (429，幂等请求还有 503/504) 的子请求按 Retry-After 重新提交。"""
+        for attempt in range(throttle.MAX_RETRIES + 1):
+            resp = self.post("$batch", access_token, json={"requests": chunk})
+            if resp.status_code != 200:
+                for item in chunk:
+                    results[item["id"]] = BatchResponse(resp.status_code, dict(resp.headers), resp.text)
+                return
+
+            throttled = []
+            for sub in resp.json().get("responses", []):
+                result = BatchResponse(sub.get("status", 500), sub.get("headers"), sub.get("body"))
+                results[sub["id"]] = result
+                method = next((item["method"] for item in chunk if item["id"] == sub["id"]), "POST")
+                if throttle.should_retry(method, result.status_code, result.headers):
+                    throttled.append(result)
+            if not throttled or attempt == throttle.MAX_RETRIES:
+                return
+
+            delay = max(throttle.retry_after_seconds(r.headers, attempt) for r in throttled)
+            print(f"🐢 $batch 中 {len(throttled)} 个请求被限流，{delay:.1f} 秒后重试")
+            time.sleep(delay)
+            retry_ids = {item_id for item_id, r in results.items() if r in throttled}
+            chunk = [item for item in chunk if item["id"] in retry_ids]
+            for item in chunk:
+                if "dependsOn" in item:
+                    item["dependsOn"] = [d for d in item["dependsOn"] if d in retry_ids]
+                    if not item["dependsOn"]:
+                        del item["dependsOn"]
+
+    def close(self):
+        self.session.close()
+
+
+_default_client = None
+# 多账号模式下每个账号一个 GraphClient (各自的连接池)
+_account_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client():
+    """
+    返回进程内共享的 GraphClient (首次调用时创建)。
+    处于 accounts.use_account() 中时返回该账号专属的客户端。
+    """
+    global _default_client
+    account = current_account()
+    with _clients_lock:
+        if account is not None:
+            if account.name not in _account_clients:
+                _account_clients[account.name] = GraphClient()
+            return _account_clients[account.name]
+        if _default_client is None:
+            _default_client = GraphClient()
+        return _default_client
+
+
+def close_account_client(name):
+    """关闭并丢弃某个账号的 GraphClient (批量任务中该账号处理完毕后调用)。"""
+    with _clients_lock:
+        client = _account_clients.pop(name, None)
+    if client:
+        client.close()
+
+
+# ==============================================================================
+# 身份验证相关函数
+# ==============================================================================
+
+# ========== 读取凭据 ==========
+def load_credentials():
+    """
+    从环境变量读取 CLIENT_ID / CLIENT_SECRET / TENANT_ID / GRAPH_REFRESH_TOKEN。
+    多账号模式下优先读取当前账号的配置，并带上账号名 (用于区分 Token 缓存)。
+    缺少 CLIENT_ID 时直接退出。
+    """
+    if not setting("CLIENT_ID"):
+        print("❌ [致命错误] 环境变量 CLIENT_ID 未找到！")
+        print("   请检查：1. my.secrets 文件是否包含 CLIENT_ID")
+        print("           2. yaml 文件的 env 部分是否正确映射")
+        exit(1)
+
+    credentials = {
+        "client_id": setting("CLIENT_ID"),
+        "client_secret": setting("CLIENT_SECRET"),
+        "tenant_id": setting("TENANT_ID") or "common",
+        "refresh_token": setting("GRAPH_REFRESH_TOKEN"),
+    }
+    account = current_account()
+    if account is not None:
+        credentials["account"] = account.name
+    return credentials
+
+
+# ========== 账号标识 ==========
+def account_key(access_token):
+    """
+    返回 "tenant:user" 形式的账号标识，用于区分各类本地缓存。
+    工作/学校账号的 access_token 是 JWT，直接读取 tid/oid 声明 (不校验签名，不发请求)；
+    解析失败时 (个人账号的 Token 不是 JWT) 退回到 TENANT_ID:CLIENT_ID，
+    多账号模式下再加上账号名：同一个应用注册下的多个账号不能共用缓存。
+    """
+    try:
+        payload = access_token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return f"{claims['tid']}:{claims['oid']}"
+    except Exception:
+        key = f"{setting('TENANT_ID') or 'common'}:{setting('CLIENT_ID', '')}"
+        account = current_account()
+        return f"{key}:{account.name}" if account else key
+
+
+# ========== 用 refresh_token 请求 Token ==========
+def request_token(credentials, scope="https://graph.microsoft.com/.default offline_access"):
+    """向 AAD 发起 refresh_token 授权，返回原始响应 (调用方自行判断状态码)。"""
+    token_url = f"{AAD_HOST}{credentials['tenant_id']}/oauth2/v2.0/token"
+    data = {
+        "client_id": credentials["client_id"],
+        "client_secret": credentials["client_secret"],
+        "grant_type": "refresh_token",
+        "refresh_token": credentials["refresh_token"],
+        "scope": scope,
+    }
+    return get_client().post(token_url, data=data)
+
+
+# ========== 获取 access_token (使用 refresh_token) ==========
+def _fetch_token(credentials, refresh_token):
+    try:
+        resp = request_token(dict(credentials, refresh_token=refresh_token))
+    except Exception as e:
+        raise TokenError(f"请求 Microsoft 接口发生异常: {e}")
+    if resp.status_code != 200:
+        raise TokenError(f"获取 access_token 失败 (状态码: {resp.status_code})", resp)
+    return resp.json()
+
+
+def get_access_token():
+    """
+    使用存储在环境变量中的 refresh_token 交换新的 access_token，
+    用于访问 Microsoft Graph API。
+    启用 Token 缓存时 (默认，TOKEN_CACHE=0 关闭)，未过期的 access_token 直接复用，
+    AAD 返回的新 refresh_token 会写回缓存供下次使用。
+    """
+    credentials = load_credentials()
+
+    try:
+        if not cache_enabled():
+            print("🔄 正在使用 Refresh Token 换取 Access Token...")
+            return _fetch_token(credentials, credentials["refresh_token"])["access_token"]
+
+        cache = TokenCache(credentials)
+        if not cache.peek():
+            print("🔄 正在使用 Refresh Token 换取 Access Token...")
+        token, from_cache = cache.get_access_token(lambda rt: _fetch_token(credentials, rt))
+        if from_cache:
+            print("♻️  使用缓存的 Access Token")
+        return token
+    except TokenError as e:
+        print(f"❌ {e}")
+        if e.response is not None:
+            print(f"⚠️ 错误详情: {e.response.text}")
+        exit(1)
@@ -0,0 +1,254 @@
+import os
+import time
+import threading
+from contextlib import closing
+
+from graph_client import account_key
+from json_cache import cache_dir
+from onedrive_listing import ListingError, list_folder_files, get_download_url
+
+# ================= 配置区域 =================
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+# 目录里找不到某天的图片时重新列出 OneDrive 目录的最短间隔 (秒)：
+# 单次运行 (补建多天也一样) 最多列一次，常驻的 scheduler 每小时最多列一次
+RESYNC_INTERVAL = 3600
+
+_schema_lock = threading.Lock()
+_schema_ready = set()
+
+# 每个 (账号, 目录) 上次重新列出的时间 (time.monotonic())，以及同时只有一个线程在列出的锁
+_last_sync = {}
+_sync_locks = {}
+_sync_locks_guard = threading.Lock()
+
+
+def catalog_path():
+    return os.path.join(cache_dir(), "catalog.sqlite3")
+
+
+def _connect():
+    path = catalog_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    import sqlite3  # 首次打开目录时才导入
+
+    conn = sqlite3.connect(path, timeout=30)
+    with _schema_lock:
+        if path not in _schema_ready:
+            # 主键 (account, name) 即按文件名排序的 B 树索引：
+            # 文件名以 YYYYMMDD_HHMMSS 开头，按日期前缀的范围查询是对数复杂度
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS images (
+                    account   TEXT NOT NULL,
+                    name      TEXT NOT NULL,
+                    item_id   TEXT NOT NULL,
+                    size      INTEGER,
+                    mime_type TEXT,
+                    photo_id  TEXT,
+                    PRIMARY KEY (account, name)
+                ) WITHOUT ROWID
+            """)
+            # 已经下载过的 Unsplash 图片 (按图片 ID 与内容哈希去重)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS seen_photos (
+                    account  TEXT NOT NULL,
+                    photo_id TEXT NOT NULL,
+                    sha256   TEXT,
+                    PRIMARY KEY (account, photo_id)
+                ) WITHOUT ROWID
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS seen_photos_sha256 ON seen_photos (account, sha256)")
+            # 原图对应的小尺寸预览图 (Pictures/Unsplash/Preview 下)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS previews (
+                    account         TEXT NOT NULL,
+                    name            TEXT NOT NULL,
+                    preview_item_id TEXT NOT NULL,
+                    PRIMARY KEY (account, name)
+                ) WITHOUT ROWID
+            """)
+            conn.commit()
+            _schema_ready.add(path)
+    return conn
+
+
+def is_image(name):
+    return name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def photo_id_from_name(name):
+    """从 YYYYMMDD_HHMMSS_<id>.jpg 形式的文件名中取出 Unsplash 图片 ID。"""
+    parts = os.path.splitext(name)[0].split("_", 2)
+    return parts[2] if len(parts) == 3 else None
+
+
+def _row(account, item, photo_id=None):
+    return (
+        account,
+        item["name"],
+        item["id"],
+        item.get("size"),
+        (item.get("file") or {}).get("mimeType"),
+        photo_id or photo_id_from_name(item["name"]),
+    )
+
+
+# ========== 写入 ==========
+def record_upload(access_token, item, photo_id=None):
+    """unsplash_to_onedrive 上传成功后登记一张图片。"""
+    if not is_image(item.get("name", "")):
+        return
+    with closing(_connect()) as conn, conn:
+        conn.execute("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?)",
+                     _row(account_key(access_token), item, photo_id))
+
+
+def sync_catalog(access_token, items):
+    """用完整的目录列表覆盖该账号的目录记录。"""
+    account = account_key(access_token)
+    rows = [_row(account, item) for item in items if item.get("file") and is_image(item.get("name", ""))]
+    with closing(_connect()) as conn, conn:
+        conn.execute("DELETE FROM images WHERE account = ?", (account,))
+        conn.executemany("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+
+def record_preview(access_token, name, preview_item):
+    """登记原图 name 的预览图 driveItem。"""
+    with closing(_connect()) as conn, conn:
+        conn.execute("INSERT OR REPLACE INTO previews VALUES (?, ?, ?)",
+                     (account_key(access_token), name, preview_item["id"]))
+
+
+def find_preview_id(access_token, name):
+    with closing(_connect()) as conn:
+        row = conn.execute(
+            "SELECT preview_item_id FROM previews WHERE account = ? AND name = ?",
+            (account_key(access_token), name),
+        ).fetchone()
+    return row[0] if row else None
+
+
+def forget_item(access_token, item_id):
+    with closing(_connect()) as conn, conn:
+        conn.execute("DELETE FROM images WHERE account = ? AND item_id = ?", (account_key(access_token), item_id))
+
+
+# ========== 去重记录 ==========
+def known_photo_ids(access_token, photo_ids):
+    """返回 photo_ids 中已经下载过或已在目录中的图片 ID 集合。"""
+    photo_ids = list(photo_ids)
+    if not photo_ids:
+        return set()
+    account = account_key(access_token)
+    placeholders = ",".join("?" * len(photo_ids))
+    with closing(_connect()) as conn:
+        rows = conn.execute(
+            f"SELECT photo_id FROM seen_photos WHERE account = ? AND photo_id IN ({placeholders}) "
+            f"UNION SELECT photo_id FROM images WHERE account = ? AND photo_id IN ({placeholders})",
+            [account, *photo_ids, account, *photo_ids],
+        ).fetchall()
+    return {row[0] for row in rows}
+
+
+def hash_owner(access_token, sha256):
+    """返回已登记相同内容哈希的图片 ID，没有则返回 None。"""
+    with closing(_connect()) as conn:
+        row = conn.execute(
+            "SELECT photo_id FROM seen_photos WHERE account = ? AND sha256 = ? LIMIT 1",
+            (account_key(access_token), sha256),
+        ).fetchone()
+    return row[0] if row else None
+
+
+def mark_seen(access_token, photo_id, sha256=None):
+    with closing(_connect()) as conn, conn:
+        conn.execute("INSERT OR REPLACE INTO seen_photos VALUES (?, ?, ?)",
+                     (account_key(access_token), photo_id, sha256))
+
+
+# ========== 查询 ==========
+def _as_item(row):
+    name, item_id, size, mime_type, photo_id = row
+    return {"name": name, "id": item_id, "size": size, "file": {"mimeType": mime_type}, "photo_id": photo_id}
+
+
+def find_by_date(access_token, start_day, end_day=None):
+    """
+    返回文件名日期前缀在 [start_day, end_day] (YYYYMMDD，含两端) 范围内的图片，按文件名倒序。
+    """
+    end_day = end_day or start_day
+    # "YYYYMMDD" 之后的任意后缀都小于 "YYYYMMDD~"
+    with closing(_connect()) as conn:
+        rows = conn.execute(
+            "SELECT name, item_id, size, mime_type, photo_id FROM images "
+            "WHERE account = ? AND name >= ? AND name < ? ORDER BY name DESC",
+            (account_key(access_token), start_day, end_day + "~"),
+        ).fetchall()
+    return [_as_item(row) for row in rows]
+
+
+def find_latest(access_token, day=None):
+    """返回最新的一张图片；day (YYYYMMDD) 不为空时只取该天及以前的图片。"""
+    # 文件名以 YYYYMMDD 开头，"YYYYMMDD~" 大于该天的任意文件名
+    upper = (day or "9") + "~"
+    with closing(_connect()) as conn:
+        row = conn.execute(
+            "SELECT name, item_id, size, mime_type, photo_id FROM images "
+            "WHERE account = ? AND name < ? ORDER BY name DESC LIMIT 1",
+            (account_key(access_token), upper),
+        ).fetchone()
+    return _as_item(row) if row else None
+
+
+def _resync(access_token, folder_path):
+    """
+    重新列出 OneDrive 目录并刷新本地目录，每个账号的目录在 RESYNC_INTERVAL 内最多列一次
+    (并发调用时只有一个线程去列，其余等它完成)。返回本次是否列出过；列出失败时打印错误并返回 False。
+    """
+    key = (account_key(access_token), folder_path)
+    with _sync_locks_guard:
+        lock = _sync_locks.setdefault(key, threading.Lock())
+    with lock:
+        last = _last_sync.get(key)
+        if last is not None and time.monotonic() - last < RESYNC_INTERVAL:
+            return False
+        # 失败也计入间隔：列表出错时不在每一天上重试
+        _last_sync[key] = time.monotonic()
+        try:
+            sync_catalog(access_token, list_folder_files(access_token, folder_path))
+        except ListingError as e:
+            print(f"❌ 获取 OneDrive 图片失败: {e}")
+            return False
+        return True
+
+
+# ========== 选择当天图片 ==========
+def select_daily_image(access_token, day, folder_path="Pictures/Unsplash"):
+    """
+    返回 (driveItem, 下载链接)：优先当天 (day 为 YYYYMMDD) 的最新图片，没有则取该天以前最新的一张
+    (补建历史页面时不会用上之后的图片)。
+    先查本地目录；目录里没有当天的图片时才列出 OneDrive 目录并刷新本地目录 (见 _resync，补建多天时只列一次)。
+    目录中的记录在 OneDrive 上已不存在 (404) 时会被删除并重新选择；
+    其他错误 (限流、5xx、401 等) 不改动目录，打印错误后返回 (None, None)。
+    """
+    for _ in range(2):
+        candidates = find_by_date(access_token, day)
+        if not candidates and _resync(access_token, folder_path):
+            candidates = find_by_date(access_token, day)
+
+        selected = candidates[0] if candidates else find_latest(access_token, day)
+        if not selected:
+            return None, None
+
+        try:
+            url = get_download_url(access_token, selected)
+        except ListingError as e:
+            if e.status_code != 404:
+                # 暂时性的失败，记录本身仍然有效
+                print(f"❌ 获取图片下载链接失败: {e}")
+                return None, None
+            url = None
+        if url:
+            return selected, url
+        # 记录已失效 (文件被删除或不是文件)：从目录中移除后重试
+        forget_item(access_token, selected["id"])
+    return None, None
@@ -0,0 +1,98 @@
+import os
+import json
+import threading
+from contextlib import contextmanager
+
+# 文件锁：Linux / macOS 使用 fcntl，Windows 使用 msvcrt
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+# ================= 配置区域 =================
+# 缓存目录，可通过 E5_CACHE_DIR 覆盖 (例如指向 actions/cache 恢复的目录)
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+
+# 同一进程内按文件路径共享的线程锁
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+
+def cache_dir():
+    return os.environ.get("E5_CACHE_DIR") or DEFAULT_CACHE_DIR
+
+
+def _thread_lock(path):
+    with _thread_locks_guard:
+        return _thread_locks.setdefault(path, threading.RLock())
+
+
+# ========== 跨进程文件锁 ==========
+@contextmanager
+def _file_lock(lock_path):
+    with open(lock_path, "a+") as f:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+# ========== JSON 文件缓存 ==========
+class JsonCache:
+    """
+    存放在缓存目录下的一个 JSON 文件 (<name>.json)。
+    读取无需加锁 (写入是原子替换)；修改请使用 locked()，
+    它同时持有线程锁和文件锁，保证并发任务之间的读-改-写安全。
+    """
+
+    def __init__(self, name, directory=None, private=False):
+        self.directory = directory or cache_dir()
+        self.path = os.path.join(self.directory, f"{name}.json")
+        self.private = private
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def get(self, key, default=None):
+        return self.load().get(key, default)
+
+    @contextmanager
+    def locked(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with _thread_lock(self.path), _file_lock(self.path + ".lock"):
+            data = self.load()
+            before = json.dumps(data, sort_keys=True)
+            yield data
+            if json.dumps(data, sort_keys=True) != before:
+                self._write(data)
+
+    def set(self, key, value):
+        with self.locked() as data:
+            data[key] = value
+
+    def delete(self, key):
+        with self.locked() as data:
+            data.pop(key, None)
+
+    def _write(self, data):
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        # 含有凭据的缓存只允许当前用户读写
+        mode = 0o600 if self.private else 0o644
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,225 @@
+import os
+import re
+import sys
+import json
+import time
+import atexit
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from urllib.parse import urlsplit, unquote
+
+from accounts import current_account
+from config import env_flag
+
+# ================= 配置区域 =================
+# E5_METRICS=1 时统计每个外部请求，退出时打印汇总；
+# 设置 METRICS_DIR 时 (隐含开启) 另外写出 <job>.json 和 Prometheus textfile <job>.prom
+PROM_PREFIX = "e5"
+
+# 当前所处的阶段 (token / gather / resolve / create / publish ...)，请求按阶段归类
+_phase = ContextVar("phase", default=None)
+
+# 路径中看起来像 ID 的片段 (含数字且较长，或 SharePoint 站点 ID 这种逗号分隔的复合 ID)，统一替换为 {id}
+_ID_SEGMENT = re.compile(r"^(?:(?=[^:]*\d)[^/:{]{8,}|[^/:{]*,[^/:{]*)(:?)$")
+
+
+def endpoint_template(url):
+    """把请求地址归一化为接口模板，例如 graph.microsoft.com/v1.0/me/onenote/sections/{id}/pages。"""
+    parts = urlsplit(url)
+    path = unquote(parts.path)
+    # OneDrive 的路径寻址：root:/Pictures/Unsplash:/children -> root:/{path}:/children，
+    # 末尾没有操作时 root:/Pictures/Unsplash -> root:/{path}
+    if re.search(r":/[^:]*:", path):
+        path = re.sub(r":/[^:]*:", ":/{path}:", path)
+    else:
+        path = re.sub(r":/[^:]+$", ":/{path}", path)
+    segments = [_ID_SEGMENT.sub(r"{id}\1", seg) for seg in path.split("/")]
+    return parts.netloc + "/".join(segments)
+
+
+# ========== 统计数据 ==========
+class Recorder:
+    def __init__(self, job):
+        self.job = job
+        self.started = time.time()
+        self.started_monotonic = time.monotonic()
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.phases = {}
+
+    def observe(self, method, url, response, seconds, stream=False):
+        """GraphClient 的请求钩子：记录一个请求 (包含限流重试在内的总耗时)。"""
+        bytes_out = 0
+        status = "error"
+        bytes_in = retries = 0
+        throttle_wait = 0.0
+        if response is not None:
+            status = str(response.status_code)
+            body = getattr(response.request, "body", None)
+            if body is not None and not hasattr(body, "read"):
+                bytes_out = len(body)
+            length = response.headers.get("Content-Length")
+            if length and length.isdigit():
+                bytes_in = int(length)
+            elif not stream:
+                bytes_in = len(response.content or b"")
+            retries = getattr(response, "retries", 0)
+            throttle_wait = getattr(response, "throttle_wait", 0.0)
+
+        account = current_account()
+        key = (account.name if account else None, _phase.get() or "other", method, endpoint_template(url), status)
+        with self.lock:
+            entry = self.requests.setdefault(key, {
+                "count": 0, "seconds_total": 0.0, "seconds_max": 0.0,
+                "bytes_out": 0, "bytes_in": 0, "retries": 0, "throttle_wait": 0.0,
+            })
+            entry["count"] += 1
+            entry["seconds_total"] += seconds
+            entry["seconds_max"] = max(entry["seconds_max"], seconds)
+            entry["bytes_out"] += bytes_out
+            entry["bytes_in"] += bytes_in
+            entry["retries"] += retries
+            entry["throttle_wait"] += throttle_wait
+
+    def observe_phase(self, name, seconds):
+        with self.lock:
+            entry = self.phases.setdefault(name, {"count": 0, "seconds_total": 0.0, "seconds_max": 0.0})
+            entry["count"] += 1
+            entry["seconds_total"] += seconds
+            entry["seconds_max"] = max(entry["seconds_max"], seconds)
+
+    # ---------- 导出 ----------
+    def summary(self):
+        with self.lock:
+            endpoints = [
+                dict(zip(("account", "phase", "method", "endpoint", "status"), key), **{
+                    k: round(v, 4) if isinstance(v, float) else v for k, v in entry.items()
+                })
+                for key, entry in sorted(self.requests.items(), key=lambda kv: -kv[1]["seconds_total"])
+            ]
+            phases = {name: {k: round(v, 4) if isinstance(v, float) else v for k, v in entry.items()}
+                      for name, entry in self.phases.items()}
+        totals = {k: sum(e[k] for e in endpoints)
+                  for k in ("count", "seconds_total", "bytes_out", "bytes_in", "retries", "throttle_wait")}
+        return {
+            "job": self.job,
+            "started": self.started,
+            "wall_seconds": round(time.monotonic() - self.started_monotonic, 4),
+            "totals": totals,
+            "phases": phases,
+            "endpoints": endpoints,
+        }
+
+    def prometheus(self, summary):
+        def labels(**kw):
+            return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in kw.items() if v is not None) + "}"
+
+        metrics = [
+            ("http_requests_total", "counter", "Outbound HTTP requests", "count"),
+            ("http_request_seconds_total", "counter", "Time spent in outbound HTTP requests, including retries", "seconds_total"),
+            ("http_request_seconds_max", "gauge", "Slowest outbound HTTP request", "seconds_max"),
+            ("http_bytes_sent_total", "counter", "Request body bytes sent", "bytes_out"),
+            ("http_bytes_received_total", "counter", "Response body bytes received", "bytes_in"),
+            ("http_retries_total", "counter", "Retries after 429/503/504", "retries"),
+            ("http_throttle_wait_seconds_total", "counter", "Time spent waiting for rate limits and Retry-After", "throttle_wait"),
+        ]
+        lines = []
+        for name, kind, help_text, field in metrics:
+            lines.append(f"# HELP {PROM_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {PROM_PREFIX}_{name} {kind}")
+            for e in summary["endpoints"]:
+                lab = labels(job=self.job, account=e["account"], phase=e["phase"], method=e["method"],
+                             endpoint=e["endpoint"], status=e["status"])
+                lines.append(f"{PROM_PREFIX}_{name}{lab} {e[field]}")
+        lines.append(f"# HELP {PROM_PREFIX}_phase_seconds_total Time spent in each phase of the run")
+        lines.append(f"# TYPE {PROM_PREFIX}_phase_seconds_total counter")
+        for phase_name, e in summary["phases"].items():
+            lines.append(f"{PROM_PREFIX}_phase_seconds_total{labels(job=self.job, phase=phase_name)} {e['seconds_total']}")
+        lines.append(f"# HELP {PROM_PREFIX}_run_seconds Wall time of the run")
+        lines.append(f"# TYPE {PROM_PREFIX}_run_seconds gauge")
+        lines.append(f"{PROM_PREFIX}_run_seconds{labels(job=self.job)} {summary['wall_seconds']}")
+        lines.append(f"# HELP {PROM_PREFIX}_run_timestamp_seconds Start time of the run")
+        lines.append(f"# TYPE {PROM_PREFIX}_run_timestamp_seconds gauge")
+        lines.append(f"{PROM_PREFIX}_run_timestamp_seconds{labels(job=self.job)} {round(summary['started'], 3)}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _write_atomic(path, text):
+    # textfile collector 可能随时读取，先写临时文件再替换
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+_recorder = None
+
+
+def enabled():
+    return bool(os.environ.get("METRICS_DIR")) or env_flag("E5_METRICS")
+
+
+def get_recorder():
+    return _recorder
+
+
+# ========== 阶段计时 ==========
+@contextmanager
+def phase(name):
+    """标记一段执行阶段：统计其耗时，期间发出的请求归入该阶段。未开启统计时只切换阶段标记。"""
+    token = _phase.set(name)
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        _phase.reset(token)
+        if _recorder is not None:
+            _recorder.observe_phase(name, time.monotonic() - started)
+
+
+# ========== 开启统计 ==========
+def install(job=None):
+    """
+    按环境变量开启统计 (脚本的 __main__ 中调用)：注册 GraphClient 请求钩子，退出时输出汇总。
+    未开启时什么都不做。返回 Recorder 或 None。
+    """
+    global _recorder
+    if _recorder is not None or not enabled():
+        return _recorder
+
+    from graph_client import add_request_hook
+
+    job = job or os.path.splitext(os.path.basename(sys.argv[0] or "e5"))[0]
+    _recorder = Recorder(job)
+    add_request_hook(_recorder.observe)
+    atexit.register(report)
+    return _recorder
+
+
+def report():
+    """打印汇总；设置了 METRICS_DIR 时写出 JSON 汇总和 Prometheus textfile。"""
+    if _recorder is None:
+        return None
+    summary = _recorder.summary()
+    totals = summary["totals"]
+    print(f"\n📈 请求统计：{totals['count']} 个请求，耗时 {totals['seconds_total']:.2f}s，"
+          f"发送 {totals['bytes_out'] / 1024:.0f} KB，接收 {totals['bytes_in'] / 1024:.0f} KB，"
+          f"重试 {totals['retries']} 次，限流等待 {totals['throttle_wait']:.2f}s")
+    for name, entry in summary["phases"].items():
+        print(f"   ⏱️  {name:<8} {entry['seconds_total']:.2f}s ({entry['count']} 次)")
+    for e in summary["endpoints"][:5]:
+        print(f"   🐌 {e['method']} {e['endpoint']} [{e['status']}] ×{e['count']} {e['seconds_total']:.2f}s")
+
+    directory = os.environ.get("METRICS_DIR")
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, summary["job"])
+        _write_atomic(base + ".json", json.dumps(summary, ensure_ascii=False, indent=2))
+        _write_atomic(base + ".prom", _recorder.prometheus(summary))
+        print(f"📝 统计已写入 {base}.json / {base}.prom")
+    return summary
@@ -0,0 +1,851 @@
+import re
+import gzip
+import json
+import time
+import uuid
+import base64
+import hashlib
+import random
+import threading
+import urllib.parse
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from requests.adapters import HTTPAdapter
+
+# ================= 配置区域 =================
+MOCK_TENANT = "00000000-0000-0000-0000-00000000e5e5"
+MOCK_USER = "00000000-0000-0000-0000-0000000000aa"
+STORAGE_HOST = "mock-storage.sharepoint.com"
+# 下发图片内容时每次写出的块大小
+WRITE_BLOCK = 64 * 1024
+# 这些主机的请求会按 throttle_rate 随机返回 429
+THROTTLED_HOSTS = ("graph.microsoft.com", STORAGE_HOST)
+# 客户端接受 gzip 时，超过该大小的 JSON 响应压缩后返回 (与 Graph 一致)
+GZIP_MIN_SIZE = 1024
+
+
+class MockConfig:
+    """
+    模拟服务器的行为参数。
+    latency:       每个请求的固定延迟 (秒)，host_latency 可按主机覆盖
+    page_size:     列表接口每页条数 (超过时返回 @odata.nextLink)
+    throttle_rate: Graph 请求随机返回 429 的概率，Retry-After 为 retry_after 秒
+    image_size:    Unsplash 原图大小 (字节)；带 w 参数的缩放图按宽度缩小
+    seed_images:   Pictures/Unsplash 中预置的图片数量 (文件名按日期倒推)
+    folder_delta:  是否支持目录级 delta (商业版 OneDrive 不支持，需要回退到根目录 delta)
+    search_latency: 站点搜索 (/sites?search=) 的额外延迟，搜索是 Graph 中较慢的接口
+    gzip:          客户端带 Accept-Encoding: gzip 时是否压缩 JSON 响应
+    """
+
+    def __init__(self, latency=0.0, host_latency=None, page_size=200, throttle_rate=0.0, retry_after=0.05,
+                 image_size=4 * 1024 * 1024, seed_images=30, folder_delta=True, search_latency=0.3, gzip=True,
+                 seed=0):
+        self.latency = latency
+        self.host_latency = host_latency or {}
+        self.page_size = page_size
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.image_size = image_size
+        self.seed_images = seed_images
+        self.folder_delta = folder_delta
+        self.search_latency = search_latency
+        self.gzip = gzip
+        self.seed = seed
+
+
+# ========== 把真实主机的请求转发到模拟服务器 ==========
+class RedirectAdapter(HTTPAdapter):
+    """把 https://<host>/<path> 改写为 <模拟服务器>/<host>/<path>，其余行为与 HTTPAdapter 相同。"""
+
+    def __init__(self, base_url, **kwargs):
+        self.base_url = base_url.rstrip("/")
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        request.url = redirect_url(request.url, self.base_url)
+        return super().send(request, **kwargs)
+
+
+def redirect_url(url, base_url):
+    """把 https://<host>/<path> 改写为 <模拟服务器>/<host>/<path> (已经指向模拟服务器的地址不变)。"""
+    base_url = base_url.rstrip("/")
+    if url.startswith(base_url):
+        return url
+    parts = urllib.parse.urlsplit(url)
+    return f"{base_url}/{parts.netloc}{parts.path}" + (f"?{parts.query}" if parts.query else "")
+
+
+def redirect_session(session, base_url, pool_size=32):
+    """让 session 的全部请求都发往模拟服务器 (共用一个连接池)。"""
+    adapter = RedirectAdapter(base_url, pool_connections=1, pool_maxsize=pool_size)
+    for prefix in list(session.adapters) + ["https://", "http://"]:
+        session.mount(prefix, adapter)
+    return session
+
+
+# ========== 响应 ==========
+class Reply:
+    """stream_size 不为空时按块写出该长度的内容 (以 stream_prefix 开头，使不同资源的内容哈希不同)。"""
+
+    def __init__(self, status=200, body=None, headers=None, stream_size=None, content_type=None, stream_prefix=b""):
+        self.status = status
+        self.body = body
+        self.headers = dict(headers or {})
+        self.stream_size = stream_size
+        self.stream_prefix = stream_prefix
+        if content_type:
+            self.headers["Content-Type"] = content_type
+
+
+def _json(body, status=200, headers=None):
+    return Reply(status, json.dumps(body, ensure_ascii=False).encode("utf-8"), headers, content_type="application/json")
+
+
+def _error(status, code, message=""):
+    return _json({"error": {"code": code, "message": message}}, status)
+
+
+def _onenote_entity(kind, entity_id, name):
+    """与 Graph 相同形状的笔记本 / 分区 (包含列表里通常用不到的链接、创建者等字段)。"""
+    user = {"user": {"id": MOCK_USER, "displayName": "Mock User"}}
+    web = f"https://contoso-my.sharepoint.com/personal/mock/Documents/Notebooks/{urllib.parse.quote(name)}"
+    return {
+        "id": entity_id,
+        "self": f"https://graph.microsoft.com/v1.0/me/onenote/{kind}/{entity_id}",
+        "createdDateTime": "2024-01-01T00:00:00Z",
+        "lastModifiedDateTime": "2024-01-01T00:00:00Z",
+        "displayName": name,
+        "isDefault": False,
+        "userRole": "Owner",
+        "isShared": False,
+        "createdBy": user,
+        "lastModifiedBy": user,
+        "links": {"oneNoteClientUrl": {"href": "onenote:" + web}, "oneNoteWebUrl": {"href": web}},
+        # 笔记本带 sectionsUrl，分区带 pagesUrl
+        ("sectionsUrl" if kind == "notebooks" else "pagesUrl"):
+            f"https://graph.microsoft.com/v1.0/me/onenote/{kind}/{entity_id}/"
+            + ("sections" if kind == "notebooks" else "pages"),
+    }
+
+
+def _now():
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+
+# ========== 模拟数据 ==========
+class MockState:
+    """OneDrive / OneNote / SharePoint 的内存数据，所有修改都在 lock 下进行。"""
+
+    def __init__(self, config):
+        self.config = config
+        self.lock = threading.RLock()
+        self.items = {"root": {"id": "root", "name": "root", "folder": {"childCount": 0}, "parent": None}}
+        self.children = {"root": {}}
+        # delta 变更日志：(序号, 项目 ID)，deltaLink 中的 token 即序号
+        self.changes = []
+        self.deleted = set()
+        self.uploads = {}
+        self.notebooks = {}
+        self.sections = {}
+        self.onenote_pages = {}
+        self.site_pages = {}
+        # 被删除的站点 ID (GET /sites/{id} 返回 404)
+        self.removed_sites = set()
+        self._seed()
+
+    def new_id(self):
+        return uuid.uuid4().hex.upper()
+
+    def _seed(self):
+        pictures = self.create_folder("root", "Pictures")["id"]
+        unsplash = self.create_folder(pictures, "Unsplash")["id"]
+        # 子目录里的预览图：目录级 delta 会返回整个子树，列表时需要按父目录过滤
+        preview = self.create_folder(unsplash, "Preview")["id"]
+        rng = random.Random(self.config.seed)
+        today = time.time()
+        for i in range(self.config.seed_images):
+            stamp = time.strftime("%Y%m%d_%H%M%S", time.localtime(today - 86400 * (i + 1)))
+            photo_id = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz0123456789") for _ in range(11))
+            self.create_file(unsplash, f"{stamp}_{photo_id}.jpg", self.config.image_size, "image/jpeg")
+            self.create_file(preview, f"{stamp}_{photo_id}_preview.webp", 40 * 1024, "image/webp")
+
+    # ---------- OneDrive ----------
+    def _touch(self, item_id):
+        self.changes.append((len(self.changes) + 1, item_id))
+
+    def _add(self, parent_id, item):
+        item["parent"] = parent_id
+        item["lastModifiedDateTime"] = _now()
+        self.items[item["id"]] = item
+        self.children.setdefault(parent_id, {})[item["name"]] = item["id"]
+        self._touch(item["id"])
+        return item
+
+    def create_folder(self, parent_id, name):
+        item = {"id": self.new_id(), "name": name, "folder": {"childCount": 0}}
+        self.children[item["id"]] = {}
+        return self._add(parent_id, item)
+
+    def unique_name(self, parent_id, name, conflict="rename"):
+        siblings = self.children.get(parent_id, {})
+        if name not in siblings or conflict != "rename":
+            return name
+        stem, dot, ext = name.rpartition(".")
+        stem, ext = (stem, f".{ext}") if dot else (name, "")
+        n = 1
+        while f"{stem} {n}{ext}" in siblings:
+            n += 1
+        return f"{stem} {n}{ext}"
+
+    def create_file(self, parent_id, name, size, mime_type, conflict="rename"):
+        name = self.unique_name(parent_id, name, conflict)
+        existing = self.children.get(parent_id, {}).get(name)
+        if existing:
+            self.items[existing].update(size=size, file={"mimeType": mime_type})
+            self._touch(existing)
+            return self.items[existing]
+        return self._add(parent_id, {"id": self.new_id(), "name": name, "size": size, "file": {"mimeType": mime_type}})
+
+    def delete(self, item_id):
+        item = self.items.pop(item_id, None)
+        if item:
+            self.children.get(item["parent"], {}).pop(item["name"], None)
+            self.deleted.add(item_id)
+            self._touch(item_id)
+        return item
+
+    def resolve_path(self, path, base="root"):
+        current = base
+        for part in [p for p in urllib.parse.unquote(path).split("/") if p]:
+            current = self.children.get(current, {}).get(part)
+            if current is None:
+                return None
+        return current
+
+    def view(self, item_id):
+        """返回与 Graph 相同形状的 driveItem (包含列表里通常用不到的 eTag / 创建者 / 哈希等字段)。"""
+        item = self.items[item_id]
+        out = {k: v for k, v in item.items() if k != "parent"}
+        digest = hashlib.sha256(item_id.encode()).hexdigest()
+        user = {"user": {"email": "mock@contoso.onmicrosoft.com", "id": MOCK_USER, "displayName": "Mock User"}}
+        out.update({
+            "@odata.etag": f'"{{{item_id}}},1"',
+            "eTag": f'"{{{item_id}}},1"',
+            "cTag": f'"c:{{{item_id}}},1"',
+            "createdDateTime": item["lastModifiedDateTime"],
+            "webUrl": f"https://contoso-my.sharepoint.com/personal/mock/Documents/{item['name']}",
+            "createdBy": user,
+            "lastModifiedBy": user,
+            "fileSystemInfo": {"createdDateTime": item["lastModifiedDateTime"],
+                               "lastModifiedDateTime": item["lastModifiedDateTime"]},
+            "shared": {"scope": "users"},
+        })
+        if item.get("parent"):
+            out["parentReference"] = {"driveType": "business", "driveId": "b!" + digest[:60],
+                                      "id": item["parent"], "path": "/drive/root:"}
+        if item.get("file"):
+            out["@microsoft.graph.downloadUrl"] = f"https://{STORAGE_HOST}/download/{item_id}?tempauth=" + digest * 4
+            out["file"] = dict(item["file"], hashes={"quickXorHash": digest[:28], "sha1Hash": digest[:40].upper(),
+                                                     "sha256Hash": digest.upper()})
+            out["image"] = {"height": 2560, "width": 3840}
+        return out
+
+    def is_under(self, item_id, folder_id):
+        """item 是否在 folder 的子树中 (与 Graph 的目录级 delta 一样包含所有层级的子项)。"""
+        item = self.items.get(item_id)
+        while item and item.get("parent"):
+            if item["parent"] == folder_id:
+                return True
+            item = self.items.get(item["parent"])
+        return False
+
+
+# ========== 请求处理 ==========
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "MockGraph/1.0"
+    # 响应头和响应体分两次写出，开启 Nagle 时长连接上的每个请求都会多等一次延迟 ACK (约 40ms)
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        # 屏蔽多余的日志输出
+        return
+
+    def _handle(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+
+        host, _, rest = self.path.lstrip("/").partition("/")
+        path, _, query = rest.partition("?")
+        request = {
+            "method": self.command,
+            "host": host,
+            "path": "/" + path,
+            "query": dict(urllib.parse.parse_qsl(query, keep_blank_values=True)),
+            "headers": self.headers,
+            "body": body,
+        }
+
+        delay = server.config.host_latency.get(host, server.config.latency)
+        if delay:
+            time.sleep(delay)
+
+        if host in THROTTLED_HOSTS and server.rng_throttle():
+            reply = _json({"error": {"code": "TooManyRequests"}}, 429,
+                          {"Retry-After": str(server.config.retry_after)})
+        else:
+            try:
+                reply = server.dispatch(request)
+            except Exception as e:
+                reply = _error(500, "mockError", repr(e))
+
+        sent = self._send(reply)
+        server.record(host, reply.status, len(body), sent)
+
+    def _send(self, reply):
+        if (reply.body and len(reply.body) >= GZIP_MIN_SIZE and self.server.config.gzip
+                and reply.headers.get("Content-Type") == "application/json"
+                and "gzip" in (self.headers.get("Accept-Encoding") or "")):
+            reply.body = gzip.compress(reply.body, compresslevel=5)
+            reply.headers["Content-Encoding"] = "gzip"
+        size = reply.stream_size if reply.stream_size is not None else len(reply.body or b"")
+        self.send_response(reply.status)
+        for name, value in reply.headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(size))
+        self.end_headers()
+        if self.command == "HEAD":
+            return 0
+        if reply.stream_size is not None:
+            prefix = reply.stream_prefix[:size]
+            self.wfile.write(prefix)
+            block = b"\xff" * WRITE_BLOCK
+            remaining = size - len(prefix)
+            while remaining > 0:
+                n = min(remaining, WRITE_BLOCK)
+                self.wfile.write(block[:n])
+                remaining -= n
+        elif reply.body:
+            self.wfile.write(reply.body)
+        return size
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = do_HEAD = _handle
+
+
+# ========== 模拟服务器 ==========
+class MockServer:
+    """
+    在后台线程中运行的本地模拟服务器，模拟脚本用到的 AAD / Graph / Unsplash / 天气 / 一言 / 笑话接口。
+    session() 返回把真实主机改写到本服务器的 requests.Session；stats() 返回按主机统计的请求数和字节数。
+    """
+
+    def __init__(self, config=None, port=0):
+        self.config = config or MockConfig()
+        self.state = MockState(self.config)
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), MockHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.config = self.config
+        self.httpd.dispatch = self.dispatch
+        self.httpd.record = self.record
+        self.httpd.rng_throttle = self._rng_throttle
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self.thread = None
+        self._stats_lock = threading.Lock()
+        self._stats = {}
+        self._rng = random.Random(self.config.seed)
+        self.routes = self._build_routes()
+
+    # ---------- 生命周期 ----------
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="mock-server", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def session(self):
+        from graph_client import build_session
+        return redirect_session(build_session(), self.url)
+
+    # ---------- 统计 ----------
+    def _rng_throttle(self):
+        with self._stats_lock:
+            return self.config.throttle_rate > 0 and self._rng.random() < self.config.throttle_rate
+
+    def record(self, host, status, bytes_in, bytes_out):
+        with self._stats_lock:
+            s = self._stats.setdefault(host, {"requests": 0, "throttled": 0, "bytes_in": 0, "bytes_out": 0})
+            s["requests"] += 1
+            s["throttled"] += status == 429
+            s["bytes_in"] += bytes_in
+            s["bytes_out"] += bytes_out
+
+    def stats(self):
+        with self._stats_lock:
+            return {host: dict(s) for host, s in self._stats.items()}
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self._stats = {}
+
+    # ---------- 路由 ----------
+    def _build_routes(self):
+        g = r"/(?:v1\.0|beta)"
+        item_ref = r"(?:root|items/(?P<item>[^/:]+))"
+        return [
+            ("POST", "login.microsoftonline.com", r"/[^/]+/oauth2/v2\.0/token", self.token),
+            ("POST", "graph.microsoft.com", g + r"/\$batch", self.batch),
+            ("GET", "graph.microsoft.com", g + r"/me", self.me),
+            ("GET", "graph.microsoft.com", g + r"/me/(?:messages|events|joinedTeams)", self.empty_list),
+            ("GET", "graph.microsoft.com", g + r"/sites/root", self.site_root),
+            ("GET", "graph.microsoft.com", g + r"/sites", self.site_search),
+            # OneNote
+            ("GET", "graph.microsoft.com", g + r"/me/onenote/notebooks", self.list_notebooks),
+            ("POST", "graph.microsoft.com", g + r"/me/onenote/notebooks", self.create_notebook),
+            ("GET", "graph.microsoft.com", g + r"/me/onenote/notebooks/(?P<nb>[^/]+)/sections", self.list_sections),
+            ("POST", "graph.microsoft.com", g + r"/me/onenote/notebooks/(?P<nb>[^/]+)/sections", self.create_section),
+            ("GET", "graph.microsoft.com", g + r"/me/onenote/sections/(?P<sec>[^/]+)/pages", self.list_onenote_pages),
+            ("POST", "graph.microsoft.com", g + r"/me/onenote/sections/(?P<sec>[^/]+)/pages", self.create_onenote_page),
+            # SharePoint 页面
+            ("GET", "graph.microsoft.com", g + r"/sites/(?P<site>[^/]+)/pages", self.list_site_pages),
+            ("POST", "graph.microsoft.com", g + r"/sites/(?P<site>[^/]+)/pages", self.create_site_page),
+            ("GET", "graph.microsoft.com", g + r"/sites/(?P<site>[^/]+)/pages/(?P<page>[^/]+)(?:/microsoft\.graph\.sitePage)?", self.get_site_page),
+            ("PATCH", "graph.microsoft.com", g + r"/sites/(?P<site>[^/]+)/pages/(?P<page>[^/]+)(?:/microsoft\.graph\.sitePage)?", self.patch_site_page),
+            ("POST", "graph.microsoft.com", g + r"/sites/(?P<site>[^/]+)/pages/(?P<page>[^/]+)(?:/microsoft\.graph\.sitePage)?/publish", self.publish_site_page),
+            ("GET", "graph.microsoft.com", g + r"/sites/(?P<site>[^/]+)", self.get_site),
+            # OneDrive
+            ("POST", "graph.microsoft.com", g + r"/me/drive/" + item_ref + r":/(?P<path>[^:]+):/createUploadSession", self.create_upload_session),
+            ("PUT", "graph.microsoft.com", g + r"/me/drive/" + item_ref + r":/(?P<path>[^:]+):/content", self.simple_upload),
+            ("GET", "graph.microsoft.com", g + r"/me/drive/" + item_ref + r":/(?P<path>[^:]+):/children", self.list_children),
+            ("POST", "graph.microsoft.com", g + r"/me/drive/" + item_ref + r":/(?P<path>[^:]+):/children", self.create_child_folder),
+            ("GET", "graph.microsoft.com", g + r"/me/drive/root:/(?P<path>[^:]+):/delta", self.folder_delta),
+            ("GET", "graph.microsoft.com", g + r"/me/drive/root:/(?P<path>[^:]+):?", self.get_by_path),
+            ("GET", "graph.microsoft.com", g + r"/me/drive/root/delta", self.root_delta),
+            ("GET", "graph.microsoft.com", g + r"/me/drive/" + item_ref + r"/children", self.list_children),
+            ("POST", "graph.microsoft.com", g + r"/me/drive/" + item_ref + r"/children", self.create_child_folder),
+            ("GET", "graph.microsoft.com", g + r"/me/drive/items/(?P<item>[^/]+)/thumbnails/0/(?P<size>\w+)", self.thumbnail),
+            ("GET", "graph.microsoft.com", g + r"/me/drive/items/(?P<item>[^/]+)/thumbnails/0/(?P<size>\w+)/content", self.thumbnail_content),
+            ("GET", "graph.microsoft.com", g + r"/me/drive/items/(?P<item>[^/]+)/content", self.item_content),
+            ("GET", "graph.microsoft.com", g + r"/me/drive/items/(?P<item>[^/]+)", self.get_item),
+            ("DELETE", "graph.microsoft.com", g + r"/me/drive/items/(?P<item>[^/]+)", self.delete_item),
+            # 上传会话与下载链接 (存储主机)
+            ("PUT", STORAGE_HOST, r"/upload/(?P<sid>[^/]+)", self.upload_chunk),
+            ("GET", STORAGE_HOST, r"/upload/(?P<sid>[^/]+)", self.upload_status),
+            ("DELETE", STORAGE_HOST, r"/upload/(?P<sid>[^/]+)", self.cancel_upload),
+            ("GET", STORAGE_HOST, r"/download/(?P<item>[^/]+)", self.item_content),
+            ("GET", STORAGE_HOST, r"/thumb/(?P<item>[^/]+)", self.thumbnail_content),
+            # 第三方内容源
+            ("GET", "api.unsplash.com", r"/photos/random", self.unsplash_random),
+            ("GET", "images.unsplash.com", r"/(?P<photo>[^/]+)", self.unsplash_image),
+            ("GET", "api.open-meteo.com", r"/v1/forecast", self.weather),
+            ("GET", "v1.hitokoto.cn", r"/", self.hitokoto),
+            ("GET", "icanhazdadjoke.com", r"/", self.joke),
+        ]
+
+    def dispatch(self, request):
+        for method, host, pattern, handler in self.routes:
+            if request["method"] != method and not (method == "GET" and request["method"] == "HEAD"):
+                continue
+            if request["host"] != host:
+                continue
+            match = re.fullmatch(pattern, request["path"])
+            if match:
+                return handler(request, **{k: v for k, v in match.groupdict().items() if v is not None})
+        return _error(404, "itemNotFound", f"{request['method']} {request['host']}{request['path']}")
+
+    def _graph_url(self, request, path, **query):
+        return f"https://graph.microsoft.com{path}" + (f"?{urllib.parse.urlencode(query)}" if query else "")
+
+    def _query(self, request, values, keep=()):
+        """
+        按 $filter (只支持 <字段> eq '<值>')、$orderby (<字段> [asc|desc]) 和 $select 处理集合。
+        $select 时总会返回 id 和 keep 中的字段。
+        """
+        query = request["query"]
+        match = re.fullmatch(r"(\w+) eq '((?:[^']|'')*)'", query.get("$filter", ""))
+        if match:
+            field, value = match.group(1), match.group(2).replace("''", "'")
+            values = [v for v in values if v.get(field) == value]
+        if query.get("$orderby"):
+            field, _, direction = query["$orderby"].partition(" ")
+            values = sorted(values, key=lambda v: v.get(field) or "", reverse=direction.strip() == "desc")
+        if query.get("$select"):
+            wanted = set(query["$select"].split(",")) | {"id"} | set(keep)
+            values = [{k: v for k, v in value.items() if k in wanted} for value in values]
+        return values
+
+    def _page(self, request, values, base_path):
+        """按 page_size 分页，nextLink 使用 $skiptoken 记录偏移。"""
+        values = self._query(request, values)
+        skip = int(request["query"].get("$skiptoken", 0))
+        top = int(request["query"].get("$top", self.config.page_size))
+        size = min(top, self.config.page_size)
+        body = {"value": values[skip:skip + size]}
+        if skip + size < len(values):
+            query = {k: v for k, v in request["query"].items() if k != "$skiptoken"}
+            body["@odata.nextLink"] = self._graph_url(request, base_path, **query, **{"$skiptoken": skip + size})
+        return _json(body)
+
+    # ---------- AAD ----------
+    def token(self, request):
+        claims = {"tid": MOCK_TENANT, "oid": MOCK_USER, "exp": int(time.time()) + 3600}
+        payload = base64.urlsafe_b64encode(json.dumps(claims).encode()).decode().rstrip("=")
+        return _json({
+            "token_type": "Bearer",
+            "expires_in": 3600,
+            "access_token": f"eyJhbGciOiJub25lIn0.{payload}.mock",
+            "refresh_token": f"mock-refresh-{uuid.uuid4().hex}",
+        })
+
+    # ---------- Graph 通用 ----------
+    def batch(self, request):
+        responses = []
+        for sub in json.loads(request["body"])["requests"]:
+            path, _, query = sub["url"].lstrip("/").partition("?")
+            reply = self.dispatch({
+                "method": sub["method"],
+                "host": "graph.microsoft.com",
+                "path": "/v1.0/" + path,
+                "query": dict(urllib.parse.parse_qsl(query)),
+                "headers": sub.get("headers", {}),
+                "body": json.dumps(sub["body"]).encode() if sub.get("body") is not None else b"",
+            })
+            body = json.loads(reply.body) if reply.body else None
+            responses.append({"id": sub["id"], "status": reply.status, "headers": reply.headers, "body": body})
+        return _json({"responses": responses})
+
+    def me(self, request):
+        return _json({"id": MOCK_USER, "displayName": "Mock User", "userPrincipalName": "mock@contoso.onmicrosoft.com",
+                      "jobTitle": "Tester", "businessPhones": [], "mobilePhone": None, "officeLocation": "Lab"})
+
+    def empty_list(self, request):
+        return _json({"value": []})
+
+    def site_root(self, request):
+        return _json({"id": "contoso.sharepoint.com,root,root", "name": "root"})
+
+    def site_search(self, request):
+        time.sleep(self.config.search_latency)
+        name = request["query"].get("search", "")
+        with self.state.lock:
+            generation = sum(1 for removed in self.state.removed_sites if f",{name}," in removed)
+        suffix = f"-{generation}" if generation else ""
+        return _json({"value": [{"id": f"contoso.sharepoint.com,{name or 'root'}{suffix},site", "name": name}]})
+
+    def get_site(self, request, site):
+        site = urllib.parse.unquote(site)
+        with self.state.lock:
+            if site in self.state.removed_sites:
+                return _error(404, "itemNotFound", site)
+        return _json({"id": site})
+
+    # ---------- OneNote ----------
+    def list_notebooks(self, request):
+        with self.state.lock:
+            values = [_onenote_entity("notebooks", k, v) for k, v in self.state.notebooks.items()]
+        return self._page(request, values, request["path"])
+
+    def create_notebook(self, request):
+        name = json.loads(request["body"])["displayName"]
+        with self.state.lock:
+            notebook_id = self.state.new_id()
+            self.state.notebooks[notebook_id] = name
+        return _json({"id": notebook_id, "displayName": name}, 201)
+
+    def list_sections(self, request, nb):
+        with self.state.lock:
+            if nb not in self.state.notebooks:
+                return _error(404, "20102", "notebook not found")
+            values = [_onenote_entity("sections", k, v[1]) for k, v in self.state.sections.items() if v[0] == nb]
+        return self._page(request, values, request["path"])
+
+    def create_section(self, request, nb):
+        name = json.loads(request["body"])["displayName"]
+        with self.state.lock:
+            if nb not in self.state.notebooks:
+                return _error(404, "20102", "notebook not found")
+            section_id = self.state.new_id()
+            self.state.sections[section_id] = (nb, name)
+            self.state.onenote_pages[section_id] = []
+        return _json({"id": section_id, "displayName": name}, 201)
+
+    def list_onenote_pages(self, request, sec):
+        with self.state.lock:
+            if sec not in self.state.sections:
+                return _error(404, "20111", "section not found")
+            values = list(self.state.onenote_pages[sec])
+        return self._page(request, values, request["path"])
+
+    def create_onenote_page(self, request, sec):
+        body = request["body"]
+        content_type = request["headers"].get("Content-Type", "")
+        if content_type.startswith("multipart/"):
+            message = BytesParser(policy=HTTP).parsebytes(
+                f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+            parts = {p.get_param("name", header="content-disposition"): p for p in message.iter_parts()}
+            if "Presentation" not in parts:
+                return _error(400, "20001", "missing Presentation part")
+            body = parts["Presentation"].get_payload(decode=True)
+        title = re.search(rb"<title>(.*?)</title>", body, re.S)
+        title = title.group(1).decode("utf-8") if title else ""
+        with self.state.lock:
+            if sec not in self.state.sections:
+                return _error(404, "20111", "section not found")
+            page_id = self.state.new_id()
+            page = {"id": page_id, "title": title, "createdDateTime": _now()}
+            self.state.onenote_pages[sec].append(page)
+        return _json(dict(page, links={"oneNoteWebUrl": {"href": f"https://onenote.mock/{page_id}"}}), 201)
+
+    # ---------- SharePoint 页面 ----------
+    def list_site_pages(self, request, site):
+        with self.state.lock:
+            values = [{"id": p["id"], "name": p["name"], "title": p.get("title"), "webUrl": p["webUrl"]}
+                      for p in self.state.site_pages.values() if p["site"] == site]
+        return self._page(request, values, request["path"])
+
+    def create_site_page(self, request, site):
+        payload = json.loads(request["body"])
+        with self.state.lock:
+            if any(p["site"] == site and p["name"] == payload["name"] for p in self.state.site_pages.values()):
+                return _error(409, "nameAlreadyExists", "a page with this name already exists")
+            page_id = self.state.new_id()
+            page = dict(payload, id=page_id, site=site, webUrl=f"https://contoso.sharepoint.com/SitePages/{payload['name']}")
+            self.state.site_pages[page_id] = page
+        return _json({k: v for k, v in page.items() if k != "site"}, 201)
+
+    def get_site_page(self, request, site, page):
+        with self.state.lock:
+            data = self.state.site_pages.get(page)
+        if not data or data["site"] != site:
+            return _error(404, "itemNotFound")
+        return _json({k: v for k, v in data.items() if k != "site"})
+
+    def patch_site_page(self, request, site, page):
+        with self.state.lock:
+            data = self.state.site_pages.get(page)
+            if not data or data["site"] != site:
+                return _error(404, "itemNotFound")
+            data.update(json.loads(request["body"] or b"{}"))
+        return _json({k: v for k, v in data.items() if k != "site"})
+
+    def publish_site_page(self, request, site, page):
+        with self.state.lock:
+            if page not in self.state.site_pages:
+                return _error(404, "itemNotFound")
+            self.state.site_pages[page]["published"] = _now()
+        return Reply(204)
+
+    # ---------- OneDrive ----------
+    def _base(self, item):
+        return item or "root"
+
+    def get_by_path(self, request, path):
+        with self.state.lock:
+            item_id = self.state.resolve_path(path)
+            if item_id is None:
+                return _error(404, "itemNotFound")
+            return _json(self.state.view(item_id))
+
+    def get_item(self, request, item):
+        with self.state.lock:
+            if item not in self.state.items:
+                return _error(404, "itemNotFound")
+            return _json(self.state.view(item))
+
+    def delete_item(self, request, item):
+        with self.state.lock:
+            if not self.state.delete(item):
+                return _error(404, "itemNotFound")
+        return Reply(204)
+
+    def list_children(self, request, item=None, path=None):
+        with self.state.lock:
+            folder = self.state.resolve_path(path or "", self._base(item))
+            if folder is None or folder not in self.state.children:
+                return _error(404, "itemNotFound")
+            values = [self.state.view(i) for i in self.state.children[folder].values()]
+        return self._page(request, values, request["path"])
+
+    def create_child_folder(self, request, item=None, path=None):
+        name = json.loads(request["body"])["name"]
+        with self.state.lock:
+            parent = self.state.resolve_path(path or "", self._base(item))
+            if parent is None:
+                return _error(404, "itemNotFound")
+            if name in self.state.children.get(parent, {}):
+                return _error(409, "nameAlreadyExists")
+            return _json(self.state.view(self.state.create_folder(parent, name)["id"]), 201)
+
+    def _delta(self, request, folder_id):
+        token = int(request["query"].get("token", 0))
+        with self.state.lock:
+            latest = {}
+            for seq, item_id in self.state.changes:
+                if seq > token:
+                    latest[item_id] = seq
+            values = []
+            for item_id in latest:
+                if item_id in self.state.deleted:
+                    values.append({"id": item_id, "deleted": {"state": "deleted"}})
+                elif folder_id is None or self.state.is_under(item_id, folder_id):
+                    values.append(self.state.view(item_id))
+            head = len(self.state.changes)
+        values = self._query(request, values, keep=("deleted",))
+        skip = int(request["query"].get("$skiptoken", 0))
+        size = self.config.page_size
+        body = {"value": values[skip:skip + size]}
+        query = {k: v for k, v in request["query"].items() if k != "$skiptoken"}
+        if skip + size < len(values):
+            body["@odata.nextLink"] = self._graph_url(request, request["path"], **query, **{"$skiptoken": skip + size})
+        else:
+            # 与 Graph 一样，deltaLink 保留原来的查询参数 ($select 等)
+            query = {k: v for k, v in query.items() if k != "token"}
+            body["@odata.deltaLink"] = self._graph_url(request, request["path"], **query, token=head)
+        return _json(body)
+
+    def folder_delta(self, request, path):
+        if not self.config.folder_delta:
+            return _error(400, "invalidRequest", "delta is only supported on the root")
+        with self.state.lock:
+            folder = self.state.resolve_path(path)
+        if folder is None:
+            return _error(404, "itemNotFound")
+        return self._delta(request, folder)
+
+    def root_delta(self, request):
+        return self._delta(request, None)
+
+    def create_upload_session(self, request, path, item=None):
+        behavior = (json.loads(request["body"] or b"{}").get("item") or {}).get(
+            "@microsoft.graph.conflictBehavior", "rename")
+        with self.state.lock:
+            parent_path, _, name = urllib.parse.unquote(path).rpartition("/")
+            parent = self.state.resolve_path(parent_path, self._base(item))
+            if parent is None:
+                return _error(404, "itemNotFound")
+            session_id = uuid.uuid4().hex
+            self.state.uploads[session_id] = {"parent": parent, "name": name, "received": 0, "conflict": behavior}
+        return _json({"uploadUrl": f"https://{STORAGE_HOST}/upload/{session_id}",
+                      "expirationDateTime": _now(), "nextExpectedRanges": ["0-"]})
+
+    def upload_chunk(self, request, sid):
+        match = re.fullmatch(r"bytes (\d+)-(\d+)/(\d+)", request["headers"].get("Content-Range", ""))
+        if not match:
+            return _error(400, "invalidRange")
+        start, end, total = map(int, match.groups())
+        with self.state.lock:
+            session = self.state.uploads.get(sid)
+            if session is None:
+                return _error(404, "itemNotFound", "upload session not found")
+            if start != session["received"] or end - start + 1 != len(request["body"]):
+                return _error(416, "invalidRange", f"expected {session['received']}-")
+            session["received"] = end + 1
+            if session["received"] < total:
+                return _json({"nextExpectedRanges": [f"{session['received']}-"]}, 202)
+            del self.state.uploads[sid]
+            name = session["name"]
+            mime = "image/webp" if name.endswith(".webp") else "image/png" if name.endswith(".png") else "image/jpeg"
+            created = self.state.create_file(session["parent"], name, total, mime, session["conflict"])
+            return _json(self.state.view(created["id"]), 201)
+
+    def upload_status(self, request, sid):
+        with self.state.lock:
+            session = self.state.uploads.get(sid)
+        if session is None:
+            return _error(404, "itemNotFound")
+        return _json({"nextExpectedRanges": [f"{session['received']}-"]})
+
+    def cancel_upload(self, request, sid):
+        with self.state.lock:
+            self.state.uploads.pop(sid, None)
+        return Reply(204)
+
+    def simple_upload(self, request, path, item=None):
+        with self.state.lock:
+            parent_path, _, name = urllib.parse.unquote(path).rpartition("/")
+            parent = self.state.resolve_path(parent_path, self._base(item))
+            if parent is None:
+                return _error(404, "itemNotFound")
+            mime = request["headers"].get("Content-Type", "application/octet-stream")
+            created = self.state.create_file(parent, name, len(request["body"]), mime, conflict="replace")
+            return _json(self.state.view(created["id"]), 201)
+
+    def item_content(self, request, item):
+        with self.state.lock:
+            data = self.state.items.get(item)
+        if not data or not data.get("file"):
+            return _error(404, "itemNotFound")
+        return Reply(200, stream_size=data.get("size", 0), content_type=data["file"]["mimeType"],
+                     stream_prefix=item.encode())
+
+    def thumbnail(self, request, item, size):
+        with self.state.lock:
+            if item not in self.state.items:
+                return _error(404, "itemNotFound")
+        return _json({"url": f"https://{STORAGE_HOST}/thumb/{item}", "width": 800, "height": 450})
+
+    def thumbnail_content(self, request, item, size="large"):
+        with self.state.lock:
+            if item not in self.state.items:
+                return _error(404, "itemNotFound")
+        return Reply(200, stream_size=min(self.config.image_size, 48 * 1024), content_type="image/jpeg")
+
+    # ---------- 第三方内容源 ----------
+    def unsplash_random(self, request):
+        count = int(request["query"].get("count", 1))
+        photos = []
+        for _ in range(count):
+            photo_id = uuid.uuid4().hex[:11]
+            raw = f"https://images.unsplash.com/photo-{photo_id}?ixid=mock"
+            photos.append({
+                "id": photo_id,
+                "urls": {"raw": raw, "full": raw + "&q=85&fm=jpg", "small": raw + "&w=400"},
+                "user": {"name": "Mock Photographer"},
+                "links": {"html": f"https://unsplash.com/photos/{photo_id}"},
+            })
+        return _json(photos)
+
+    def unsplash_image(self, request, photo):
+        width = request["query"].get("w")
+        size = self.config.image_size
+        if width:
+            # 服务端缩放：按宽度粗略估算编码后的体积
+            size = min(size, int(width) * 100)
+        fmt = request["query"].get("fm", "jpg")
+        return Reply(200, stream_size=size, content_type=f"image/{'jpeg' if fmt == 'jpg' else fmt}",
+                     stream_prefix=f"{photo}?{width}".encode())
+
+    def weather(self, request):
+        return _json({
+            "current_weather": {"temperature": 18.5, "weathercode": 3},
+            "daily": {"weather_code": [3], "temperature_2m_max": [22.1], "temperature_2m_min": [12.4]},
+        })
+
+    def hitokoto(self, request):
+        return _json({"hitokoto": "模拟的每日一言。", "from": "mock"})
+
+    def joke(self, request):
+        return _json({"id": "mock", "joke": "Why did the mock server cross the road? To return 200.", "status": 200})
+
+
+if __name__ == "__main__":
+    # 单独运行时在前台提供服务，方便手动调试：E5_MOCK_SERVER=<地址> python create_notebook.py
+    import sys
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    server = MockServer(port=port)
+    print(f"🧪 模拟服务器已启动: {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
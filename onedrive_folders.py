@@ -0,0 +1,119 @@
+import threading
+import urllib.parse
+
+from config import env_flag
+from graph_client import get_client, account_key
+from json_cache import JsonCache
+from metrics import phase
+
+# 进程内缓存: (账号, 路径) -> 文件夹 driveItem ID
+_memory = {}
+_resolve_lock = threading.Lock()
+
+
+def disk_cache_enabled():
+    return env_flag("FOLDER_CACHE", True)
+
+
+def _store():
+    return JsonCache("folders")
+
+
+def _normalize(folder_path):
+    return "/".join(p for p in folder_path.split("/") if p)
+
+
+# ========== 确保 OneDrive 目录存在 ==========
+def ensure_onedrive_folder(access_token, folder_path):
+    """
+    确保 OneDrive 上的目录存在并返回其 driveItem ID。
+    先对完整路径发一次 GET，只有不存在时才逐级检查和创建。
+    """
+    graph = get_client()
+    folder_path = _normalize(folder_path)
+
+    resp = graph.get(f"me/drive/root:/{urllib.parse.quote(folder_path)}?$select=id", access_token, timeout=30)
+    if resp.status_code == 200:
+        return resp.json()["id"]
+    if resp.status_code != 404:
+        raise RuntimeError(f"检查文件夹异常: {resp.status_code} - {resp.text}")
+
+    # 分割路径
+    path_parts = folder_path.split("/")
+    current_path = ""
+    folder_id = None
+
+    # 逐级检查和创建文件夹
+    for part in path_parts:
+        parent_path = current_path
+        current_path = f"{current_path}/{part}" if current_path else part
+
+        encoded_path = urllib.parse.quote(current_path)
+        check_url = f"me/drive/root:/{encoded_path}?$select=id"
+
+        resp = graph.get(check_url, access_token, timeout=30)
+
+        if resp.status_code == 200:
+            folder_id = resp.json()["id"]
+            continue
+        elif resp.status_code == 404:
+            print(f"📁 创建文件夹: {current_path}")
+
+            if not parent_path:
+                create_url = "me/drive/root/children"
+            else:
+                encoded_parent = urllib.parse.quote(parent_path)
+                create_url = f"me/drive/root:/{encoded_parent}:/children"
+
+            data = {
+                "name": part,
+                "folder": {},
+                "@microsoft.graph.conflictBehavior": "fail"
+            }
+
+            create_resp = graph.post(create_url, access_token, json=data, timeout=30)
+
+            if create_resp.status_code == 409:
+                print(f"ℹ️  文件夹刚刚被创建: {current_path}")
+                folder_id = graph.get(check_url, access_token, timeout=30).json()["id"]
+            elif create_resp.status_code not in [200, 201]:
+                raise RuntimeError(f"创建文件夹失败: {create_resp.status_code} - {create_resp.text}")
+            else:
+                folder_id = create_resp.json()["id"]
+        else:
+            raise RuntimeError(f"检查文件夹异常: {resp.status_code} - {resp.text}")
+
+    return folder_id
+
+
+# ========== 带缓存的目录解析 ==========
+def resolve_folder(access_token, folder_path):
+    """
+    返回目录的 driveItem ID：依次查内存缓存、磁盘缓存 (FOLDER_CACHE=0 关闭)，
+    都未命中时才访问 Graph (必要时创建目录)。每次运行每个目录最多解析一次。
+    缓存的 ID 只在 Graph 对它返回 404 时通过 invalidate_folder 作废。
+    """
+    key = f"{account_key(access_token)}:{_normalize(folder_path)}"
+    folder_id = _memory.get(key)
+    if folder_id:
+        return folder_id
+
+    with _resolve_lock:
+        folder_id = _memory.get(key)
+        if not folder_id and disk_cache_enabled():
+            folder_id = _store().get(key)
+        if not folder_id:
+            with phase("resolve"):
+                folder_id = ensure_onedrive_folder(access_token, folder_path)
+            if disk_cache_enabled():
+                _store().set(key, folder_id)
+        _memory[key] = folder_id
+    return folder_id
+
+
+def invalidate_folder(access_token, folder_path):
+    key = f"{account_key(access_token)}:{_normalize(folder_path)}"
+    with _resolve_lock:
+        _memory.pop(key, None)
+        if disk_cache_enabled():
+            _store().delete(key)
@@ -0,0 +1,157 @@
+import os
+import urllib.parse
+
+from graph_client import get_client, account_key
+from json_cache import JsonCache
+from onedrive_folders import resolve_folder
+
+# ================= 配置区域 =================
+# paged: 每次完整分页列出目录；delta: 只拉取上次运行以来的变化 (默认)
+DEFAULT_LISTING_MODE = "delta"
+# 本地快照里保留的 driveItem 字段
+SNAPSHOT_FIELDS = ("id", "name", "size", "file", "lastModifiedDateTime")
+# 列表请求只取用得到的字段 ($select)，不下载缩略图、哈希、创建者等完整 driveItem
+CHILDREN_SELECT = ",".join(SNAPSHOT_FIELDS + ("@microsoft.graph.downloadUrl",))
+# delta 还需要判断删除 / 目录 / 父目录的字段
+DELTA_SELECT = ",".join(SNAPSHOT_FIELDS + ("parentReference", "deleted", "folder"))
+# 分页列表每页条数 (Graph 上限 999)，目录越大省下的往返越多
+LISTING_PAGE_SIZE = 999
+
+
+class ListingError(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def listing_mode():
+    return os.environ.get("LISTING_MODE", DEFAULT_LISTING_MODE).lower()
+
+
+# ========== 跟随 @odata.nextLink 的分页迭代 ==========
+def iter_pages(access_token, url, params=None):
+    """逐页请求 Graph 集合，yield 每一页的响应 JSON；nextLink 已包含查询参数。"""
+    graph = get_client()
+    while url:
+        resp = graph.get(url, access_token, params=params, timeout=30)
+        if resp.status_code != 200:
+            raise ListingError(f"列出目录失败: {resp.status_code} - {resp.text}", resp.status_code)
+        page = resp.json()
+        yield page
+        url = page.get("@odata.nextLink")
+        params = None
+
+
+def iter_children(access_token, folder_path, params=None):
+    """
+    遍历目录下的全部子项 (自动翻页)。默认只取 CHILDREN_SELECT 中的字段，
+    按文件名倒序 (YYYYMMDD 开头的图片最新的在前)，每页 LISTING_PAGE_SIZE 条。
+    """
+    if params is None:
+        params = {"$select": CHILDREN_SELECT, "$orderby": "name desc", "$top": LISTING_PAGE_SIZE}
+    encoded_path = urllib.parse.quote(folder_path)
+    for page in iter_pages(access_token, f"me/drive/root:/{encoded_path}:/children", params):
+        yield from page.get("value", [])
+
+
+# ========== delta 增量同步 ==========
+def _snapshot_item(item):
+    return {k: item[k] for k in SNAPSHOT_FIELDS if k in item}
+
+
+def _apply_delta(access_token, url, items, folder_id, params=None):
+    """
+    从 url (delta 起点或上次保存的 deltaLink) 开始拉取变化并合并进 items，返回新的 deltaLink。
+    只保留父目录为 folder_id 的文件：根目录 delta 包含整个网盘，目录级 delta 也包含所有层级的子目录
+    (例如 Pictures/Unsplash/Preview 中的预览图)。
+    params 只用于起点；nextLink / deltaLink 已包含 $select 等查询参数。
+    """
+    delta_link = None
+    for page in iter_pages(access_token, url, params):
+        for item in page.get("value", []):
+            if item.get("deleted") or item.get("folder") is not None:
+                items.pop(item["id"], None)
+                continue
+            parent_id = (item.get("parentReference") or {}).get("id")
+            if parent_id != folder_id:
+                # 子目录中的文件、移出目录的文件都不在快照中
+                items.pop(item["id"], None)
+                continue
+            items[item["id"]] = _snapshot_item(item)
+        delta_link = page.get("@odata.deltaLink") or delta_link
+    return delta_link
+
+
+def delta_children(access_token, folder_path):
+    """
+    返回目录下的文件列表，只请求上次运行以来的变化：
+    快照和 deltaLink 保存在本地缓存中，下次从 deltaLink 继续。
+    个人版 OneDrive 支持目录级 delta；商业版只支持根目录 delta，此时改用根目录 delta。
+    两种情况都按父目录过滤，只返回目录下直接的文件。deltaLink 过期 (410) 时自动全量重建。
+    """
+    store = JsonCache("listing")
+    key = f"{account_key(access_token)}:{folder_path}"
+    state = store.get(key) or {}
+    items = state.get("items", {})
+    scope = state.get("scope")
+    delta_link = state.get("delta_link")
+    folder_id = state.get("folder_id")
+
+    try:
+        # 旧版本的目录级快照没有记录目录 ID (也没有按父目录过滤)，需要重建
+        if delta_link and folder_id:
+            delta_link = _apply_delta(access_token, delta_link, items, folder_id)
+        else:
+            raise ListingError("没有 deltaLink", 410)
+    except ListingError as e:
+        if e.status_code not in (400, 404, 410):
+            raise
+        # 全量重建：先尝试目录级 delta，不支持时退回根目录 delta
+        items = {}
+        encoded_path = urllib.parse.quote(folder_path)
+        folder_id = resolve_folder(access_token, folder_path)
+        try:
+            scope = "folder"
+            delta_link = _apply_delta(access_token, f"me/drive/root:/{encoded_path}:/delta", items, folder_id,
+                                      {"$select": DELTA_SELECT})
+        except ListingError as folder_error:
+            if folder_error.status_code not in (400, 403, 501):
+                raise
+            print("ℹ️  目录级 delta 不可用，改用根目录 delta")
+            scope = "root"
+            items = {}
+            delta_link = _apply_delta(access_token, "me/drive/root/delta", items, folder_id,
+                                      {"$select": DELTA_SELECT})
+
+    store.set(key, {"scope": scope, "folder_id": folder_id, "delta_link": delta_link, "items": items})
+    return list(items.values())
+
+
+# ========== 对外接口 ==========
+def list_folder_files(access_token, folder_path, mode=None):
+    """按 LISTING_MODE 返回目录下的全部文件 (不含子目录)。"""
+    mode = mode or listing_mode()
+    if mode == "delta":
+        return delta_children(access_token, folder_path)
+    return [item for item in iter_children(access_token, folder_path) if item.get("file")]
+
+
+def get_download_url(access_token, item):
+    """
+    返回文件的临时下载链接。列表结果里已带 @microsoft.graph.downloadUrl 时直接使用，
+    否则 (delta 快照中不保存短期有效的链接) 单独查询一次该文件。
+    查询失败时抛出 ListingError (status_code 为响应状态码，404 表示文件已不存在)；
+    文件存在但没有下载链接 (不是文件) 时返回 None。
+    """
+    url = item.get("@microsoft.graph.downloadUrl")
+    if url:
+        return url
+    resp = get_client().get(
+        f"me/drive/items/{item['id']}",
+        access_token,
+        params={"$select": "id,@microsoft.graph.downloadUrl"},
+        timeout=20,
+    )
+    if resp.status_code != 200:
+        raise ListingError(f"获取下载链接失败: {resp.status_code} - {resp.text}", resp.status_code)
+    return resp.json().get("@microsoft.graph.downloadUrl")
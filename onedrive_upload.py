@@ -0,0 +1,201 @@
+import asyncio
+import hashlib
+import tempfile
+import urllib.parse
+
+import aio
+from aio import get_async_client
+from graph_client import get_client
+
+# ================= 配置区域 =================
+# 分片大小必须是 320 KiB 的整数倍，3.2 MiB 在内存占用和请求次数之间取平衡
+CHUNK_SIZE = 320 * 1024 * 10
+# 单个分片失败后的重试次数：只重试连接错误和下面的状态码。
+# 429/503/504 已在 throttle 中按 Retry-After 重试，这里不再叠加
+CHUNK_RETRIES = 3
+CHUNK_RETRY_STATUS = (500, 502)
+# 读取下载流的块大小
+READ_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class UploadSessionError(UploadError):
+    """创建上传会话失败：此时还没有读取任何数据，调用方可以用同一个下载流重试。"""
+
+
+# ========== 创建上传会话 ==========
+async def create_upload_session_async(access_token, item_path, parent_id=None, conflict_behavior="rename"):
+    """
+    创建可续传的上传会话，返回 uploadUrl。
+    item_path 默认相对 /me/drive/root；给出 parent_id 时相对该文件夹 (省去服务端路径解析)。
+    """
+    encoded_path = urllib.parse.quote(item_path)
+    parent = f"me/drive/items/{parent_id}" if parent_id else "me/drive/root"
+    resp = await get_async_client().post(
+        f"{parent}:/{encoded_path}:/createUploadSession",
+        access_token,
+        json={"item": {"@microsoft.graph.conflictBehavior": conflict_behavior}},
+    )
+    if resp.status_code != 200:
+        raise UploadSessionError(f"创建上传会话失败: {resp.status_code} - {resp.text}", resp.status_code)
+    return resp.json()["uploadUrl"]
+
+
+def create_upload_session(access_token, item_path, parent_id=None, conflict_behavior="rename"):
+    return aio.run(create_upload_session_async(access_token, item_path, parent_id, conflict_behavior))
+
+
+# ========== 把任意块流整理成固定大小的分片 ==========
+async def _aiter(blocks):
+    """把普通迭代器或异步迭代器统一成异步迭代器。"""
+    if hasattr(blocks, "__aiter__"):
+        async for block in blocks:
+            yield block
+    else:
+        for block in blocks:
+            yield block
+
+
+async def iter_fixed_chunks(blocks, chunk_size=CHUNK_SIZE):
+    buffer = bytearray()
+    async for block in _aiter(blocks):
+        if not block:
+            continue
+        buffer.extend(block)
+        while len(buffer) >= chunk_size:
+            yield bytes(buffer[:chunk_size])
+            del buffer[:chunk_size]
+    if buffer:
+        yield bytes(buffer)
+
+
+async def _next_expected_offset(upload_url):
+    """查询上传会话状态，返回服务端期望的下一个字节偏移 (查询失败返回 None)。"""
+    try:
+        resp = await get_async_client().get(upload_url, timeout=30)
+        ranges = resp.json().get("nextExpectedRanges") if resp.status_code == 200 else None
+        if ranges:
+            return int(ranges[0].split("-")[0])
+    except Exception:
+        pass
+    return None
+
+
+# ========== 上传单个分片 (失败只重传该分片) ==========
+async def _put_chunk(upload_url, chunk, offset, total_size):
+    end = offset + len(chunk) - 1
+    headers = {
+        "Content-Length": str(len(chunk)),
+        "Content-Range": f"bytes {offset}-{end}/{total_size}",
+    }
+    last_error = None
+    for attempt in range(CHUNK_RETRIES + 1):
+        if attempt:
+            await asyncio.sleep(2 ** attempt)
+            # 上一次请求可能已经写入成功，只是响应丢失
+            expected = await _next_expected_offset(upload_url)
+            if expected is not None and expected > end:
+                return None
+        try:
+            # uploadUrl 自带授权信息，不能再带 Authorization 头
+            resp = await get_async_client().put(upload_url, headers=headers, data=chunk, timeout=120)
+        except Exception as e:
+            last_error = e
+            continue
+        if resp.status_code in (200, 201):
+            return resp.json()
+        if resp.status_code == 202:
+            return None
+        if resp.status_code not in CHUNK_RETRY_STATUS:
+            raise UploadError(f"分片上传失败: {resp.status_code} - {resp.text}", resp.status_code)
+        last_error = f"{resp.status_code} - {resp.text}"
+    raise UploadError(f"分片 {offset}-{end} 重试 {CHUNK_RETRIES} 次后仍失败: {last_error}")
+
+
+# ========== 流式上传 ==========
+async def upload_stream_async(upload_url, blocks, total_size):
+    """
+    把字节块迭代器 blocks (普通或异步迭代器) 按分片写入上传会话，边上传边计算 SHA-256。
+    内存中最多只保留一个分片，返回 (driveItem, sha256 十六进制)。
+    """
+    digest = hashlib.sha256()
+    offset = 0
+    item = None
+    try:
+        async for chunk in iter_fixed_chunks(blocks):
+            digest.update(chunk)
+            result = await _put_chunk(upload_url, chunk, offset, total_size)
+            offset += len(chunk)
+            if result is not None:
+                item = result
+    except BaseException:
+        # 取消会话，释放服务端暂存的分片
+        try:
+            await get_async_client().delete(upload_url, timeout=30)
+        except Exception:
+            pass
+        raise
+
+    if offset != total_size or item is None:
+        raise UploadError(f"上传不完整: 已发送 {offset} / {total_size} 字节")
+    return item, digest.hexdigest()
+
+
+def upload_stream(upload_url, blocks, total_size):
+    return aio.run(upload_stream_async(upload_url, blocks, total_size))
+
+
+async def _tee_blocks(blocks, tee):
+    async for block in _aiter(blocks):
+        tee.write(block)
+        yield block
+
+
+# ========== 小文件直接上传 ==========
+def upload_small(access_token, filename, data, parent_id, content_type="application/octet-stream"):
+    """单次 PUT 上传小文件 (如预览图，远小于 4 MB)，重名时覆盖。"""
+    resp = get_client().put(
+        f"me/drive/items/{parent_id}:/{urllib.parse.quote(filename)}:/content",
+        access_token,
+        headers={"Content-Type": content_type},
+        data=data,
+        timeout=60,
+    )
+    if resp.status_code not in (200, 201):
+        raise UploadError(f"上传失败: {resp.status_code} - {resp.text}", resp.status_code)
+    return resp.json()
+
+
+# ========== 把 HTTP 下载响应直接转存到 OneDrive ==========
+async def upload_response_async(access_token, item_path, response, parent_id=None, tee=None):
+    """
+    把 stream=True 的下载响应 (requests.Response 或 aio.AsyncResponse) 边读边传到 OneDrive。
+    有 Content-Length 时直接管道转发；否则先落到临时文件 (超过一个分片即写磁盘) 再上传，
+    两种情况下内存占用都与文件大小无关。
+    上传会话在读取响应之前创建，所以创建失败 (如父文件夹 404) 时响应仍可重用。
+    tee 为可写文件对象时，读到的每一块同时写入其中 (例如留一份本地副本生成预览图)。
+    """
+    upload_url = await create_upload_session_async(access_token, item_path, parent_id)
+    blocks = response.iter_content(READ_SIZE)
+    if tee is not None:
+        blocks = _tee_blocks(blocks, tee)
+    length = response.headers.get("Content-Length")
+    encoded = response.headers.get("Content-Encoding", "identity") != "identity"
+    if length and not encoded:
+        return await upload_stream_async(upload_url, blocks, int(length))
+
+    with tempfile.SpooledTemporaryFile(max_size=CHUNK_SIZE) as spool:
+        async for block in _aiter(blocks):
+            spool.write(block)
+        total_size = spool.tell()
+        spool.seek(0)
+        return await upload_stream_async(upload_url, iter(lambda: spool.read(READ_SIZE), b""), total_size)
+
+
+def upload_response(access_token, item_path, response, parent_id=None, tee=None):
+    return aio.run(upload_response_async(access_token, item_path, response, parent_id, tee))
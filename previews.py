@@ -0,0 +1,64 @@
+import io
+import os
+from importlib.util import find_spec
+
+from config import env_flag, env_int
+
+# Pillow 为可选依赖：安装后在进程池里本地生成预览图，否则使用 Unsplash 服务端缩放。
+# Pillow 和进程池 (multiprocessing) 都只在真正生成预览图时才导入，不拖慢脚本启动
+HAS_PILLOW = find_spec("PIL") is not None
+
+# ================= 配置区域 =================
+PREVIEW_WIDTH = env_int("UNSPLASH_PREVIEW_WIDTH", 640)
+PREVIEW_QUALITY = 70
+PREVIEW_FOLDER = "Pictures/Unsplash/Preview"
+
+
+def previews_enabled():
+    return env_flag("UNSPLASH_PREVIEW")
+
+
+def preview_name(filename):
+    return f"{os.path.splitext(filename)[0]}_preview.webp"
+
+
+# ========== 本地生成预览图 (在子进程中运行) ==========
+def render_preview(src_path, width=PREVIEW_WIDTH, quality=PREVIEW_QUALITY):
+    """把原图缩放到指定宽度并编码为 WebP，返回字节内容。"""
+    from PIL import Image
+
+    with Image.open(src_path) as img:
+        img = img.convert("RGB")
+        if img.width > width:
+            img = img.resize((width, round(img.height * width / img.width)), Image.LANCZOS)
+        out = io.BytesIO()
+        img.save(out, "WEBP", quality=quality, method=4)
+        return out.getvalue()
+
+
+# ========== 预览图生成器 ==========
+class PreviewMaker:
+    """
+    持有生成预览图用的进程池 (图片解码和缩放是 CPU 密集型，放在线程里会被 GIL 串行化)。
+    未安装 Pillow 时 local 为 False，调用方改用 Unsplash 的服务端缩放链接。
+    """
+
+    def __init__(self, workers=None):
+        self.local = HAS_PILLOW
+        self.pool = None
+        if self.local:
+            from concurrent.futures import ProcessPoolExecutor
+            self.pool = ProcessPoolExecutor(max_workers=workers)
+
+    def submit(self, src_path):
+        return self.pool.submit(render_preview, src_path)
+
+    def close(self):
+        if self.pool:
+            self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,388 @@
+import os
+import sys
+import json
+import time
+import heapq
+import random
+import signal
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from zoneinfo import ZoneInfo
+
+from accounts import load_accounts, use_account
+from config import JOB_JITTER, env_int
+from graph_client import get_access_token
+import metrics
+from batch_runner import JOBS, run_job
+
+# ================= 配置区域 =================
+# 常驻调度：三个任务在同一个进程里按 cron 表达式定时执行，复用连接池和 Token 缓存。
+# 时间按 SCHEDULER_TZ (默认北京时间) 解释，与工作流里的 UTC cron 对应；多个表达式用 ; 分隔
+SCHEDULER_TZ = ZoneInfo(os.environ.get("SCHEDULER_TZ", "Asia/Shanghai"))
+DEFAULT_SCHEDULES = {
+    # 周二、四、六 6:47，周三、五 6:57 (即工作流中 UTC 周一、三、五 22:47 / 周二、四 22:57)
+    "note": "47 6 * * 2,4,6; 57 6 * * 3,5",
+    "page": "37 6 * * *",
+    "images": "6 6 * * *",
+}
+# 触发前多少秒预先检查 / 刷新 Token，使任务开始时 Token 已就绪
+PREWARM_SECONDS = 60
+SCHEDULER_WORKERS = env_int("SCHEDULER_WORKERS", 3)
+# 健康检查地址 (只监听本机)；设为空字符串时不启动
+HEALTH_ADDR = os.environ.get("SCHEDULER_HEALTH", "127.0.0.1:8787")
+
+
+# ==============================================================================
+# cron 表达式
+# ==============================================================================
+def _parse_field(text, low, high):
+    """解析 cron 的一个字段 (支持 * / , - 和 /步长)，返回允许值的集合。"""
+    values = set()
+    for part in text.split(","):
+        step = 1
+        if "/" in part:
+            part, step = part.split("/", 1)
+            step = int(step)
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start, end = (int(v) for v in part.split("-", 1))
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+        if not low <= start <= end <= high or step < 1:
+            raise ValueError(f"cron 字段超出范围: {text}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class Cron:
+    """标准 5 段 cron 表达式：分 时 日 月 周 (周日为 0 或 7)。"""
+
+    def __init__(self, expr):
+        fields = expr.split()
+        if len(fields) != 5:
+            raise ValueError(f"cron 表达式需要 5 个字段: {expr!r}")
+        self.expr = expr
+        self.minutes = sorted(_parse_field(fields[0], 0, 59))
+        self.hours = sorted(_parse_field(fields[1], 0, 23))
+        self.days = _parse_field(fields[2], 1, 31)
+        self.months = _parse_field(fields[3], 1, 12)
+        self.weekdays = {d % 7 for d in _parse_field(fields[4], 0, 7)}
+        # 与 cron 相同：日和周都做了限制时，满足其一即可
+        self.any_day = fields[2] == "*"
+        self.any_weekday = fields[4] == "*"
+
+    def _day_matches(self, day):
+        if day.month not in self.months:
+            return False
+        dom = day.day in self.days
+        dow = (day.isoweekday() % 7) in self.weekdays
+        if self.any_day or self.any_weekday:
+            return dom and dow
+        return dom or dow
+
+    def next_after(self, after):
+        """返回严格晚于 after (带时区的 datetime) 的下一次触发时间。"""
+        start = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        day = start.date()
+        for _ in range(366 * 5):
+            if self._day_matches(day):
+                for hour in self.hours:
+                    for minute in self.minutes:
+                        candidate = datetime(day.year, day.month, day.day, hour, minute, tzinfo=start.tzinfo)
+                        if candidate >= start:
+                            return candidate
+            day += timedelta(days=1)
+        raise ValueError(f"cron 表达式没有可触发的时间: {self.expr!r}")
+
+
+class Schedule:
+    """一个任务的调度：若干 cron 表达式中最早的一次触发。"""
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.crons = [Cron(expr.strip()) for expr in spec.split(";") if expr.strip()]
+        if not self.crons:
+            raise ValueError("调度表达式为空")
+
+    def next_after(self, after):
+        return min(cron.next_after(after) for cron in self.crons)
+
+
+def load_schedules(jobs):
+    """读取各任务的调度 (SCHEDULE_NOTE / SCHEDULE_PAGE / SCHEDULE_IMAGES 覆盖默认值)。"""
+    return {job: Schedule(os.environ.get(f"SCHEDULE_{job.upper()}", DEFAULT_SCHEDULES[job])) for job in jobs}
+
+
+# ==============================================================================
+# 调度器
+# ==============================================================================
+class JobState:
+    def __init__(self, name, schedule):
+        self.name = name
+        self.schedule = schedule
+        self.next_fire = None
+        self.next_run = None
+        self.running = False
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.last_started = None
+        self.last_seconds = None
+        self.last_ok = None
+        self.last_error = None
+
+    def snapshot(self):
+        def iso(ts):
+            return datetime.fromtimestamp(ts, SCHEDULER_TZ).isoformat(timespec="seconds") if ts else None
+        return {
+            "schedule": self.schedule.spec,
+            "next_run": iso(self.next_run),
+            "running": self.running,
+            "runs": self.runs,
+            "failures": self.failures,
+            "skipped": self.skipped,
+            "last_started": iso(self.last_started),
+            "last_seconds": self.last_seconds,
+            "last_ok": self.last_ok,
+            "last_error": self.last_error,
+        }
+
+
+class Scheduler:
+    """
+    单线程维护定时堆：到点后把任务交给工作线程池执行，抖动 (jitter) 和 Token 预热都作为堆里的
+    定时事件处理，不会让工作线程空等。同一任务上一次还没结束时，本次触发直接跳过。
+    """
+
+    def __init__(self, schedules, accounts=None, workers=SCHEDULER_WORKERS, jitter=None):
+        self.jobs = {name: JobState(name, schedule) for name, schedule in schedules.items()}
+        self.accounts = accounts or [None]
+        # 随机推迟 (JOB_JITTER) 在调度器里等待，不占用工作线程
+        self.jitter = dict(JOB_JITTER, **(jitter or {}))
+        self.pool = ThreadPoolExecutor(max(1, workers), thread_name_prefix="job")
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.stopping = False
+        self.started = time.time()
+        self.heap = []
+        self.loop_thread = None
+
+    # ---------- 定时堆 ----------
+    def _push(self, when, kind, job):
+        heapq.heappush(self.heap, (when, kind, job))
+        self.wakeup.notify()
+
+    def _plan(self, state, after):
+        """按 cron 计算下一次触发，加上随机抖动，并在触发前安排一次 Token 预热。"""
+        fire = state.schedule.next_after(after)
+        low, high = self.jitter.get(state.name, (0, 0))
+        state.next_fire = fire
+        state.next_run = fire.timestamp() + random.uniform(low, high)
+        self._push(state.next_run, "run", state.name)
+        self._push(max(time.time(), fire.timestamp() - PREWARM_SECONDS), "warm", state.name)
+
+    def start(self):
+        with self.lock:
+            now = datetime.now(SCHEDULER_TZ)
+            for state in self.jobs.values():
+                self._plan(state, now)
+        self.loop_thread = threading.Thread(target=self._loop, name="scheduler", daemon=True)
+        self.loop_thread.start()
+        return self
+
+    def _loop(self):
+        with self.lock:
+            while not self.stopping:
+                if not self.heap:
+                    self.wakeup.wait()
+                    continue
+                when, kind, job = self.heap[0]
+                delay = when - time.time()
+                if delay > 0:
+                    self.wakeup.wait(delay)
+                    continue
+                heapq.heappop(self.heap)
+                state = self.jobs[job]
+                if kind == "warm":
+                    self.pool.submit(self._prewarm)
+                    continue
+                # 以本次 cron 时间为基准排下一次，任务执行多久都不会漂移
+                self._plan(state, state.next_fire)
+                if state.running:
+                    state.skipped += 1
+                    print(f"⏭️  {job} 上一次还在执行，跳过本次触发")
+                    continue
+                state.running = True
+                self.pool.submit(self._execute, state)
+
+    # ---------- 执行 ----------
+    def _prewarm(self):
+        """提前刷新即将过期的 Token (未过期时只读一次缓存)，任务开始时不必再等 AAD。"""
+        for account in self.accounts:
+            try:
+                with use_account(account):
+                    get_access_token()
+            except BaseException as e:  # 凭据错误时 get_access_token 会 exit()
+                print(f"⚠️  预热 Token 失败: {e!r}")
+
+    def _execute(self, state):
+        started = time.time()
+        print(f"⏰ {datetime.now(SCHEDULER_TZ):%Y-%m-%d %H:%M:%S} 开始执行 {state.name}")
+        records = [run_job(account, state.name) for account in self.accounts]
+        failed = [r for r in records if not r["ok"]]
+        with self.lock:
+            state.running = False
+            state.runs += 1
+            state.last_started = started
+            state.last_seconds = round(time.time() - started, 3)
+            state.last_ok = not failed
+            state.last_error = "; ".join(f"{r['account'] or 'default'}: {r['error']}" for r in failed) or None
+            if failed:
+                state.failures += 1
+        print(f"{'✅' if not failed else '❌'} {state.name} 完成，耗时 {state.last_seconds:.1f} 秒"
+              + (f"，失败: {state.last_error}" if failed else ""))
+
+    def run_now(self, job):
+        """立即执行一次 (不影响原有调度)。"""
+        with self.lock:
+            state = self.jobs[job]
+            if state.running:
+                return False
+            state.running = True
+        self.pool.submit(self._execute, state)
+        return True
+
+    # ---------- 状态 / 停止 ----------
+    def health(self):
+        with self.lock:
+            jobs = {name: state.snapshot() for name, state in self.jobs.items()}
+        alive = bool(self.loop_thread and self.loop_thread.is_alive())
+        degraded = any(j["last_ok"] is False for j in jobs.values())
+        return {
+            "status": "down" if not alive else "degraded" if degraded else "ok",
+            "uptime_seconds": round(time.time() - self.started, 1),
+            "accounts": [a.name if a else "default" for a in self.accounts],
+            "jobs": jobs,
+        }
+
+    def stop(self, wait=True):
+        with self.lock:
+            self.stopping = True
+            self.wakeup.notify()
+        self.pool.shutdown(wait=wait)
+
+
+# ==============================================================================
+# 健康检查
+# ==============================================================================
+class HealthHandler(BaseHTTPRequestHandler):
+    scheduler = None
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path in ("/", "/healthz"):
+            body = self.scheduler.health()
+            self._reply(503 if body["status"] == "down" else 200, json.dumps(body, ensure_ascii=False), "application/json")
+        elif path == "/metrics" and metrics.get_recorder() is not None:
+            recorder = metrics.get_recorder()
+            self._reply(200, recorder.prometheus(recorder.summary()), "text/plain; version=0.0.4")
+        else:
+            self._reply(404, "not found", "text/plain")
+
+    def do_POST(self):
+        # POST /run/<job> 立即执行一次任务
+        job = self.path.rstrip("/").rsplit("/", 1)[-1]
+        if not self.path.startswith("/run/") or job not in self.scheduler.jobs:
+            self._reply(404, "not found", "text/plain")
+        elif self.scheduler.run_now(job):
+            self._reply(202, f"{job} started", "text/plain")
+        else:
+            self._reply(409, f"{job} is already running", "text/plain")
+
+    def _reply(self, status, text, content_type):
+        data = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8" if "charset" not in content_type else content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_health_server(scheduler, addr):
+    host, _, port = addr.rpartition(":")
+    handler = type("Handler", (HealthHandler,), {"scheduler": scheduler})
+    server = ThreadingHTTPServer((host or "127.0.0.1", int(port)), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="health", daemon=True).start()
+    return server
+
+
+# ==============================================================================
+# 主程序
+# ==============================================================================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="常驻进程：按 cron 调度执行 OneNote / SharePoint / 壁纸同步任务")
+    parser.add_argument("--jobs", default=",".join(DEFAULT_SCHEDULES), help="要调度的任务，逗号分隔：note,page,images")
+    parser.add_argument("--accounts", help="账号列表 JSON 文件；不指定时使用环境变量中的单个账号")
+    parser.add_argument("--workers", type=int, default=SCHEDULER_WORKERS, help="同时执行的任务数")
+    parser.add_argument("--health", default=HEALTH_ADDR, help="健康检查监听地址 host:port，空字符串表示不启动")
+    parser.add_argument("--run-now", action="store_true", help="启动后立即执行一次全部任务")
+    parser.add_argument("--dry-run", action="store_true", help="只打印接下来的触发时间")
+    args = parser.parse_args(argv)
+
+    jobs = [j.strip() for j in args.jobs.split(",") if j.strip()]
+    unknown = [j for j in jobs if j not in JOBS]
+    if unknown:
+        parser.error(f"未知任务: {', '.join(unknown)}")
+    try:
+        schedules = load_schedules(jobs)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.dry_run:
+        now = datetime.now(SCHEDULER_TZ)
+        for job, schedule in schedules.items():
+            fires, after = [], now
+            for _ in range(5):
+                after = schedule.next_after(after)
+                fires.append(f"{after:%m-%d %a %H:%M}")
+            print(f"🗓️  {job:<7} [{schedule.spec}] -> {', '.join(fires)}")
+        return 0
+
+    metrics.install("scheduler")
+    accounts = load_accounts(args.accounts) if args.accounts or os.environ.get("ACCOUNTS_JSON") else None
+    scheduler = Scheduler(schedules, accounts, args.workers).start()
+    # 启动时先预热一次 Token 和连接池，之后每次触发只剩实际的 Graph 请求
+    scheduler._prewarm()
+
+    server = start_health_server(scheduler, args.health) if args.health else None
+    if server:
+        print(f"💓 健康检查: http://{args.health}/healthz")
+    for job, state in scheduler.jobs.items():
+        print(f"🗓️  {job:<7} 下次执行 {state.snapshot()['next_run']}")
+    if args.run_now:
+        for job in jobs:
+            scheduler.run_now(job)
+
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop.set())
+    stop.wait()
+
+    print("🛑 正在停止调度器 (等待执行中的任务结束)...")
+    if server:
+        server.shutdown()
+    scheduler.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,263 @@
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+from accounts import current_account
+
+# ================= 配置区域 =================
+# asyncio 模式下并发已满时，重新检查的间隔 (秒)
+LIMITER_POLL = 0.02
+# 需要退避重试的状态码
+RETRY_STATUS = (429, 503, 504)
+# 可以安全重放的方法。503/504 可能在服务端已经处理完请求之后才返回 (网关超时)，
+# 重放 POST (创建页面 / 分区 / 笔记本) 会产生重复资源，见 should_retry
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+# 每类资源的 (每秒请求数, 最大并发)。
+# OneNote 按用户限流最严 (约 120 次/分钟)，OneDrive 和站点相对宽松。
+RESOURCE_LIMITS = {
+    "drive": (10.0, 8),
+    "onenote": (2.0, 2),
+    "sites": (5.0, 4),
+    "graph": (10.0, 8),
+    "aad": (5.0, 2),
+    "default": (10.0, 8),
+}
+
+
+def classify(url):
+    """按 URL 判断请求属于哪类资源，各类资源分别限流。"""
+    parts = urlsplit(url)
+    host, path = parts.netloc.lower(), parts.path.lower()
+    if host == "login.microsoftonline.com":
+        return "aad"
+    if host == "graph.microsoft.com" or host.endswith(".graph.microsoft.com"):
+        if "/onenote/" in path:
+            return "onenote"
+        if "/drive" in path or "/drives/" in path or "/items/" in path:
+            return "drive"
+        if "/sites" in path:
+            return "sites"
+        return "graph"
+    # 上传会话的 uploadUrl 指向 SharePoint / OneDrive 存储主机
+    if host.endswith(".sharepoint.com") or host.endswith("onedrive.com") or host.endswith("1drv.com"):
+        return "drive"
+    return "default"
+
+
+# ========== 令牌桶 ==========
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate * 2)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        """不等待：取到令牌返回 0，否则返回还需要等待的秒数。"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        """取一个令牌，不足时等待；返回等待的秒数。"""
+        waited = 0.0
+        while True:
+            delay = self.take()
+            if not delay:
+                return waited
+            time.sleep(delay)
+            waited += delay
+
+
+# ========== 自适应并发 ==========
+class AdaptiveLimiter:
+    """
+    AIMD 并发控制：被限流时并发上限减半，连续成功时逐步加回，直到 max_limit。
+    """
+
+    def __init__(self, max_limit):
+        self.max_limit = max_limit
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        started = time.monotonic()
+        with self.cond:
+            while self.in_flight >= max(1, int(self.limit)):
+                self.cond.wait()
+            self.in_flight += 1
+        return time.monotonic() - started
+
+    def try_acquire(self):
+        """不等待：并发未满时占用一个名额并返回 True。"""
+        with self.cond:
+            if self.in_flight >= max(1, int(self.limit)):
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, throttled):
+        with self.cond:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(1.0, self.limit / 2)
+            else:
+                self.limit = min(float(self.max_limit), self.limit + 1.0 / max(self.limit, 1.0))
+            self.cond.notify_all()
+
+
+# ========== 单类资源的限流状态 ==========
+class Resource:
+    def __init__(self, name, rate, max_concurrency):
+        self.name = name
+        self.bucket = TokenBucket(rate)
+        self.limiter = AdaptiveLimiter(max_concurrency)
+        # 收到 Retry-After 后整类资源暂停到该时刻，避免其他线程继续撞限流
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def pause(self, seconds):
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def wait_unblocked(self):
+        delay = self.blocked_until - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+            return delay
+        return 0.0
+
+
+_resources = {}
+_resources_lock = threading.Lock()
+
+
+def get_resource(name, account=None):
+    """返回资源的限流状态；Graph 按用户 / 租户限流，多账号模式下每个账号各自一份。"""
+    key = (account, name)
+    with _resources_lock:
+        if key not in _resources:
+            rate, concurrency = RESOURCE_LIMITS.get(name, RESOURCE_LIMITS["default"])
+            _resources[key] = Resource(name, rate, concurrency)
+        return _resources[key]
+
+
+def retry_after_seconds(headers, attempt):
+    """优先使用 Retry-After；没有时使用带抖动的指数退避 (full jitter)。"""
+    value = (headers or {}).get("Retry-After")
+    if value:
+        try:
+            return min(BACKOFF_MAX, max(0.0, float(value)))
+        except ValueError:
+            pass
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+# ========== 发送请求 (限流 + 退避重试) ==========
+def should_retry(method, status_code, headers):
+    """
+    是否重放该请求：429 表示请求未被处理，总是重试；503/504 只重试幂等方法，
+    非幂等方法 (POST / PATCH) 仅在 503 带有 Retry-After (服务端明确拒绝处理) 时重试。
+    """
+    if status_code == 429:
+        return True
+    if status_code not in RETRY_STATUS:
+        return False
+    if method.upper() in IDEMPOTENT_METHODS:
+        return True
+    return status_code == 503 and bool(headers.get("Retry-After"))
+
+
+def send(url, do_request, max_retries=MAX_RETRIES, method="GET"):
+    """
+    在 url 所属资源的限流下执行 do_request()，遇到 429/503/504 时按 Retry-After 或指数退避重试
+    (method 不是幂等方法时按 should_retry 的规则，避免重复创建)。
+    返回最后一次响应，并在响应上记录 retries (重试次数) 与 throttle_wait (限流等待秒数)。
+    """
+    account = current_account()
+    resource = get_resource(classify(url), account.name if account else None)
+    retries = 0
+    waited = 0.0
+    while True:
+        waited += resource.wait_unblocked()
+        waited += resource.bucket.acquire()
+        waited += resource.limiter.acquire()
+        throttled = False
+        try:
+            resp = do_request()
+            throttled = resp.status_code in RETRY_STATUS
+        finally:
+            resource.limiter.release(throttled)
+
+        if not should_retry(method, resp.status_code, resp.headers) or retries >= max_retries:
+            resp.retries = retries
+            resp.throttle_wait = waited
+            return resp
+
+        delay = retry_after_seconds(resp.headers, retries)
+        print(f"🐢 {resource.name} 被限流 ({resp.status_code})，{delay:.1f} 秒后重试 ({retries + 1}/{max_retries})")
+        if resp.headers.get("Retry-After"):
+            resource.pause(delay)
+        resp.close()
+        time.sleep(delay)
+        waited += delay
+        retries += 1
+
+
+# ========== asyncio 版本 ==========
+async def send_async(url, do_request, max_retries=MAX_RETRIES, method="GET"):
+    """
+    send() 的 asyncio 版本 (见 aio.py)：do_request() 返回 awaitable，
+    等待令牌、并发名额和 Retry-After 时让出事件循环，不占用线程。与同步请求共用同一份限流状态。
+    """
+    import asyncio
+
+    account = current_account()
+    resource = get_resource(classify(url), account.name if account else None)
+    retries = 0
+    waited = 0.0
+    while True:
+        started = time.monotonic()
+        blocked = resource.blocked_until - started
+        if blocked > 0:
+            await asyncio.sleep(blocked)
+        while True:
+            delay = resource.bucket.take()
+            if not delay:
+                break
+            await asyncio.sleep(delay)
+        while not resource.limiter.try_acquire():
+            await asyncio.sleep(LIMITER_POLL)
+        waited += time.monotonic() - started
+        throttled = False
+        try:
+            resp = await do_request()
+            throttled = resp.status_code in RETRY_STATUS
+        finally:
+            resource.limiter.release(throttled)
+
+        if not should_retry(method, resp.status_code, resp.headers) or retries >= max_retries:
+            resp.retries = retries
+            resp.throttle_wait = waited
+            return resp
+
+        delay = retry_after_seconds(resp.headers, retries)
+        print(f"🐢 {resource.name} 被限流 ({resp.status_code})，{delay:.1f} 秒后重试 ({retries + 1}/{max_retries})")
+        if resp.headers.get("Retry-After"):
+            resource.pause(delay)
+        resp.close()
+        await asyncio.sleep(delay)
+        waited += delay
+        retries += 1
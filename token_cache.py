@@ -0,0 +1,97 @@
+import time
+import hashlib
+import threading
+
+from config import env_flag
+from json_cache import JsonCache
+
+# ================= 配置区域 =================
+# 距离过期不足该秒数时提前刷新，避免脚本运行中途 Token 过期
+REFRESH_SKEW = 300
+
+# 同一进程内每个账号一把刷新锁，保证同一时刻只有一个线程去 AAD 刷新
+_flight_locks = {}
+_flight_locks_guard = threading.Lock()
+
+
+class TokenError(Exception):
+    """AAD 刷新失败，response 为原始响应 (请求异常时为 None)。"""
+
+    def __init__(self, message, response=None):
+        super().__init__(message)
+        self.response = response
+
+
+def cache_enabled():
+    return env_flag("TOKEN_CACHE", True)
+
+
+def _fingerprint(refresh_token):
+    return hashlib.sha256(refresh_token.encode("utf-8")).hexdigest()[:16]
+
+
+# ========== Token 缓存 ==========
+class TokenCache:
+    """
+    按 (tenant, client_id) 缓存 access_token、过期时间和轮换后的 refresh_token；
+    多账号模式下再加上账号名，同一个应用下的不同用户互不覆盖。
+    seed 记录环境变量里 refresh_token 的指纹：用户更换了 Secret 时旧缓存自动作废。
+    """
+
+    def __init__(self, credentials, store=None):
+        self.credentials = credentials
+        self.store = store or JsonCache("token_cache", private=True)
+        self.key = f"{credentials['tenant_id']}:{credentials['client_id']}"
+        if credentials.get("account"):
+            self.key += f":{credentials['account']}"
+        self.seed = _fingerprint(credentials["refresh_token"])
+
+    def _entry(self, data):
+        entry = data.get(self.key)
+        if entry and entry.get("seed") == self.seed:
+            return entry
+        return None
+
+    def _is_fresh(self, entry):
+        return bool(entry) and entry.get("expires_at", 0) - REFRESH_SKEW > time.time()
+
+    def peek(self):
+        """返回仍然有效的缓存 access_token，没有则返回 None (不加锁，不发请求)。"""
+        entry = self._entry(self.store.load())
+        return entry["access_token"] if self._is_fresh(entry) else None
+
+    def get_access_token(self, fetch):
+        """
+        返回有效的 access_token；需要刷新时调用 fetch(refresh_token) 获取 AAD 响应 JSON。
+        刷新过程持有进程内锁和文件锁 (single-flight)，拿到锁后会再检查一次缓存，
+        这样并发的线程或任务只会有一个真正发起刷新。
+        """
+        token = self.peek()
+        if token:
+            return token, True
+
+        with _flight_locks_guard:
+            flight = _flight_locks.setdefault(self.key, threading.Lock())
+
+        with flight, self.store.locked() as data:
+            entry = self._entry(data)
+            if self._is_fresh(entry):
+                return entry["access_token"], True
+
+            refresh_token = (entry or {}).get("refresh_token") or self.credentials["refresh_token"]
+            try:
+                result = fetch(refresh_token)
+            except TokenError:
+                # 轮换后的 refresh_token 失效时，回退到 Secret 里的原始 Token 再试一次
+                if refresh_token == self.credentials["refresh_token"]:
+                    raise
+                refresh_token = self.credentials["refresh_token"]
+                result = fetch(refresh_token)
+
+            data[self.key] = {
+                "seed": self.seed,
+                "access_token": result["access_token"],
+                "expires_at": int(time.time()) + int(result.get("expires_in", 3600)),
+                "refresh_token": result.get("refresh_token") or refresh_token,
+            }
+            return result["access_token"], False
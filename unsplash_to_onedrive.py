@@ -1,5 +1,6 @@
 import os
-import requests
+import asyncio
+import tempfile
 import urllib.parse
 from datetime import datetime
 import time
@@ -10,66 +11,63 @@ try:
 except ImportError:
     from backports.zoneinfo import ZoneInfo
 
+from accounts import setting
+from config import env_int
+import aio
+from aio import get_async_client
+import metrics
+from metrics import phase
+from graph_client import get_client, get_access_token
+from image_catalog import record_upload, record_preview, known_photo_ids, hash_owner, mark_seen
+from onedrive_folders import resolve_folder, invalidate_folder
+from onedrive_upload import UploadSessionError, upload_response_async, upload_small
+from previews import PREVIEW_FOLDER, PREVIEW_WIDTH, PreviewMaker, previews_enabled, preview_name
+
 # 定义一次获取的图片数量
-IMAGE_COUNT = 5
+IMAGE_COUNT = env_int("IMAGE_COUNT", 5)
 
-# ==============================================================================
-# 身份验证相关函数
-# ==============================================================================
+# Unsplash 随机接口单次最多返回 30 张
+UNSPLASH_MAX_COUNT = 30
+# 去重后数量不足时，最多追加请求的轮数 (Unsplash 免费额度为每小时 50 次)
+UNSPLASH_TOPUP_ROUNDS = 3
 
-# ========== 获取 access_token (使用 refresh_token) ==========
-def get_access_token():
-    """
-    使用存储在环境变量中的 refresh_token 交换新的 access_token，
-    用于访问 Microsoft Graph API (OneDrive)。
-    """
-    # 调试：检查核心变量是否存在
-    if not os.environ.get("CLIENT_ID"):
-        print("❌ [致命错误] 环境变量 CLIENT_ID 未找到！")
-        print("   请检查：1. my.secrets 文件是否包含 CLIENT_ID")
-        print("           2. yaml 文件的 env 部分是否正确映射")
-        exit(1)
-
-    client_id = os.environ["CLIENT_ID"]
-    client_secret = os.environ["CLIENT_SECRET"]
-    tenant_id = os.environ["TENANT_ID"]
-    refresh_token = os.environ["GRAPH_REFRESH_TOKEN"]
-
-    token_url = f"https://login.microsoftonline.com/{tenant_id}/oauth2/v2.0/token"
-    data = {
-        "client_id": client_id,
-        "client_secret": client_secret,
-        "grant_type": "refresh_token",
-        "refresh_token": refresh_token,
-        "scope": "https://graph.microsoft.com/.default offline_access"
-    }
-
-    print("🔄 正在使用 Refresh Token 换取 Access Token...")
-    try:
-        resp = requests.post(token_url, data=data, timeout=30)
-        
-        if resp.status_code != 200:
-            print(f"❌ 获取 access_token 失败 (状态码: {resp.status_code})")
-            print(f"⚠️ 错误详情: {resp.text}")
-            exit(1)
-
-        return resp.json()["access_token"]
-        
-    except Exception as e:
-        print(f"❌ 请求 Microsoft 接口发生异常: {e}")
-        exit(1)
+# 流水线各阶段的并发数：下载 (Unsplash) 与上传 (OneDrive) 互相重叠
+DOWNLOAD_WORKERS = env_int("DOWNLOAD_WORKERS", 4)
+UPLOAD_WORKERS = env_int("UPLOAD_WORKERS", 4)
 
+# 下载的尺寸：full 为 Unsplash 原始的 urls.full；raw 使用 urls.raw 加 w/q/fm 参数按需缩放转码
+UNSPLASH_RENDITION = os.environ.get("UNSPLASH_RENDITION", "full").lower()
+UNSPLASH_WIDTH = env_int("UNSPLASH_WIDTH", 2560)
+UNSPLASH_QUALITY = env_int("UNSPLASH_QUALITY", 80)
+UNSPLASH_FORMAT = os.environ.get("UNSPLASH_FORMAT", "webp")
 
 # ==============================================================================
 # Unsplash 数据获取函数
 # ==============================================================================
 
+# ========== 生成图片尺寸链接 ==========
+def rendition_url(raw_url, **params):
+    """在 Unsplash 的 raw 链接上追加 imgix 参数 (w / q / fm 等)。"""
+    parts = urllib.parse.urlsplit(raw_url)
+    query = dict(urllib.parse.parse_qsl(parts.query))
+    query.update({k: str(v) for k, v in params.items()})
+    return urllib.parse.urlunsplit(parts._replace(query=urllib.parse.urlencode(query)))
+
+
+def pick_image_url(urls):
+    if UNSPLASH_RENDITION == "raw" and urls.get("raw"):
+        return rendition_url(urls["raw"], w=UNSPLASH_WIDTH, q=UNSPLASH_QUALITY, fm=UNSPLASH_FORMAT, fit="max")
+    return urls["full"]
+
+
 # ========== 从 Unsplash 获取随机壁纸 ==========
-def get_unsplash_wallpapers():
+def get_unsplash_wallpapers(known_ids=None):
     """
     从 Unsplash API 获取指定数量 (IMAGE_COUNT) 的【随机】横向壁纸。
+    known_ids(ids) 返回其中已经下载过的图片 ID；这些图片在下载前就被丢弃，
+    并继续追加请求，直到凑够 IMAGE_COUNT 张新图片 (最多追加 UNSPLASH_TOPUP_ROUNDS 轮)。
     """
-    unsplash_access_key = os.environ.get("UNSPLASH_ACCESS_KEY")
+    unsplash_access_key = setting("UNSPLASH_ACCESS_KEY")
     
     # 调试：检查 Unsplash Key
     if not unsplash_access_key:
@@ -80,31 +78,50 @@ def get_unsplash_wallpapers():
     url = "https://api.unsplash.com/photos/random"
     headers = {"Authorization": f"Client-ID {unsplash_access_key}"}
     
-    params = {
-        "count": IMAGE_COUNT,       # 随机接口使用 count 指定数量
-        "query": "wallpaper",       # 依然限定为壁纸类
-        "orientation": "landscape"  # 限定横屏
-    }
-    
     print(f"📷 正在从 Unsplash 随机抽取 {IMAGE_COUNT} 张壁纸...")
     try:
-        resp = requests.get(url, headers=headers, params=params, timeout=30)
-        
-        if resp.status_code != 200:
-            print(f"❌ 获取 Unsplash 图片失败 (状态码: {resp.status_code})")
-            print(f"⚠️ 错误详情: {resp.text}")
-            exit(1)
-        
-        data_list = resp.json()
-        
         image_list = []
-        for data in data_list:
-            image_list.append({
-                "id": data["id"],
-                "url": data["urls"]["full"], 
-                "photographer": data["user"]["name"],
-                "photo_url": data["links"]["html"]
-            })
+        seen_ids = set()
+        rounds = 0
+        while len(image_list) < IMAGE_COUNT:
+            if rounds > UNSPLASH_TOPUP_ROUNDS:
+                print(f"⚠️  追加 {UNSPLASH_TOPUP_ROUNDS} 轮后仍只有 {len(image_list)} 张新图片")
+                break
+            rounds += 1
+            params = {
+                "count": min(IMAGE_COUNT - len(image_list), UNSPLASH_MAX_COUNT),  # 随机接口使用 count 指定数量
+                "query": "wallpaper",       # 依然限定为壁纸类
+                "orientation": "landscape"  # 限定横屏
+            }
+            resp = get_client().get(url, headers=headers, params=params, timeout=30)
+            
+            if resp.status_code != 200:
+                print(f"❌ 获取 Unsplash 图片失败 (状态码: {resp.status_code})")
+                print(f"⚠️ 错误详情: {resp.text}")
+                exit(1)
+            
+            data_list = resp.json()
+            if not data_list:
+                break
+            
+            # 丢弃本次已抽到的和以前下载过的图片
+            data_list = [d for d in data_list if d["id"] not in seen_ids]
+            seen_ids.update(d["id"] for d in data_list)
+            known = known_ids([d["id"] for d in data_list]) if known_ids else set()
+            if known:
+                print(f"♻️  跳过 {len(known)} 张已下载过的图片")
+            
+            for data in data_list:
+                if data["id"] in known or len(image_list) >= IMAGE_COUNT:
+                    continue
+                image_list.append({
+                    "id": data["id"],
+                    "url": pick_image_url(data["urls"]),
+                    "preview_url": rendition_url(data["urls"]["raw"], w=PREVIEW_WIDTH, q=70, fm="webp")
+                    if data["urls"].get("raw") else data["urls"].get("small"),
+                    "photographer": data["user"]["name"],
+                    "photo_url": data["links"]["html"]
+                })
             
         return image_list
         
@@ -114,71 +131,56 @@ def get_unsplash_wallpapers():
 
 
 # ========== 下载图片 ==========
-def download_image(image_url):
+async def download_image_async(image_url):
     """
-    根据 URL 下载图片的二进制内容，并返回图片数据和 Content-Type。
+    打开图片的下载流，返回未读取的响应对象和 Content-Type。
+    图片内容不会整体读入内存，而是由 upload_to_onedrive 边读边上传。
+    失败时抛出异常，由流水线跳过该图片。
     """
     print(f"⬇️  正在下载图片: {image_url[:50]}...")
-    resp = requests.get(image_url, stream=True, timeout=60)
+    resp = await get_async_client().get(image_url, stream=True, timeout=60)
     if resp.status_code != 200:
-        print(f"❌ 下载图片失败: {resp.status_code}")
-        exit(1)
-    return resp.content, resp.headers.get('Content-Type', 'image/jpeg')
+        resp.close()
+        raise RuntimeError(f"下载图片失败: {resp.status_code}")
+    return resp, resp.headers.get('Content-Type', 'image/jpeg')
+
+
+def download_image(image_url):
+    # 返回的下载流属于共享事件循环，交给 upload_to_onedrive 读取
+    return aio.run(download_image_async(image_url))
 
 
 # ==============================================================================
 # OneDrive 操作函数
 # ==============================================================================
 
-# ========== 确保 OneDrive 目录存在 ==========
-def ensure_onedrive_folder(access_token, folder_path):
-    headers = {"Authorization": f"Bearer {access_token}"}
-    
-    # 分割路径
-    path_parts = [p for p in folder_path.split("/") if p]
-    current_path = ""
-    
-    # 逐级检查和创建文件夹
-    for part in path_parts:
-        parent_path = current_path
-        current_path = f"{current_path}/{part}" if current_path else part
-        
-        encoded_path = urllib.parse.quote(current_path)
-        check_url = f"https://graph.microsoft.com/v1.0/me/drive/root:/{encoded_path}"
-        
-        resp = requests.get(check_url, headers=headers, timeout=30)
-        
-        if resp.status_code == 200:
-            continue
-        elif resp.status_code == 404:
-            print(f"📁 创建文件夹: {current_path}")
-            
-            if not parent_path:
-                create_url = "https://graph.microsoft.com/v1.0/me/drive/root/children"
-            else:
-                encoded_parent = urllib.parse.quote(parent_path)
-                create_url = f"https://graph.microsoft.com/v1.0/me/drive/root:/{encoded_parent}:/children"
-            
-            data = {
-                "name": part,
-                "folder": {},
-                "@microsoft.graph.conflictBehavior": "fail" 
-            }
-            
-            create_resp = requests.post(create_url, headers=headers, json=data, timeout=30)
-            
-            if create_resp.status_code == 409:
-                print(f"ℹ️  文件夹刚刚被创建: {current_path}")
-            elif create_resp.status_code not in [200, 201]:
-                print(f"❌ 创建文件夹失败: {create_resp.status_code} - {create_resp.text}")
-                exit(1)
-        else:
-            print(f"❌ 检查文件夹异常: {resp.status_code} - {resp.text}")
-            exit(1)
+# ========== 上传预览图 ==========
+def upload_preview(access_token, filename, image_info, previews, local_path=None):
+    """
+    生成并上传与原图对应的小尺寸 WebP 预览图到 Pictures/Unsplash/Preview。
+    安装了 Pillow 时在进程池里从本地副本生成，否则下载 Unsplash 服务端缩放的版本。
+    """
+    if previews.local and local_path:
+        data = previews.submit(local_path).result()
+    else:
+        resp = get_client().get(image_info["preview_url"], timeout=30)
+        if resp.status_code != 200:
+            raise RuntimeError(f"下载预览图失败: {resp.status_code}")
+        data = resp.content
+
+    folder_id = resolve_folder(access_token, PREVIEW_FOLDER)
+    preview_item = upload_small(access_token, preview_name(filename), data, folder_id, "image/webp")
+    record_preview(access_token, filename, preview_item)
+    print(f"🖼️  预览图已上传: {preview_item.get('name')} ({len(data) // 1024} KB)")
 
 
 # ========== 上传图片到 OneDrive ==========
-def upload_to_onedrive(access_token, image_data, image_info, content_type):
+async def upload_to_onedrive_async(access_token, image_stream, image_info, content_type, previews=None):
+    """
+    通过上传会话分片上传图片 (不受单次 PUT 的大小限制)，失败的分片单独重试。
+    previews 为 PreviewMaker 时同时生成并上传预览图。
+    返回上传后的 driveItem 和内容的 SHA-256。
+    """
     # 扩展名判断
     extension = '.jpg'
     if 'png' in content_type.lower(): extension = '.png'
@@ -189,61 +191,143 @@ def upload_to_onedrive(access_token, image_data, image_info, content_type):
     beijing_time = datetime.now(ZoneInfo("Asia/Shanghai"))
     filename = f"{beijing_time.strftime('%Y%m%d_%H%M%S')}_{image_info['id']}{extension}"
     
-    # 目标路径
+    # 目标目录 (每次运行只解析一次，之后按文件夹 ID 上传；解析带锁和磁盘缓存，在线程中执行)
     target_folder = "Pictures/Unsplash"
-    ensure_onedrive_folder(access_token, target_folder)
+    folder_id = await asyncio.to_thread(resolve_folder, access_token, target_folder)
     
-    # 构建完整的 OneDrive 路径并进行 URL 编码
-    full_path = f"{target_folder}/{filename}"
-    encoded_full_path = urllib.parse.quote(full_path)
-    
-    # 上传 URL
-    upload_url = f"https://graph.microsoft.com/v1.0/me/drive/root:/{encoded_full_path}:/content?@microsoft.graph.conflictBehavior=rename" 
-    
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/octet-stream" 
-    }
-    
-    print(f"⬆️  正在上传: {filename}")
-    resp = requests.put(upload_url, headers=headers, data=image_data, timeout=120)
-    
-    if resp.status_code not in [200, 201]:
-        print(f"❌ 上传失败: {resp.status_code}")
-        print(resp.text)
-        exit(1)
+    # 本地生成预览图时，边上传边把原图写入临时文件
+    local_copy = None
+    if previews and previews.local:
+        local_copy = tempfile.NamedTemporaryFile(suffix=extension, delete=False)
     
-    uploaded_name = resp.json().get('name', filename)
-    print(f"✅ 上传完成: {target_folder}/{uploaded_name}")
+    try:
+        print(f"⬆️  正在上传: {filename}")
+        try:
+            try:
+                # 重名时自动改名
+                item, sha256 = await upload_response_async(access_token, filename, image_stream,
+                                                           parent_id=folder_id, tee=local_copy)
+            except UploadSessionError as e:
+                # 缓存的文件夹 ID 已失效 (目录被删除或移动)：作废缓存后重新解析。
+                # 只处理创建上传会话时的 404：此时下载流还没有被读取，可以直接重试；
+                # 分片上传阶段的 404 (会话过期等) 时流已读过一部分，不能重试。
+                if e.status_code != 404:
+                    raise
+                await asyncio.to_thread(invalidate_folder, access_token, target_folder)
+                folder_id = await asyncio.to_thread(resolve_folder, access_token, target_folder)
+                item, sha256 = await upload_response_async(access_token, filename, image_stream,
+                                                           parent_id=folder_id, tee=local_copy)
+        finally:
+            image_stream.close()
+            if local_copy:
+                local_copy.close()
+        
+        # 内容与以前的图片完全相同 (不同 ID 的同一张图)：删除刚上传的副本，节省空间。
+        # 图片目录是 SQLite，查询和写入都在线程中执行
+        duplicate_of = await asyncio.to_thread(hash_owner, access_token, sha256)
+        await asyncio.to_thread(mark_seen, access_token, image_info['id'], sha256)
+        if duplicate_of and duplicate_of != image_info['id']:
+            await get_async_client().delete(f"me/drive/items/{item['id']}", access_token)
+            raise RuntimeError(f"内容与已有图片 {duplicate_of} 重复，已删除副本")
+        
+        uploaded_name = item.get('name', filename)
+        print(f"✅ 上传完成: {target_folder}/{uploaded_name} ({item.get('size', 0) // 1024} KB)")
+        
+        # 登记到本地图片目录，供 OneNote / SharePoint 按日期直接查询
+        await asyncio.to_thread(record_upload, access_token, item, image_info['id'])
+        
+        if previews:
+            try:
+                await asyncio.to_thread(upload_preview, access_token, uploaded_name, image_info, previews,
+                                        local_copy.name if local_copy else None)
+            except Exception as e:
+                # 预览图只是附加内容，失败不影响原图
+                print(f"⚠️  预览图生成失败: {e}")
+        return item, sha256
+    finally:
+        if local_copy:
+            os.unlink(local_copy.name)
+
+
+def upload_to_onedrive(access_token, image_stream, image_info, content_type, previews=None):
+    return aio.run(upload_to_onedrive_async(access_token, image_stream, image_info, content_type, previews))
+
+
+# ==============================================================================
+# 下载 / 上传流水线
+# ==============================================================================
+
+# ========== 并发处理图片列表 ==========
+async def process_images_async(access_token, image_list, download_workers=DOWNLOAD_WORKERS, upload_workers=UPLOAD_WORKERS):
+    """
+    asyncio 流水线：每张图片一个任务，下载流打开后立即进入上传，下载和上传互相重叠。
+    同时下载 / 上传的图片分别不超过 download_workers / upload_workers，
+    同时打开的下载流不超过两者之和。单张图片出错时打印并跳过，返回成功上传的数量。
+    """
+    slots = asyncio.Semaphore(download_workers + upload_workers)
+    downloads = asyncio.Semaphore(download_workers)
+    uploads = asyncio.Semaphore(upload_workers)
+    previews = PreviewMaker() if previews_enabled() else None
+
+    async def process(img):
+        async with slots:
+            try:
+                async with downloads:
+                    stream, ctype = await download_image_async(img["url"])
+            except Exception as e:
+                # 捕获异常，打印错误信息，然后继续处理下一张图片
+                print(f"⚠️  下载图片 {img['id']} 时发生错误，跳过该图片: {e}")
+                return False
+            try:
+                async with uploads:
+                    await upload_to_onedrive_async(access_token, stream, img, ctype, previews)
+                return True
+            except Exception as e:
+                print(f"⚠️  上传图片 {img['id']} 时发生错误，跳过该图片: {e}")
+                return False
+            finally:
+                stream.close()
+
+    try:
+        results = await asyncio.gather(*(process(img) for img in image_list))
+    finally:
+        if previews:
+            previews.close()
+    return sum(results)
+
+
+def process_images(access_token, image_list, download_workers=DOWNLOAD_WORKERS, upload_workers=UPLOAD_WORKERS):
+    return aio.run(process_images_async(access_token, image_list, download_workers, upload_workers))
 
 
 # ==============================================================================
 # 主执行逻辑
 # ==============================================================================
 
-if __name__ == "__main__":
-    print(f"⏰ {datetime.now(ZoneInfo('Asia/Shanghai'))} - 🚀 开始获取和上传 {IMAGE_COUNT} 张随机壁纸")
-    
+def run():
+    """获取随机壁纸并上传到 OneDrive，返回 (成功张数, 总张数)。"""
     # 1. 获取认证 token
-    token = get_access_token()
+    with phase("token"):
+        token = get_access_token()
     
     # 2. 获取随机壁纸列表
-    image_list = get_unsplash_wallpapers()
+    with phase("fetch"):
+        image_list = get_unsplash_wallpapers(lambda ids: known_photo_ids(token, ids))
     
-    # 3. 遍历列表，下载并上传每张图片
-    for i, img in enumerate(image_list):
-        print(f"\n--- 🏞️  处理第 {i + 1} / {len(image_list)} 张图片 (ID: {img['id']}) ---")
-        
-        try:
-            # 下载图片
-            data, ctype = download_image(img["url"])
+    # 3. 下载并上传每张图片 (下载与上传并发重叠)
+    with phase("create"):
+        succeeded = process_images(token, image_list)
             
-            # 上传到 OneDrive
-            upload_to_onedrive(token, data, img, ctype)
-            
-        except Exception as e:
-            # 捕获异常，打印错误信息，然后继续处理下一张图片
-            print(f"⚠️  处理图片 {img['id']} 时发生错误，跳过该图片: {e}")
-            continue
-            
-    print("\n🎉 任务结束")
\ No newline at end of file
+    print(f"\n🎉 任务结束：成功 {succeeded} / {len(image_list)} 张")
+    return succeeded, len(image_list)
+
+
+def main():
+    """脚本入口：开启统计后同步壁纸，返回 (成功张数, 总张数)。"""
+    metrics.install("unsplash_to_onedrive")
+    print(f"⏰ {datetime.now(ZoneInfo('Asia/Shanghai'))} - 🚀 开始获取和上传 {IMAGE_COUNT} 张随机壁纸")
+    return run()
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file